@@ -0,0 +1,111 @@
+"""
+基准脚本的公共部分：分位数统计、运行环境信息、JSON 结果的保存与两次结果的对比
+
+每个结果文件的格式：
+    {"benchmark": 名称, "created": 时间, "environment": {...}, "args": {...}, "runs": [{...}, ...]}
+runs 中每一项由 key 字段 (如 stage / batch 或 endpoint / rows / concurrency) 唯一确定，
+compare 按 key 匹配两次运行，比较延迟分位数 (越小越好) 与吞吐 (越大越好)。
+
+用法 (项目根目录):
+    python benchmarks/bench_common.py benchmarks/results/old.json benchmarks/results/new.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# 越小越好 / 越大越好的指标
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+HIGHER_IS_BETTER = ("throughput_rps", "rows_per_s")
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    """延迟 (秒) 列表 -> 毫秒分位数"""
+    if not len(seconds):
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+            "mean_ms": round(float(ms.mean()), 3), "max_ms": round(float(ms.max()), 3)}
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(name: str, runs: List[Dict[str, Any]], args: Dict[str, Any], out: str = None) -> str:
+    """保存为 JSON，默认 benchmarks/results/<name>-<时间>.json，返回路径"""
+    out = out or os.path.join(DEFAULT_RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"benchmark": name, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                   "environment": environment(), "args": args, "runs": runs}, f, indent=2, ensure_ascii=False)
+    print(f"✅ Results saved to {out}")
+    return out
+
+
+def run_key(run: Dict[str, Any]) -> tuple:
+    return tuple(sorted((k, v) for k, v in run.get("key", {}).items()))
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1) -> List[Dict[str, Any]]:
+    """按 key 匹配两次运行，返回每个指标的相对变化；regression 表示向变差方向超过 threshold"""
+    base_runs = {run_key(r): r for r in baseline["runs"]}
+    rows = []
+    for run in current["runs"]:
+        base = base_runs.get(run_key(run))
+        if base is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            old, new = base.get(metric), run.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            rows.append({"key": dict(run["key"]), "metric": metric, "baseline": old, "current": new,
+                         "change": round(change, 4), "regression": worse})
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定为退化的相对变化 (默认 10%%)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    for row in rows:
+        key = " ".join(f"{k}={v}" for k, v in row["key"].items())
+        mark = "❌" if row["regression"] else "  "
+        print(f"{mark} {key:<40} {row['metric']:<15} {row['baseline']:>12.3f} -> {row['current']:>12.3f} "
+              f"({row['change']:+.1%})")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"{len(rows)} metrics compared, {regressions} regressions (threshold {args.threshold:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Stacking 推理基准：原生 predict_proba 链路 vs compiled_ensemble 展平树引擎
+
+校验两者在全部样本上的概率差 (要求 < 1e-6)，并对比不同批量下的延迟。
+
+用法 (项目根目录):
+    python benchmarks/bench_ensemble.py --model-dir models --data kaggle/input/test.csv --rows 100000
+    python benchmarks/bench_ensemble.py --model-dir models          # 无数据文件时按词表随机采样
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.classifier_api as api  # noqa: E402
+from src.compiled_ensemble import CompiledEnsemble  # noqa: E402
+from bench_preprocess import make_records  # noqa: E402
+
+TOLERANCE = 1e-6
+
+
+def native_predict(X):
+    """优化前 /predict 中的推理链路 (含重复的元模型计算)"""
+    lgb_proba = api.lgb_model.predict_proba(X)[:, 1]
+    xgb_proba = api.xgb_model.predict_proba(X)[:, 1]
+    meta_features = np.column_stack([lgb_proba, xgb_proba])
+    return api.meta_model.predict_proba(meta_features)[:, 1], api.meta_model.predict(meta_features)
+
+
+def median_latency(fn, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--data", default=None, help="Kaggle test.csv 路径")
+    parser.add_argument("--rows", type=int, default=100000, help="参与校验的最大行数")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    api.lgb_model = joblib.load(os.path.join(args.model_dir, "lgb_model.pkl"))
+    api.xgb_model = joblib.load(os.path.join(args.model_dir, "xgb_model.pkl"))
+    api.meta_model = joblib.load(os.path.join(args.model_dir, "meta_model.pkl"))
+    api.label_encoders = joblib.load(os.path.join(args.model_dir, "label_encoders.pkl"))
+
+    start = time.perf_counter()
+    ensemble = CompiledEnsemble.from_models(api.lgb_model, api.xgb_model, api.meta_model)
+    print(f"export: {time.perf_counter() - start:.2f}s | lgb {ensemble.lgb.n_trees} trees "
+          f"(depth {ensemble.lgb.max_depth}), xgb {ensemble.xgb.n_trees} trees (depth {ensemble.xgb.max_depth})")
+
+    if args.data:
+        raw = pd.read_csv(args.data, nrows=args.rows)
+    else:
+        raw = pd.DataFrame(make_records(min(args.rows, 20000), np.random.default_rng(0)))
+    X = api.preprocess_data(raw)
+    X_np = X.to_numpy(dtype=np.float64)
+
+    expected_proba, expected_pred = native_predict(X)
+    proba, pred = ensemble.predict(X_np)
+    max_diff = float(np.abs(proba - expected_proba).max())
+    print(f"parity on {len(X)} rows: max |Δp| = {max_diff:.3e} "
+          f"({'OK' if max_diff < TOLERANCE else 'FAIL'}), "
+          f"class mismatches = {int((pred != expected_pred).sum())}")
+
+    print(f"{'batch':>8} | {'native (ms)':>12} | {'compiled (ms)':>13} | {'speedup':>8}")
+    for n in args.sizes:
+        if n > len(X):
+            break
+        repeat = args.repeat if n <= 1000 else 3
+        native = median_latency(native_predict, X.iloc[:n], repeat)
+        compiled = median_latency(ensemble.predict, X_np[:n], repeat)
+        print(f"{n:>8} | {native * 1e3:>12.2f} | {compiled * 1e3:>13.2f} | {native / compiled:>7.1f}x")
+
+    if max_diff >= TOLERANCE:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+preprocess_data 基准：逐行 apply 的旧编码逻辑 vs 查表向量化编码
+
+用法 (项目根目录):
+    python benchmarks/bench_preprocess.py --model-dir models --sizes 1 1000 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.classifier_api as api  # noqa: E402
+
+
+def legacy_preprocess(input_data):
+    """优化前的 preprocess_data 实现，仅用于对照"""
+    df = pd.DataFrame(input_data)
+    for col in api.feature_order:
+        if col not in df.columns:
+            df[col] = None
+    for col in api.numeric_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in api.categorical_cols:
+        le = api.label_encoders[col]
+        df[col] = df[col].astype(str)
+        df[col] = df[col].replace({'None': 'nan', 'nan': 'nan', '<NA>': 'nan'})
+        fallback_value = 'nan' if 'nan' in le.classes_ else le.classes_[0]
+        df[col] = df[col].apply(lambda x: x if x in le.classes_ else fallback_value)
+        df[col] = le.transform(df[col])
+    return df[api.feature_order]
+
+
+def make_records(n, rng):
+    """从真实词表中采样，混入 None 与未见过的类别"""
+    records = []
+    columns = {
+        col: np.append(api.label_encoders[col].classes_, [None, 'zz'])
+        for col in api.categorical_cols
+    }
+    for _ in range(n):
+        row = {col: values[rng.integers(len(values))] for col, values in columns.items()}
+        row.update({col: float(rng.uniform(0, 30)) for col in api.numeric_cols})
+        records.append(row)
+    return records
+
+
+def timeit(fn, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    api.label_encoders = joblib.load(os.path.join(args.model_dir, "label_encoders.pkl"))
+    rng = np.random.default_rng(42)
+
+    print(f"{'batch':>8} | {'legacy (ms)':>12} | {'lookup (ms)':>12} | {'speedup':>8}")
+    for n in args.sizes:
+        records = make_records(n, rng)
+        # 编码结果必须逐位一致
+        expected = legacy_preprocess(records)
+        actual = api.preprocess_data(records)
+        np.testing.assert_array_equal(
+            expected[api.categorical_cols].to_numpy(), actual[api.categorical_cols].to_numpy()
+        )
+
+        repeat = args.repeat if n <= 10000 else 1
+        legacy = timeit(legacy_preprocess, records, repeat)
+        lookup = timeit(api.preprocess_data, records, repeat)
+        print(f"{n:>8} | {legacy * 1e3:>12.2f} | {lookup * 1e3:>12.2f} | {legacy / lookup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
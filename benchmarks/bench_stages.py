@@ -0,0 +1,143 @@
+"""
+分类器各阶段的进程内微基准：preprocess_data、LightGBM / XGBoost / 元模型、compiled 引擎、端到端打分与 /explain 的逐特征贡献
+
+每个阶段在每个批量下重复执行 (至少 --min-time 秒或 --repeat 次)，记录延迟分位数与每行耗时，
+结果保存为 JSON，可用 bench_common.py 与之前的结果对比。
+
+用法 (项目根目录):
+    python benchmarks/bench_stages.py --model-dir models --sizes 1 10 100 1000 10000
+    python benchmarks/bench_stages.py --synthetic        # 没有完整模型文件时用合成数据训练同结构的模型
+    python benchmarks/bench_common.py old.json new.json  # 对比两次结果
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.classifier_api as api  # noqa: E402
+from src import explain  # noqa: E402
+from src.compiled_ensemble import CompiledEnsemble  # noqa: E402
+from bench_common import latency_summary, write_results  # noqa: E402
+from bench_preprocess import make_records  # noqa: E402
+
+
+def load_models(model_dir: str):
+    for name in ("lgb_model", "xgb_model", "meta_model", "label_encoders"):
+        setattr(api, name, joblib.load(os.path.join(model_dir, f"{name}.pkl")))
+
+
+def train_synthetic_models(rows: int = 20000, seed: int = 0):
+    """按真实词表 (无则用提示词中的取值) 生成数据，训练与线上结构相同的 LGB / XGB / LR"""
+    import lightgbm as lgb
+    import xgboost as xgb
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import LabelEncoder
+
+    if api.label_encoders is None:
+        from src.imgprocess_api import prompt
+        from src.vlm_output import schema_from_prompt
+
+        schema = schema_from_prompt(prompt)
+        api.label_encoders = {}
+        for col in api.categorical_cols:
+            api.label_encoders[col] = LabelEncoder().fit(np.asarray(sorted(schema[col]) + ["nan"], dtype=object))
+
+    rng = np.random.default_rng(seed)
+    X = api.preprocess_data(make_records(rows, rng))
+    logit = X["cap-diameter"] / 10 - X["stem-width"] / 15 + (X["cap-shape"] % 3) + (X["gill-color"] % 2) - 1.5
+    y = (logit + rng.normal(0, 0.5, rows) > 0).astype(int)
+    api.lgb_model = lgb.LGBMClassifier(n_estimators=100, num_leaves=63, verbosity=-1).fit(X, y)
+    api.xgb_model = xgb.XGBClassifier(n_estimators=200, max_depth=8).fit(X, y)
+    meta = np.column_stack([api.lgb_model.predict_proba(X)[:, 1], api.xgb_model.predict_proba(X)[:, 1]])
+    api.meta_model = LogisticRegression().fit(meta, y)
+
+
+def measure(fn: Callable[[], Any], repeat: int, min_time: float) -> List[float]:
+    fn()  # 预热
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < repeat or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        if len(timings) >= repeat * 50:
+            break
+    return timings
+
+
+def run_stages(sizes: List[int], repeat: int = 20, min_time: float = 0.2, seed: int = 42) -> List[Dict[str, Any]]:
+    """api 的模型与编码器需已加载；返回每个 (阶段, 批量) 的统计"""
+    ensemble = CompiledEnsemble.from_models(api.lgb_model, api.xgb_model, api.meta_model)
+    # 端到端打分不经过预测缓存，测的是每次都真正推理的耗时；引擎选择与服务相同 (小批量走 compiled)
+    previous_cache, api.prediction_cache = api.prediction_cache, None
+    previous_compiled = api.compiled_ensemble
+    if api.compiled_ensemble is None and api.INFERENCE_ENGINE != "native":
+        api.compiled_ensemble = ensemble
+    rng = np.random.default_rng(seed)
+    runs = []
+    try:
+        for n in sizes:
+            records = make_records(n, rng)
+            X = api.preprocess_data(records)
+            X_np = X.to_numpy(dtype=np.float64)
+            lgb_p = api.lgb_model.predict_proba(X)[:, 1]
+            xgb_p = api.xgb_model.predict_proba(X)[:, 1]
+            meta = np.column_stack([lgb_p, xgb_p])
+            stages = {
+                "preprocess": lambda: api.preprocess_data(records),
+                "lgb": lambda: api.lgb_model.predict_proba(X),
+                "xgb": lambda: api.xgb_model.predict_proba(X),
+                "meta": lambda: api.meta_model.predict_proba(meta),
+                "compiled": lambda: ensemble.predict(X_np),
+                "end_to_end": lambda: api.score_payloads([records]),
+                "explain": lambda: explain.explain(api.lgb_model, api.xgb_model, api.meta_model, X),
+            }
+            for stage, fn in stages.items():
+                timings = measure(fn, repeat if n <= 1000 else max(3, repeat // 5), min_time)
+                summary = latency_summary(timings)
+                runs.append({
+                    "key": {"stage": stage, "batch": n},
+                    "iterations": len(timings),
+                    **summary,
+                    "us_per_row": round(summary["p50_ms"] * 1000 / n, 3),
+                    "rows_per_s": round(n / (summary["p50_ms"] / 1000), 1),
+                })
+    finally:
+        api.prediction_cache = previous_cache
+        api.compiled_ensemble = previous_compiled
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--synthetic", action="store_true", help="用合成数据训练模型 (仍使用已有的 label_encoders)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--min-time", type=float, default=0.2, help="每个阶段 / 批量至少测量的秒数")
+    parser.add_argument("--out", default=None, help="结果 JSON 路径，默认 benchmarks/results/stages-<时间>.json")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        path = os.path.join(args.model_dir, "label_encoders.pkl")
+        api.label_encoders = joblib.load(path) if os.path.exists(path) else None
+        train_synthetic_models()
+    else:
+        load_models(args.model_dir)
+
+    runs = run_stages(args.sizes, args.repeat, args.min_time)
+    print(f"{'stage':>10} | {'batch':>6} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'p99 (ms)':>9} | {'µs/row':>8}")
+    for run in runs:
+        print(f"{run['key']['stage']:>10} | {run['key']['batch']:>6} | {run['p50_ms']:>9.3f} | "
+              f"{run['p95_ms']:>9.3f} | {run['p99_ms']:>9.3f} | {run['us_per_row']:>8.2f}")
+    write_results("stages", runs, vars(args), args.out)
+
+
+if __name__ == "__main__":
+    main()
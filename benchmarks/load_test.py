@@ -0,0 +1,242 @@
+"""
+HTTP 压测：以固定并发 (闭环，每个并发槽收到响应后立即发下一个请求) 驱动分类器或视觉服务，
+记录 p50 / p95 / p99 延迟、吞吐与错误数，结果保存为 JSON (可用 bench_common.py 对比)
+
+- predict：POST /predict (rows，按行 JSON) / /predict/columnar (columnar) / /predict/stream (ndjson)，
+  每个请求 --rows 行；样本取自 --data (Kaggle test.csv) 或按提示词中的取值随机生成。
+  请求体预先序列化 (最多 64 个轮流发送)，重复的行会命中服务端预测缓存；
+  要测量每次都真正推理的延迟，启动服务时设置 PREDICTION_CACHE_SIZE=0
+- analyze-image：POST /analyze-image，请求体为 --image 的原始字节 (image/jpeg)；
+  --unique 时每个请求改动一个像素，绕过 VLM 结果缓存。离线时让视觉服务指向 stub：
+      python benchmarks/stub_vlm_server.py --port 1234 --latency 0.5
+      LM_STUDIO_BASE_URL=http://127.0.0.1:1234/v1 python src/imgprocess_api.py
+
+--concurrency 与 --rows 可给多个值，逐一组合运行。
+
+用法 (项目根目录):
+    python benchmarks/load_test.py predict --url http://127.0.0.1:8000 --concurrency 1 8 32 --rows 1 100 --requests 500
+    python benchmarks/load_test.py predict --shape ndjson --rows 10000 --concurrency 2 --duration 20
+    python benchmarks/load_test.py analyze-image --url http://127.0.0.1:8001 --image img/1.jpg --concurrency 1 4 --unique
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import mimetypes
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_common import latency_summary, write_results  # noqa: E402
+
+PREDICT_PATHS = {"rows": "/predict", "columnar": "/predict/columnar", "ndjson": "/predict/stream"}
+
+# build(i) -> (path, httpx 请求参数)
+RequestBuilder = Callable[[int], Tuple[str, Dict[str, Any]]]
+
+
+# ----------------------------
+# 1. 请求体
+# ----------------------------
+def sample_records(n: int, data: Optional[str] = None, seed: int = 0) -> List[Dict[str, Any]]:
+    """从 CSV 读取前 n 行，或按提示词中每个字段的取值 (含 null) 随机生成"""
+    if data:
+        import pandas as pd
+
+        df = pd.read_csv(data, nrows=n)
+        return json.loads(df.to_json(orient="records"))
+    from src.imgprocess_api import prompt
+    from src.vlm_output import schema_from_prompt
+
+    rng = np.random.default_rng(seed)
+    schema = schema_from_prompt(prompt)
+    records = []
+    for i in range(n):
+        row = {"id": i}
+        for col, allowed in schema.items():
+            if allowed is None:
+                row[col] = round(float(rng.uniform(1, 20)), 2)
+            else:
+                values = sorted(allowed) + [None]
+                row[col] = values[rng.integers(len(values))]
+        records.append(row)
+    return records
+
+
+def predict_requests(records: List[Dict[str, Any]], rows: int, shape: str = "rows") -> RequestBuilder:
+    """预先序列化若干个不同的请求体 (轮流使用)，压测时不在客户端做 JSON 编码"""
+    path = PREDICT_PATHS[shape]
+    bodies = []
+    for start in range(0, max(len(records) - rows, 0) + 1, max(rows, 1)):
+        chunk = records[start:start + rows]
+        if len(chunk) < rows:  # 样本不足时循环复用
+            chunk = list(itertools.islice(itertools.cycle(records), start, start + rows))
+        if shape == "rows":
+            bodies.append((json.dumps(chunk).encode(), "application/json"))
+        elif shape == "columnar":
+            columns = {key: [r.get(key) for r in chunk] for key in chunk[0]}
+            bodies.append((json.dumps(columns).encode(), "application/json"))
+        else:
+            bodies.append(("\n".join(json.dumps(r) for r in chunk).encode(), "application/x-ndjson"))
+        if len(bodies) >= 64:
+            break
+
+    def build(i: int):
+        content, content_type = bodies[i % len(bodies)]
+        return path, {"content": content, "headers": {"Content-Type": content_type}}
+
+    return build
+
+
+def image_requests(image: bytes, unique: bool = False, variants: int = 256,
+                   content_type: str = "image/jpeg") -> RequestBuilder:
+    """原始图片字节；unique 时预先生成 variants 个各改动一个像素的 JPEG，避免命中 VLM 结果缓存"""
+    bodies = [image]
+    if unique:
+        content_type = "image/jpeg"
+        from PIL import Image
+
+        with Image.open(io.BytesIO(image)) as img:
+            base = img.convert("RGB")
+        bodies = []
+        for k in range(variants):
+            img = base.copy()
+            img.putpixel((k % img.width, (k // img.width) % img.height), (k % 256, 255 - k % 256, 0))
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=95)
+            bodies.append(buf.getvalue())
+
+    def build(i: int):
+        return "/analyze-image", {"content": bodies[i % len(bodies)], "headers": {"Content-Type": content_type}}
+
+    return build
+
+
+# ----------------------------
+# 2. 负载生成
+# ----------------------------
+async def run_load(base_url: str, build: RequestBuilder, concurrency: int, requests: Optional[int] = None,
+                   duration: Optional[float] = None, warmup: int = 0, timeout: float = 60.0,
+                   rows_per_request: int = 1,
+                   transport: Optional[httpx.AsyncBaseTransport] = None) -> Dict[str, Any]:
+    """
+    concurrency 个协程各自循环发送请求，直到共发出 requests 个或超过 duration 秒。
+    先发送 warmup 个请求 (不计入统计)。只统计 2xx 响应的延迟
+    """
+    if requests is None and duration is None:
+        requests = 100
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = itertools.count()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, transport=transport) as http:
+        async def send(i: int) -> Tuple[Optional[int], float]:
+            path, kwargs = build(i)
+            start = time.perf_counter()
+            try:
+                response = await http.post(path, **kwargs)
+                await response.aread()
+                return response.status_code, time.perf_counter() - start
+            except httpx.HTTPError as e:
+                return type(e).__name__, time.perf_counter() - start
+
+        for i in range(warmup):
+            await send(i)
+
+        deadline = time.perf_counter() + duration if duration else None
+
+        async def worker():
+            while True:
+                i = next(counter)
+                if (requests is not None and i >= requests) or (deadline and time.perf_counter() >= deadline):
+                    return
+                status, elapsed = await send(warmup + i)
+                statuses[status] += 1
+                if isinstance(status, int) and 200 <= status < 300:
+                    latencies.append(elapsed)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    total = sum(statuses.values())
+    return {
+        "requests": total,
+        "ok": len(latencies),
+        "errors": {str(k): v for k, v in statuses.items() if not (isinstance(k, int) and 200 <= k < 300)},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "rows_per_s": round(len(latencies) * rows_per_request / elapsed, 1) if elapsed else 0.0,
+        **latency_summary(latencies),
+    }
+
+
+def print_run(run: Dict[str, Any]):
+    key = " ".join(f"{k}={v}" for k, v in run["key"].items())
+    errors = sum(run["errors"].values())
+    print(f"{key:<45} | {run['throughput_rps']:>8.1f} req/s | p50 {run['p50_ms'] or 0:>8.2f} | "
+          f"p95 {run['p95_ms'] or 0:>8.2f} | p99 {run['p99_ms'] or 0:>8.2f} ms | errors {errors}")
+
+
+async def run_grid(args) -> List[Dict[str, Any]]:
+    runs = []
+    if args.target == "predict":
+        records = sample_records(max(args.rows) * 4, args.data)
+        grid = [(rows, c) for rows in args.rows for c in args.concurrency]
+    else:
+        with open(args.image, "rb") as f:
+            image = f.read()
+        grid = [(1, c) for c in args.concurrency]
+    for rows, concurrency in grid:
+        if args.target == "predict":
+            build = predict_requests(records, rows, args.shape)
+            key = {"endpoint": PREDICT_PATHS[args.shape], "rows": rows, "concurrency": concurrency}
+        else:
+            build = image_requests(image, args.unique,
+                                   content_type=mimetypes.guess_type(args.image)[0] or "image/jpeg")
+            key = {"endpoint": "/analyze-image", "unique": args.unique, "concurrency": concurrency}
+        result = await run_load(args.url, build, concurrency, args.requests, args.duration, args.warmup,
+                                args.timeout, rows)
+        runs.append({"key": key, **result})
+        print_run(runs[-1])
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", choices=("predict", "analyze-image"))
+    parser.add_argument("--url", default=None, help="服务地址，默认 predict 为 :8000，analyze-image 为 :8001")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=None, help="每组发送的请求数 (默认 200)")
+    parser.add_argument("--duration", type=float, default=None, help="每组持续的秒数 (代替 --requests)")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100], help="predict：每个请求的行数")
+    parser.add_argument("--shape", choices=tuple(PREDICT_PATHS), default="rows", help="predict：请求格式")
+    parser.add_argument("--data", default=None, help="predict：样本 CSV (Kaggle test.csv)")
+    parser.add_argument("--image", default=None, help="analyze-image：图片路径")
+    parser.add_argument("--unique", action="store_true", help="analyze-image：每个请求使用不同的图片，绕过缓存")
+    parser.add_argument("--out", default=None, help="结果 JSON 路径，默认 benchmarks/results/<target>-<时间>.json")
+    args = parser.parse_args(argv)
+
+    if args.target == "analyze-image" and not args.image:
+        parser.error("analyze-image requires --image")
+    args.url = args.url or ("http://127.0.0.1:8000" if args.target == "predict" else "http://127.0.0.1:8001")
+    if args.requests is None and args.duration is None:
+        args.requests = 200
+
+    runs = asyncio.run(run_grid(args))
+    write_results(args.target, runs, vars(args), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+本地 OpenAI 兼容的 VLM stub：代替 LM Studio 测试 / 压测视觉服务与批量接口
+
+- POST /v1/chat/completions：按图片内容确定性地生成 20 个特征的 JSON (同一张图片结果相同)，
+  支持 stream=true (SSE，JSON 之后追加一段说明文字，用于观察提前结束的效果)
+- 可配置首 token 延迟、每 token 延迟、随机 503 失败率与并发上限 (超出时返回 503)
+- GET /stats 返回调用次数、被拒次数、最大并发与实际发出的 token 数
+
+用法 (项目根目录):
+    python benchmarks/stub_vlm_server.py --port 1234 --latency 0.5 --token-delay 0.01 --fail-rate 0.1
+    # 然后让视觉服务指向它：LM_STUDIO_BASE_URL=http://127.0.0.1:1234/v1 python src/imgprocess_api.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.imgprocess_api import prompt  # noqa: E402
+from src.vlm_output import schema_from_prompt  # noqa: E402
+
+TRAILING = "\n\n说明：以上特征根据图片中可见的菌盖、菌褶与菌柄推断，部分特征无法从照片中确认。" * 4
+
+
+def image_features(body: dict, schema: dict) -> dict:
+    """按请求中的图片 data URL 的哈希确定性地选取每个字段的取值"""
+    content = body["messages"][-1]["content"]
+    url = next((part["image_url"]["url"] for part in content if part.get("type") == "image_url"), "")
+    rng = random.Random(hashlib.sha256(url.encode()).digest())
+    features = {}
+    for key, allowed in schema.items():
+        if allowed is None:
+            features[key] = round(rng.uniform(1, 20), 1)
+        else:
+            features[key] = rng.choice(sorted(allowed) + [None])
+    return features
+
+
+def create_app(latency: float = 0.2, token_delay: float = 0.0, fail_rate: float = 0.0,
+               max_concurrency: int = 0, seed: int = 0) -> FastAPI:
+    schema = schema_from_prompt(prompt)
+    rng = random.Random(seed)
+    state = {"calls": 0, "rejected": 0, "failed": 0, "active": 0, "peak": 0, "tokens_sent": 0}
+    app = FastAPI(title="Stub VLM")
+    app.state.stats = state
+
+    def completion(text: str) -> dict:
+        return {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": "stub-vlm",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        }
+
+    def chunk(text: str) -> bytes:
+        return ("data: " + json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": "stub-vlm", "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+        }, ensure_ascii=False) + "\n\n").encode("utf-8")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state["calls"] += 1
+        if max_concurrency and state["active"] >= max_concurrency:
+            state["rejected"] += 1
+            return JSONResponse({"error": {"message": "Model is busy"}}, status_code=503)
+        if fail_rate and rng.random() < fail_rate:
+            state["failed"] += 1
+            return JSONResponse({"error": {"message": "Injected failure"}}, status_code=503)
+
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        text = "```json\n" + json.dumps(image_features(body, schema), indent=2) + "\n```"
+        streaming = False
+        try:
+            await asyncio.sleep(latency)
+            full = text + TRAILING
+            if not body.get("stream"):
+                await asyncio.sleep(token_delay * len(full) / 4)
+                state["tokens_sent"] += len(full) // 4
+                return completion(full)
+
+            async def events():
+                try:
+                    for i in range(0, len(full), 4):
+                        if token_delay:
+                            await asyncio.sleep(token_delay)
+                        state["tokens_sent"] += 1
+                        yield chunk(full[i:i + 4])
+                    yield b"data: [DONE]\n\n"
+                finally:
+                    state["active"] -= 1
+
+            streaming = True
+            return StreamingResponse(events(), media_type="text/event-stream")
+        finally:
+            if not streaming:  # 流式响应在 events() 结束 (或客户端断开) 时再减计数
+                state["active"] -= 1
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "stub-vlm", "object": "model"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return state
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--latency", type=float, default=0.2, help="首 token 前的延迟 (秒)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="每个 token 的生成间隔 (秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机返回 503 的比例")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="并发上限，超出返回 503 (0 表示不限)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(args.latency, args.token_delay, args.fail_rate, args.max_concurrency, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,22 @@ if %ERRORLEVEL% neq 0 (
 
 echo [信息] 正在启动各服务组件...
 
+REM 合并模式：run_services.bat fused —— 分类器与 VLM 服务在同一进程中运行 (端口 8000)
+if /I "%~1"=="fused" (
+    echo - 正在新窗口启动合并服务...
+    start "Mushroom - Fused API" cmd /k "python src\fused_app.py"
+    echo - 正在新窗口启动 Streamlit 前端...
+    start "Mushroom - Frontend" cmd /k "set VLM_API_URL=http://127.0.0.1:8000/vlm/analyze-image&& set CLASSIFIER_API_URL=http://127.0.0.1:8000/classifier/predict&& streamlit run src\front.py"
+    echo.
+    echo [成功] 合并服务已尝试启动！
+    echo ------------------------------------------
+    echo 合并服务地址:    http://127.0.0.1:8000  ^(/classifier, /vlm, /analyze-and-predict^)
+    echo 前端界面地址:    http://127.0.0.1:8501
+    echo ------------------------------------------
+    pause >nul
+    exit /b
+)
+
 REM 启动分类器 API (端口 8000)
 echo - 正在新窗口启动分类器 API...
 start "Mushroom - Classifier API" cmd /k "python src\classifier_api.py"
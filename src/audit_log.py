@@ -0,0 +1,353 @@
+"""
+预测审计日志：记录每一条预测的输入特征、概率、类别、模型版本与打分耗时，用于漂移分析与事故复盘
+
+打分线程只把结果的引用放进内存缓冲区 (一次加锁的 append)，序列化、压缩与写盘都由后台线程按批完成，
+请求路径上没有磁盘 I/O。缓冲区按行数限长，满时按策略丢弃 (drop，默认) 或阻塞等待 (block)。
+
+    <AUDIT_DIR>/
+        audit-20260301-120000-4242-0001.ndjson.gz        已完成的分段
+        audit-20260301-121500-4242-0002.ndjson.gz.part   正在写入的分段 (每个进程一个)
+
+每行一条预测: {"ts", "version", "source", "latency_ms", "features": {...}, "proba", "pred"}
+(已编码的特征矩阵另有 "encoded": true)。分段按压缩后大小或时长轮转，只保留最近 max_segments 个。
+
+用法 (项目根目录):
+    python src/audit_log.py summary --dir cache/audit
+    python src/audit_log.py replay --dir cache/audit [--limit 100000]   # 用当前模型重放并对比概率
+"""
+import argparse
+import collections
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+AUDIT_GLOB_SUFFIX = ".ndjson.gz"
+PART_SUFFIX = ".part"
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _clean(value):
+    """NaN 写成 null，保证每一行都是标准 JSON"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _rows(features) -> List[Dict[str, Any]]:
+    if hasattr(features, "to_dict"):
+        return features.to_dict(orient="records")
+    return list(features)
+
+
+# ----------------------------
+# 1. 写入
+# ----------------------------
+class AuditLog:
+    """
+    record() 可在任意线程中调用；start() 启动后台写入线程，close() 写完缓冲区并关闭当前分段。
+    policy="drop" 时缓冲区满则丢弃该批并计数；"block" 时最多等待 block_timeout 秒 (None 为一直等待)
+    """
+
+    def __init__(self, directory: str, max_rows: int = 100000, flush_rows: int = 5000,
+                 flush_interval: float = 1.0, segment_max_bytes: int = 64 * 1024 * 1024,
+                 segment_max_seconds: float = 3600.0, max_segments: int = 0, policy: str = "drop",
+                 block_timeout: Optional[float] = 5.0, compresslevel: int = 6):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown audit log policy: {policy}")
+        self.directory = directory
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.max_segments = max_segments
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.compresslevel = compresslevel
+        self._buffer = collections.deque()
+        self._pending_rows = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._segment = None
+        self._seq = 0
+        self.rows_queued = 0
+        self.rows_dropped = 0
+        self.rows_written = 0
+        self.segments_written = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.errors = 0
+
+    # ---------- 生产者 ----------
+    def record(self, features, proba, pred, version: Optional[str] = None, source: str = "predict",
+               latency_ms: Optional[float] = None, encoded: bool = False) -> bool:
+        """
+        记录一批预测 (features 为 List[Dict] 或 DataFrame，与 proba / pred 逐行对应)。
+        只保存引用，调用方之后不能再修改这些对象。写入缓冲区返回 True，被丢弃返回 False
+        """
+        rows = len(proba)
+        entry = (time.time(), features, proba, pred, version, source, latency_ms, encoded, rows)
+        with self._cond:
+            if self._closed:
+                return False
+            # 单批超过容量时只要缓冲区为空也接受，否则它永远写不进去
+            fits = lambda: self._pending_rows == 0 or self._pending_rows + rows <= self.max_rows  # noqa: E731
+            if not fits():
+                if self.policy == "drop" or not self._cond.wait_for(lambda: fits() or self._closed,
+                                                                     self.block_timeout) or self._closed:
+                    self.rows_dropped += rows
+                    return False
+            self._buffer.append(entry)
+            self._pending_rows += rows
+            self.rows_queued += rows
+            if self._pending_rows >= self.flush_rows:
+                self._cond.notify_all()
+        return True
+
+    # ---------- 后台写入 ----------
+    def start(self) -> "AuditLog":
+        self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, timeout: Optional[float] = 30.0):
+        """写完缓冲区中的全部记录并完成当前分段"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        else:
+            self._drain()
+            self._finish_segment()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._pending_rows >= self.flush_rows,
+                                    self.flush_interval)
+                closing = self._closed
+            self._drain()
+            if closing:
+                self._finish_segment()
+                return
+            if self._segment is not None and time.time() - self._segment["opened"] >= self.segment_max_seconds:
+                self._finish_segment()
+
+    def _drain(self):
+        with self._cond:
+            batch = list(self._buffer)
+            self._buffer.clear()
+            self._pending_rows = 0
+            self._cond.notify_all()  # 唤醒 block 策略下等待的生产者
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            self._write(batch)
+        except Exception as e:  # 审计日志写失败不能影响预测服务
+            self.errors += 1
+            self.rows_dropped += sum(entry[-1] for entry in batch)
+            print(f"⚠️ Audit log write failed: {e}")
+        self.flushes += 1
+        self.flush_seconds += time.perf_counter() - start
+
+    def _write(self, batch):
+        lines = []
+        for ts, features, proba, pred, version, source, latency_ms, encoded, _ in batch:
+            meta = {
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts)) + f".{int(ts * 1000) % 1000:03d}",
+                "version": version,
+                "source": source,
+                "latency_ms": None if latency_ms is None else round(latency_ms, 3),
+            }
+            if encoded:
+                meta["encoded"] = True
+            for row, p, c in zip(_rows(features), np.asarray(proba).tolist(), np.asarray(pred).tolist()):
+                line = dict(meta, features={k: _clean(v) for k, v in row.items()}, proba=p, pred=c)
+                lines.append(json.dumps(line, ensure_ascii=False, default=_json_default))
+        segment = self._open_segment()
+        segment["gzip"].write(("\n".join(lines) + "\n").encode("utf-8"))
+        # 同步刷新：读取方可以读到 .part 中已刷新的部分
+        segment["gzip"].flush()
+        self.rows_written += len(lines)
+        if segment["file"].tell() >= self.segment_max_bytes:
+            self._finish_segment()
+
+    # ---------- 分段 ----------
+    def _open_segment(self):
+        if self._segment is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._seq += 1
+            name = f"audit-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._seq:04d}{AUDIT_GLOB_SUFFIX}"
+            path = os.path.join(self.directory, name)
+            raw = open(path + PART_SUFFIX, "wb")
+            self._segment = {"path": path, "file": raw, "opened": time.time(),
+                             "gzip": gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.compresslevel)}
+        return self._segment
+
+    def _finish_segment(self):
+        segment, self._segment = self._segment, None
+        if segment is None:
+            return
+        segment["gzip"].close()
+        segment["file"].close()
+        os.replace(segment["path"] + PART_SUFFIX, segment["path"])
+        self.segments_written += 1
+        if self.max_segments > 0:
+            for path in segments(self.directory)[:-self.max_segments]:
+                os.remove(path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "policy": self.policy,
+            "buffered_rows": self._pending_rows,
+            "max_rows": self.max_rows,
+            "rows_queued": self.rows_queued,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "segments_written": self.segments_written,
+            "flushes": self.flushes,
+            "avg_flush_ms": self.flush_seconds * 1000 / self.flushes if self.flushes else 0.0,
+            "errors": self.errors,
+        }
+
+
+# ----------------------------
+# 2. 读取与重放
+# ----------------------------
+def segments(directory: str, include_partial: bool = False) -> List[str]:
+    """按时间顺序列出分段 (文件名以创建时间开头)"""
+    if not os.path.isdir(directory):
+        return []
+    names = [n for n in os.listdir(directory) if n.startswith("audit-") and (
+        n.endswith(AUDIT_GLOB_SUFFIX) or (include_partial and n.endswith(AUDIT_GLOB_SUFFIX + PART_SUFFIX)))]
+    return [os.path.join(directory, n) for n in sorted(names)]
+
+
+def iter_records(directory: str, include_partial: bool = False) -> Iterator[Dict[str, Any]]:
+    """逐行读取审计记录；include_partial=True 时也读取正在写入的分段中已刷新的部分"""
+    for path in segments(directory, include_partial):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except EOFError:  # .part 尚未写完的尾部
+            if not path.endswith(PART_SUFFIX):
+                raise
+
+
+def summary(directory: str, include_partial: bool = False) -> Dict[str, Any]:
+    rows, versions, sources, poisonous = 0, collections.Counter(), collections.Counter(), 0
+    first = last = None
+    for record in iter_records(directory, include_partial):
+        rows += 1
+        versions[record.get("version")] += 1
+        sources[record.get("source")] += 1
+        poisonous += record["pred"] == 1
+        first = first or record["ts"]
+        last = record["ts"]
+    return {"segments": len(segments(directory, include_partial)), "rows": rows, "first": first, "last": last,
+            "versions": dict(versions), "sources": dict(sources),
+            "poisonous_fraction": poisonous / rows if rows else 0.0}
+
+
+def replay(directory: str, models=None, chunk_rows: int = 10000, tolerance: float = 1e-6,
+           limit: Optional[int] = None, include_partial: bool = False) -> Dict[str, Any]:
+    """
+    用当前模型 (默认按 MODEL_DIR / CURRENT 加载) 重新打分日志中的输入，按记录时的模型版本汇总
+    与记录概率的最大 / 平均差、超过 tolerance 的行数与类别翻转数，用于发布前的回归检查
+    """
+    try:
+        import src.classifier_api as api
+    except ImportError:
+        import classifier_api as api
+
+    import pandas as pd
+
+    if models is None:
+        api.load_models()
+        models = api.current_models()
+    report: Dict[str, Dict[str, Any]] = {}
+    pending = {False: [], True: []}
+
+    def score(encoded):
+        records = pending[encoded]
+        if not records:
+            return
+        features = [r["features"] for r in records]
+        if encoded:
+            X = pd.DataFrame(features, columns=api.feature_order).astype(np.float64)
+        else:
+            X = api.preprocess_data(features, models.feature_encoder)
+        proba, pred = api.run_ensemble(X, models)
+        diff = np.abs(np.asarray(proba, dtype=np.float64) - np.array([r["proba"] for r in records], dtype=np.float64))
+        flipped = np.asarray(pred) != np.array([r["pred"] for r in records])
+        for r, d, f in zip(records, diff.tolist(), flipped.tolist()):
+            v = report.setdefault(str(r.get("version")), {"rows": 0, "max_abs_diff": 0.0, "sum_abs_diff": 0.0,
+                                                          "over_tolerance": 0, "flipped": 0})
+            v["rows"] += 1
+            v["max_abs_diff"] = max(v["max_abs_diff"], d)
+            v["sum_abs_diff"] += d
+            v["over_tolerance"] += d > tolerance
+            v["flipped"] += f
+        records.clear()
+
+    for i, record in enumerate(iter_records(directory, include_partial)):
+        if limit is not None and i >= limit:
+            break
+        encoded = bool(record.get("encoded"))
+        pending[encoded].append(record)
+        if len(pending[encoded]) >= chunk_rows:
+            score(encoded)
+    score(False)
+    score(True)
+
+    for v in report.values():
+        v["mean_abs_diff"] = v.pop("sum_abs_diff") / v["rows"]
+    return {"model_version": models.version, "tolerance": tolerance, "by_logged_version": report,
+            "rows": sum(v["rows"] for v in report.values()),
+            "over_tolerance": sum(v["over_tolerance"] for v in report.values()),
+            "flipped": sum(v["flipped"] for v in report.values())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("summary", "统计分段、行数、模型版本与来源"), ("replay", "用当前模型重放并对比概率")):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("--dir", default=os.getenv("AUDIT_DIR", os.path.join("cache", "audit")))
+        cmd.add_argument("--include-partial", action="store_true", help="同时读取正在写入的 .part 分段")
+    replay_cmd = sub.choices["replay"]
+    replay_cmd.add_argument("--limit", type=int, default=None, help="最多重放的行数")
+    replay_cmd.add_argument("--chunk-rows", type=int, default=10000)
+    replay_cmd.add_argument("--tolerance", type=float, default=1e-6)
+    args = parser.parse_args(argv)
+
+    if args.command == "summary":
+        print(json.dumps(summary(args.dir, args.include_partial), indent=2, ensure_ascii=False))
+        return 0
+    result = replay(args.dir, chunk_rows=args.chunk_rows, tolerance=args.tolerance, limit=args.limit,
+                    include_partial=args.include_partial)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    # 有行超出容差时返回非零，便于在发布流程中作为回归检查
+    return 1 if result["over_tolerance"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
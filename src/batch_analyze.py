@@ -0,0 +1,208 @@
+"""
+批量图片特征提取：把一批图片以有界并发分发给 VLM (失败重试 + 指数退避)，结果按完成顺序以 NDJSON 输出，
+可选地把全部特征合并成一次 /predict 调用交给分类器
+
+imgprocess_api.py 的 POST /analyze-images 与本文件的命令行共用 fan_out / predict_rows；
+命令行在进程内直接调用 LM Studio (与服务相同的预处理、缓存与 schema 校验)，不需要先启动视觉服务。
+
+用法 (项目根目录):
+    python src/batch_analyze.py img/ --concurrency 4 --output img_features.ndjson
+    python src/batch_analyze.py img/ --predict --classifier-url http://127.0.0.1:8000/predict
+    # 不接 LM Studio 时可先启动本地 stub：python benchmarks/stub_vlm_server.py --port 1234
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+# 这些状态码视为暂时性失败 (排队已满、超时、VLM 连接或输出异常)，可以重试
+RETRY_STATUS = (500, 502, 503, 504)
+
+
+@dataclass
+class ImageItem:
+    index: int
+    name: str
+    data: Optional[bytes] = None
+    path: Optional[str] = None  # 目录模式下延迟到真正处理时才读取文件
+    image_base64: Optional[str] = None
+
+    def read(self) -> bytes:
+        if self.data is None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        return self.data
+
+
+def list_images(directory: str) -> List[ImageItem]:
+    names = sorted(n for n in os.listdir(directory)
+                   if n.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(directory, n)))
+    return [ImageItem(i, name, path=os.path.join(directory, name)) for i, name in enumerate(names)]
+
+
+# ----------------------------
+# 1. 有界并发分发 + 重试
+# ----------------------------
+async def analyze_with_retry(item: ImageItem, analyze: Callable[..., Awaitable[Any]],
+                             retries: int, backoff: float) -> Dict[str, Any]:
+    """
+    调用 analyze(data, image_base64) 处理单张图片。analyze 抛出带 status_code 的异常
+    (HTTPException) 且状态码可重试时，按 backoff * 2^n (含随机抖动) 等待后重试
+    """
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"index": item.index, "name": item.name}
+    for attempt in range(1, retries + 2):
+        try:
+            data = await asyncio.to_thread(item.read)
+            extraction = await analyze(data, item.image_base64)
+        except OSError as e:
+            result.update(status="error", status_code=400, error=str(e))
+            break
+        except Exception as e:
+            status_code = getattr(e, "status_code", 500)
+            result.update(status="error", status_code=status_code, error=str(getattr(e, "detail", e)))
+            if status_code in RETRY_STATUS and attempt <= retries:
+                await asyncio.sleep(backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+                continue
+            break
+        result.update(status="ok", features=extraction.features, cache=extraction.cache,
+                      vlm_ms=extraction.vlm_ms, image=extraction.prepared.headers())
+        result.pop("error", None)
+        result.pop("status_code", None)
+        break
+    result["attempts"] = attempt
+    result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+async def fan_out(items: List[ImageItem], analyze: Callable[..., Awaitable[Any]], concurrency: int = 2,
+                  retries: int = 2, backoff: float = 0.5) -> AsyncIterator[Dict[str, Any]]:
+    """
+    最多 concurrency 张图片同时处理，结果按完成顺序产出。
+    消费方提前停止 (如客户端断开) 时取消尚未完成的任务
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+    done: asyncio.Queue = asyncio.Queue()
+
+    async def worker(item: ImageItem):
+        async with slots:
+            result = await analyze_with_retry(item, analyze, retries, backoff)
+        await done.put(result)
+
+    tasks = [asyncio.create_task(worker(item)) for item in items]
+    try:
+        for _ in items:
+            yield await done.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ----------------------------
+# 2. 一次批量 /predict
+# ----------------------------
+async def predict_rows(results: List[Dict[str, Any]], url: str, timeout: float = 30.0,
+                       transport: Optional[httpx.AsyncBaseTransport] = None) -> List[Dict[str, Any]]:
+    """把成功提取的特征 (id 为图片序号) 合并成一次 /predict 请求，返回 [{index, name, prediction}]"""
+    ok = [r for r in results if r.get("status") == "ok"]
+    if not ok:
+        return []
+    payload = [{**r["features"], "id": r["index"]} for r in ok]
+    async with httpx.AsyncClient(timeout=timeout, transport=transport) as client:
+        response = await client.post(url, json=payload)
+        response.raise_for_status()
+    by_id = {p["id"]: p for p in response.json()}
+    return [
+        {"index": r["index"], "name": r["name"], "prediction": {
+            "predicted_class": by_id[r["index"]]["predicted_class"],
+            "probability_poisonous": by_id[r["index"]]["probability_poisonous"],
+        }}
+        for r in sorted(ok, key=lambda r: r["index"])
+    ]
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    ok = sum(r.get("status") == "ok" for r in results)
+    return {
+        "images": len(results),
+        "ok": ok,
+        "failed": len(results) - ok,
+        "retries": sum(r["attempts"] - 1 for r in results),
+        "cache_hits": sum(r.get("cache") in ("exact", "near") for r in results),
+        "elapsed_s": round(elapsed, 3),
+        "images_per_s": round(len(results) / elapsed, 3) if elapsed else 0.0,
+    }
+
+
+# ----------------------------
+# 3. 命令行
+# ----------------------------
+async def run_cli(args) -> int:
+    try:
+        import src.imgprocess_api as vlm_api
+    except ImportError:  # 以脚本方式运行
+        import imgprocess_api as vlm_api
+
+    items = list_images(args.directory)
+    if not items:
+        print(f"❌ No images found in {args.directory}", file=sys.stderr)
+        return 1
+    if args.max_side is not None:
+        vlm_api.VLM_MAX_SIDE = args.max_side
+    vlm_api.VLM_MAX_CONCURRENCY = args.concurrency
+    vlm_api.VLM_MAX_QUEUE = max(vlm_api.VLM_MAX_QUEUE, args.concurrency)
+    vlm_api.VLM_LOG = False
+    # 与服务启动时相同：创建连接池客户端与结果缓存
+    await vlm_api.create_client()
+    vlm_api.open_cache()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    results = []
+    try:
+        async for result in fan_out(items, vlm_api.extract_features, args.concurrency, args.retries, args.backoff):
+            results.append(result)
+            out.write(json.dumps({"type": "features", **result}, ensure_ascii=False) + "\n")
+            out.flush()
+            if args.output:
+                mark = "✅" if result["status"] == "ok" else "❌"
+                print(f"{mark} [{len(results)}/{len(items)}] {result['name']} ({result['ms']:.0f} ms, "
+                      f"attempts={result['attempts']})", file=sys.stderr)
+        if args.predict:
+            for line in await predict_rows(results, args.classifier_url):
+                out.write(json.dumps({"type": "prediction", **line}, ensure_ascii=False) + "\n")
+        summary = summarize(results, time.perf_counter() - start)
+        print(f"⏱️ {json.dumps(summary)}", file=sys.stderr)
+    finally:
+        if args.output:
+            out.close()
+        await vlm_api.close_client()
+    return 0 if summary["failed"] == 0 else 2
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="图片目录 (如 img/)")
+    parser.add_argument("--output", default=None, help="NDJSON 输出文件，默认写到标准输出")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("VLM_MAX_CONCURRENCY", 2)),
+                        help="同时进行的 VLM 调用数")
+    parser.add_argument("--retries", type=int, default=2, help="暂时性失败 (503/504/5xx) 的重试次数")
+    parser.add_argument("--backoff", type=float, default=0.5, help="首次重试前的等待秒数，之后逐次翻倍")
+    parser.add_argument("--max-side", type=int, default=None, help="覆盖 VLM_MAX_SIDE")
+    parser.add_argument("--predict", action="store_true", help="提取完成后用一次 /predict 调用分类器")
+    parser.add_argument("--classifier-url", default=os.getenv("CLASSIFIER_API_URL", "http://127.0.0.1:8000/predict"))
+    args = parser.parse_args(argv)
+    return asyncio.run(run_cli(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+离线批量打分：分块读取 test.csv，在进程池中并行预处理 + Stacking 推理，按原顺序写出提交文件
+
+与 classifier_api.py 共用 preprocess_data / run_ensemble 与 models/ 下的模型，结果与 /predict 一致。
+输出格式同 train_model.ipynb 的 submission_stacking.csv (id,class)；--proba 额外输出中毒概率，
+输出路径以 .parquet 结尾时写 Parquet。
+
+注意：notebook 中的 submission 使用 5 折模型在测试集上的平均概率作为元特征，
+而线上 models/ 保存的是全量数据训练的基模型，两者的少量边界样本可能不同；
+可用 --compare 与参考提交文件逐行比对并报告一致率。
+
+用法 (项目根目录):
+    python src/batch_score.py --input kaggle/input/test.csv --output kaggle/submission_batch.csv --workers 4
+    python src/batch_score.py --output preds.parquet --proba --compare kaggle/submission_stacking.csv
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+try:
+    import src.classifier_api as api
+except ImportError:  # 以脚本方式运行 (python src/batch_score.py)
+    import classifier_api as api
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不统计峰值内存
+    resource = None
+
+
+# ----------------------------
+# 1. 读取
+# ----------------------------
+def iter_csv_chunks(path: str, chunk_rows: int):
+    """
+    分块读取 CSV：优先用 pyarrow 的流式 CSV 读取器 (多线程解析)，缺失时退回 pandas C 引擎。
+    类别列固定按字符串读取，空串视为缺失，与训练时 pd.read_csv 的结果一致。
+    pyarrow 路径产出 Arrow 表 (字符串列紧凑存储，传给工作进程的序列化开销远小于 object 列的 DataFrame)，
+    到工作进程中再转为 DataFrame
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype={col: str for col in api.categorical_cols})
+        return
+
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=16 << 20),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={col: pa.string() for col in api.categorical_cols},
+            strings_can_be_null=True,
+        ),
+    )
+    pending, rows = [], 0
+    for batch in reader:
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_rows:
+            yield pa.Table.from_batches(pending)
+            pending, rows = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+
+# ----------------------------
+# 2. 工作进程
+# ----------------------------
+def init_worker(model_dir: str, engine: str, threads: int):
+    """在工作进程中加载一次模型；每个进程限制为 threads 个推理线程，避免 N 个进程 × 全核超订"""
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["MODEL_DIR"] = model_dir
+    api.INFERENCE_ENGINE = engine
+    api.load_models()
+
+
+def score_chunk(df):
+    """返回 (id, 预测类别 0/1, 中毒概率)；离线打分不经过预测缓存"""
+    if not isinstance(df, pd.DataFrame):
+        df = df.to_pandas()
+    ids = df["id"].to_numpy() if "id" in df.columns else None
+    final_proba, final_pred = api.run_ensemble(api.preprocess_data(df))
+    return ids, np.asarray(final_pred, dtype=np.int8), np.asarray(final_proba, dtype=np.float64)
+
+
+def score_in_order(chunks, workers: int, init_args):
+    """按输入顺序产出每块的结果；进程池中最多同时有 2 × workers 块，内存与文件大小无关"""
+    if workers <= 1:
+        init_worker(*init_args)
+        for chunk in chunks:
+            yield score_chunk(chunk)
+        return
+
+    # spawn：主进程中 pyarrow 的读取线程已启动，fork 之后的子进程不安全
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=init_args) as pool:
+        in_flight = collections.deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(score_chunk, chunk))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+# ----------------------------
+# 3. 写出
+# ----------------------------
+class SubmissionWriter:
+    """逐块追加写 CSV / Parquet，列为 id,class[,probability_poisonous]"""
+
+    def __init__(self, path: str, with_proba: bool):
+        self.path = path
+        self.with_proba = with_proba
+        self.parquet = path.endswith(".parquet")
+        self._writer = None
+        self._first = True
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, ids, pred, proba, offset: int):
+        if ids is None:
+            ids = np.arange(offset, offset + len(pred))
+        frame = pd.DataFrame({"id": ids, "class": np.where(pred == 1, "p", "e")})
+        if self.with_proba:
+            frame["probability_poisonous"] = proba
+
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def compare_submissions(output: str, reference: str) -> int:
+    """按 id 对比两个提交文件的 class 列，打印一致率，返回不一致的行数"""
+    read = pd.read_parquet if output.endswith(".parquet") else pd.read_csv
+    ours = read(output, columns=["id", "class"])
+    theirs = pd.read_csv(reference, usecols=["id", "class"])
+    merged = ours.merge(theirs, on="id", how="outer", suffixes=("", "_ref"), indicator=True)
+    missing = int((merged["_merge"] != "both").sum())
+    mismatched = int((merged["class"] != merged["class_ref"]).sum()) - missing
+    both = len(merged) - missing
+    print(f"compare with {reference}: {both} common ids, {mismatched} class mismatches "
+          f"({100 * (1 - mismatched / both) if both else 0:.4f}% agree), {missing} ids only in one file")
+    return mismatched + missing
+
+
+def peak_rss_mb():
+    """(主进程, 已结束子进程中的最大值) 的峰值 RSS，单位 MB"""
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # macOS 单位为字节，Linux 为 KB
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default=os.path.join("kaggle", "input", "test.csv"))
+    parser.add_argument("--output", default=os.path.join("kaggle", "submission_batch.csv"),
+                        help="以 .parquet 结尾时写 Parquet，否则写 CSV")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", os.path.join(os.getcwd(), "models")))
+    parser.add_argument("--chunk-rows", type=int, default=200000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--engine", choices=["native", "compiled", "auto"], default="native")
+    parser.add_argument("--proba", action="store_true", help="额外输出 probability_poisonous 列")
+    parser.add_argument("--compare", default=None, help="参考提交文件 (如 kaggle/submission_stacking.csv)")
+    args = parser.parse_args(argv)
+
+    threads = args.threads_per_worker if args.workers > 1 else (os.cpu_count() or 1)
+    writer = SubmissionWriter(args.output, args.proba)
+    start = time.perf_counter()
+    rows = 0
+    try:
+        chunks = iter_csv_chunks(args.input, args.chunk_rows)
+        for ids, pred, proba in score_in_order(chunks, args.workers, (args.model_dir, args.engine, threads)):
+            writer.write(ids, pred, proba, rows)
+            rows += len(pred)
+            elapsed = time.perf_counter() - start
+            print(f"\r{rows} rows | {rows / elapsed:,.0f} rows/s", end="", flush=True)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"\n✅ {rows} rows scored in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s) "
+          f"with {args.workers} workers -> {args.output}")
+    main_rss, child_rss = peak_rss_mb()
+    if main_rss is not None:
+        print(f"peak RSS: main {main_rss:.0f} MB, largest worker {child_rss:.0f} MB")
+
+    if args.compare:
+        return 1 if compare_submissions(args.output, args.compare) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+级联推理：先只跑 LightGBM，只有 LGB 概率落在不确定区间 [low, high] 内的行才继续跑 XGBoost 与元模型
+
+区间外的行用元模型在 (p_lgb, p_lgb) 上的输出代替 (即假设 XGB 与 LGB 给出相同的概率)，
+输出与完整 Stacking 处于同一尺度。区间由 OOF 预测校准：在与完整 Stacking 预测类别一致的行比例
+不低于 --target 的前提下，选择需要升级 (escalate) 的行最少的区间。
+
+- calibrate(...)      按 OOF 预测选择区间，返回 CascadeBand 与校准报告
+- cascade_predict(...) 给定 LGB 概率与按行计算 XGB 概率的函数，返回 (中毒概率, 预测类别, 升级掩码)
+- CLI：读取 train_stacking.py 写出的 <work_dir>/oof.npz，把区间写入 <model_dir>/cascade.json，
+  并在 --data 的样本上对比完整 Stacking 与级联推理的耗时 (native / compiled 两种引擎)
+
+服务端以 CASCADE=1 启用 (见 classifier_api.py)，区间来自 <model_dir>/cascade.json 或 CASCADE_BAND=low,high。
+
+用法 (项目根目录):
+    python src/cascade.py --oof cache/train_stacking/oof.npz --model-dir models --target 0.9995 \\
+        --data kaggle/input/train.csv
+"""
+import argparse
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+CASCADE_FILE = "cascade.json"
+# CLI 额外打印的一组目标一致率，便于权衡
+TARGETS = (0.99, 0.999, 0.9995, 0.9999, 1.0)
+
+
+@dataclass
+class CascadeBand:
+    low: float
+    high: float
+
+    def escalate(self, lgb_proba: np.ndarray) -> np.ndarray:
+        """需要继续跑 XGBoost 与元模型的行"""
+        return (lgb_proba >= self.low) & (lgb_proba <= self.high)
+
+    def save(self, model_dir: str, report: Optional[Dict[str, Any]] = None) -> str:
+        path = os.path.join(model_dir, CASCADE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({**asdict(self), "calibration": report or {}}, f, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
+
+    @classmethod
+    def load(cls, model_dir: str) -> Optional["CascadeBand"]:
+        path = os.path.join(model_dir, CASCADE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            band = json.load(f)
+        return cls(float(band["low"]), float(band["high"]))
+
+    @classmethod
+    def parse(cls, text: str) -> "CascadeBand":
+        """'low,high' (CASCADE_BAND 环境变量)"""
+        low, high = (float(v) for v in text.split(","))
+        return cls(low, high)
+
+
+def meta_coefficients(meta_model) -> Tuple[np.ndarray, float]:
+    """逻辑回归元模型 (sklearn / bundle 的 LinearMetaModel / CompiledEnsemble) 的系数与截距"""
+    if hasattr(meta_model, "coef_"):
+        return np.asarray(meta_model.coef_, dtype=np.float64).ravel(), float(np.ravel(meta_model.intercept_)[0])
+    return np.asarray(meta_model.coef, dtype=np.float64), float(meta_model.intercept)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def cascade_predict(lgb_proba: np.ndarray, xgb_proba: Callable[[np.ndarray], np.ndarray], coef: np.ndarray,
+                    intercept: float, band: CascadeBand):
+    """xgb_proba(rows) 只对升级的行 (行号数组) 调用；返回 (中毒概率, 预测类别, 升级掩码)"""
+    lgb_proba = np.asarray(lgb_proba, dtype=np.float64)
+    escalated = band.escalate(lgb_proba)
+    decision = (coef[0] + coef[1]) * lgb_proba + intercept
+    rows = np.flatnonzero(escalated)
+    if len(rows):
+        decision[rows] = coef[0] * lgb_proba[rows] + coef[1] * np.asarray(xgb_proba(rows)) + intercept
+    return _sigmoid(decision), (decision > 0).astype(np.int64), escalated
+
+
+# ----------------------------
+# 1. 校准
+# ----------------------------
+def agreement(lgb_proba: np.ndarray, xgb_proba: np.ndarray, coef: np.ndarray, intercept: float,
+              band: CascadeBand) -> Dict[str, float]:
+    """按区间实际执行级联，统计与完整 Stacking 一致的比例与升级比例"""
+    full = coef[0] * lgb_proba + coef[1] * xgb_proba + intercept > 0
+    _, pred, escalated = cascade_predict(lgb_proba, lambda rows: xgb_proba[rows], coef, intercept, band)
+    return {"agreement": float(np.mean(pred == full)), "escalated_fraction": float(np.mean(escalated))}
+
+
+def calibrate(lgb_proba: np.ndarray, xgb_proba: np.ndarray, coef: np.ndarray, intercept: float,
+              target: float = 0.9995, y: Optional[np.ndarray] = None) -> Tuple[CascadeBand, Dict[str, Any]]:
+    """
+    选择升级行数最少、且与完整 Stacking 预测类别一致的行比例不低于 target 的区间。
+    按 LGB 概率排序后区间对应一段连续的行 [i, j)：区间外不一致的行数 = 前缀 (i) + 后缀 (j)，
+    对每个 i 用二分找到满足预算的最小 j，整体 O(n log n)
+    """
+    lgb_proba = np.asarray(lgb_proba, dtype=np.float64)
+    xgb_proba = np.asarray(xgb_proba, dtype=np.float64)
+    n = len(lgb_proba)
+    full = coef[0] * lgb_proba + coef[1] * xgb_proba + intercept > 0
+    lgb_only = (coef[0] + coef[1]) * lgb_proba + intercept > 0
+
+    order = np.argsort(lgb_proba, kind="stable")
+    p = lgb_proba[order]
+    wrong = np.concatenate([[0], np.cumsum(lgb_only[order] != full[order])])  # wrong[k]：前 k 行中不一致的行数
+    budget = int(np.floor((1.0 - target) * n + 1e-9))
+    i = np.arange(n + 1)
+    # 后缀 [j, n) 中不一致的行数 wrong[n] - wrong[j] <= budget - wrong[i]
+    need = wrong[n] - budget + wrong
+    j = np.maximum(np.searchsorted(wrong, need, side="left"), i)
+    feasible = wrong <= budget
+    width = np.where(feasible, j - i, n + 1)
+    best = int(np.argmin(width))
+    lo, hi = best, int(j[best])
+    # 区间按概率值表示；与边界值相同的行也会升级 (只会提高一致率)
+    band = CascadeBand(float(p[lo]), float(p[hi - 1])) if hi > lo else CascadeBand(1.0, 0.0)
+
+    report = {"target": target, "rows": n, **agreement(lgb_proba, xgb_proba, coef, intercept, band)}
+    if y is not None:
+        _, pred, _ = cascade_predict(lgb_proba, lambda rows: xgb_proba[rows], coef, intercept, band)
+        report["mcc_full"] = round(mcc(y, full), 5)
+        report["mcc_cascade"] = round(mcc(y, pred), 5)
+    return band, report
+
+
+def mcc(y, pred) -> float:
+    from sklearn.metrics import matthews_corrcoef
+
+    return float(matthews_corrcoef(np.asarray(y), np.asarray(pred).astype(int)))
+
+
+# ----------------------------
+# 2. 耗时对比
+# ----------------------------
+def benchmark(X, band: CascadeBand, sizes=(1, 100, 10000), repeat: int = 5) -> Dict[str, Any]:
+    """
+    classifier_api 的模型需已加载：对每个批量与引擎，比较完整 Stacking 与级联推理的中位耗时。
+    批量取自 X 的前 n 行 (样本不足时循环复用)
+    """
+    try:
+        import src.classifier_api as api
+        from src.compiled_ensemble import CompiledEnsemble
+    except ImportError:
+        import classifier_api as api
+        from compiled_ensemble import CompiledEnsemble
+
+    ensemble = api.compiled_ensemble or CompiledEnsemble.from_models(api.lgb_model, api.xgb_model, api.meta_model)
+    previous = api.compiled_ensemble, api.cascade_band, api.INFERENCE_ENGINE
+    results = {}
+    try:
+        for engine in ("native", "compiled"):
+            api.INFERENCE_ENGINE = engine
+            api.compiled_ensemble = ensemble if engine == "compiled" else None
+            for n in sizes:
+                batch = X.iloc[np.arange(n) % len(X)]
+                timings = {}
+                for mode, mode_band in (("full", None), ("cascade", band)):
+                    api.cascade_band = mode_band
+                    api.run_ensemble(batch)  # 预热
+                    runs = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        api.run_ensemble(batch)
+                        runs.append(time.perf_counter() - start)
+                    timings[mode] = float(np.median(runs)) * 1000
+                escalated = band.escalate(ensemble.base_proba(batch.to_numpy(dtype=np.float64))[0]).mean()
+                results[f"{engine}/{n}"] = {
+                    "full_ms": round(timings["full"], 3),
+                    "cascade_ms": round(timings["cascade"], 3),
+                    "saving": round(1 - timings["cascade"] / timings["full"], 4),
+                    "escalated_fraction": round(float(escalated), 4),
+                }
+    finally:
+        api.compiled_ensemble, api.cascade_band, api.INFERENCE_ENGINE = previous
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--oof", default=os.path.join("cache", "train_stacking", "oof.npz"),
+                        help="train_stacking.py 写出的 OOF 预测 (lgb / xgb / y)")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--target", type=float, default=0.9995, help="与完整 Stacking 预测类别一致的最低行比例")
+    parser.add_argument("--data", default=None, help="对比耗时用的样本 CSV (Kaggle train.csv / test.csv)")
+    parser.add_argument("--bench-rows", type=int, default=10000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--dry-run", action="store_true", help="不写出 cascade.json")
+    args = parser.parse_args(argv)
+
+    import joblib
+
+    meta_model = joblib.load(os.path.join(args.model_dir, "meta_model.pkl"))
+    coef, intercept = meta_coefficients(meta_model)
+    with np.load(args.oof) as oof:
+        lgb_oof, xgb_oof, y = oof["lgb"], oof["xgb"], oof["y"] if "y" in oof else None
+
+    print(f"{'target':>8} | {'low':>9} | {'high':>9} | {'agreement':>9} | {'escalated':>9}")
+    for target in sorted(set(TARGETS) | {args.target}):
+        band, report = calibrate(lgb_oof, xgb_oof, coef, intercept, target)
+        print(f"{target:>8} | {band.low:>9.5f} | {band.high:>9.5f} | {report['agreement']:>9.5f} | "
+              f"{report['escalated_fraction']:>9.4f}")
+
+    band, report = calibrate(lgb_oof, xgb_oof, coef, intercept, args.target, y)
+    print(f"✅ Band [{band.low:.5f}, {band.high:.5f}]: {report['escalated_fraction']:.2%} of OOF rows escalated, "
+          f"agreement {report['agreement']:.5f}"
+          + (f", MCC {report['mcc_full']} -> {report['mcc_cascade']}" if y is not None else ""))
+
+    if args.data:
+        import pandas as pd
+
+        try:
+            import src.classifier_api as api
+        except ImportError:
+            import classifier_api as api
+        for name in ("lgb_model", "xgb_model", "meta_model", "label_encoders"):
+            setattr(api, name, joblib.load(os.path.join(args.model_dir, f"{name}.pkl")))
+        X = api.preprocess_data(pd.read_csv(args.data, nrows=args.bench_rows))
+        report["latency"] = benchmark(X, band, args.sizes)
+        print(f"{'engine/batch':>15} | {'full (ms)':>10} | {'cascade (ms)':>12} | {'saving':>7} | {'escalated':>9}")
+        for key, row in report["latency"].items():
+            print(f"{key:>15} | {row['full_ms']:>10.3f} | {row['cascade_ms']:>12.3f} | {row['saving']:>7.1%} | "
+                  f"{row['escalated_fraction']:>9.2%}")
+
+    if not args.dry_run:
+        print(f"✅ Cascade band saved to {band.save(args.model_dir, report)}")
+
+
+if __name__ == "__main__":
+    main()
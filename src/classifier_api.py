@@ -1,12 +1,46 @@
 import os
 import json
+import asyncio
+import collections
+import itertools
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field, replace
 import pandas as pd
 import numpy as np
 import joblib
-from fastapi import FastAPI, HTTPException
-from typing import List, Dict, Any
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional, Union
 from dotenv import load_dotenv
 
+try:
+    from src.feature_encoder import FeatureEncoder
+    from src.compiled_ensemble import CompiledEnsemble
+    from src.micro_batcher import MicroBatcher, QueueFullError
+    from src.prediction_cache import PredictionCache
+    from src.model_bundle import ModelBundle
+    from src import columnar_io
+    from src import metrics
+    from src.cascade import CascadeBand, cascade_predict, meta_coefficients
+    from src import model_versions
+    from src.audit_log import AuditLog
+    from src import explain
+except ImportError:  # 以脚本方式运行 (python src/classifier_api.py)
+    from feature_encoder import FeatureEncoder
+    from compiled_ensemble import CompiledEnsemble
+    from micro_batcher import MicroBatcher, QueueFullError
+    from prediction_cache import PredictionCache
+    from model_bundle import ModelBundle
+    import columnar_io
+    import metrics
+    from cascade import CascadeBand, cascade_predict, meta_coefficients
+    import model_versions
+    from audit_log import AuditLog
+    import explain
+
 # 加载环境变量
 load_dotenv()
 
@@ -19,6 +53,18 @@ app = FastAPI(
     description="API for predicting mushroom edibility (edible/poisonous)",
     version="1.0"
 )
+app.add_middleware(metrics.MetricsMiddleware, app_name="classifier")
+
+# 分阶段耗时直方图 classifier_stage_seconds{stage=parse|frame|preprocess|cache_lookup|lgb|xgb|meta|compiled|explain|response}
+# 与批量 / 行数 / 缓存计数，由 GET /metrics 以 Prometheus 文本格式暴露 (METRICS=0 关闭)
+stages = metrics.Stages("classifier")
+batch_rows = metrics.REGISTRY.histogram("classifier_batch_rows", "Rows per scoring call (after micro-batching)",
+                                        metrics.ROWS_BUCKETS)
+rows_scored = metrics.REGISTRY.counter("classifier_rows_scored_total", "Rows scored")
+cascade_rows = metrics.REGISTRY.counter("classifier_cascade_rows_total",
+                                        "Rows scored in cascade mode by path (lgb_only / escalated)", ("path",))
+cache_rows = metrics.REGISTRY.counter("classifier_prediction_cache_rows_total", "Prediction cache lookups by result",
+                                      ("result",))
 
 # ----------------------------
 # 2. 全局变量：模型和编码器（启动时加载）
@@ -27,6 +73,38 @@ lgb_model = None
 xgb_model = None
 meta_model = None
 label_encoders = None
+feature_encoder = None  # 由 label_encoders 预构建的查表编码器
+compiled_ensemble = None  # 展平后的 LGB + XGB + 元模型 (见 compiled_ensemble.py)
+
+# 推理引擎：native (原生 predict_proba) / compiled (NumPy 展平树) /
+# auto (不超过 COMPILED_MAX_ROWS 行的小批量走 compiled，其余走 native)
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "auto")
+COMPILED_MAX_ROWS = int(os.getenv("COMPILED_MAX_ROWS", 64))
+
+# 微批调度：并发请求合并后在工作线程中统一推理 (MICRO_BATCH=0 关闭)
+MICRO_BATCH = os.getenv("MICRO_BATCH", "1") == "1"
+MICRO_BATCH_MAX_ROWS = int(os.getenv("MICRO_BATCH_MAX_ROWS", 512))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", 2))
+MICRO_BATCH_MAX_QUEUE = int(os.getenv("MICRO_BATCH_MAX_QUEUE", 10000))
+MICRO_BATCH_WORKERS = int(os.getenv("MICRO_BATCH_WORKERS", 1))
+batcher = None
+
+# 级联推理 (CASCADE=1)：先只跑 LightGBM，LGB 概率落在不确定区间内的行才继续跑 XGBoost 与元模型。
+# 区间由 cascade.py 按 OOF 预测校准并写入 <model_dir>/cascade.json，CASCADE_BAND=low,high 可直接指定
+CASCADE = os.getenv("CASCADE", "0") == "1"
+CASCADE_BAND = os.getenv("CASCADE_BAND")
+cascade_band = None
+
+# 模型格式：bundle (model_bundle.py 导出的原生格式目录 <model_dir>/bundle) / pickle (joblib) /
+# auto (默认，bundle 存在时优先使用)。MODEL_VERIFY=0 跳过 sha256 校验，MODEL_PREFETCH=0 不在后台预取 booster
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "auto")
+MODEL_VERIFY = os.getenv("MODEL_VERIFY", "1") == "1"
+MODEL_PREFETCH = os.getenv("MODEL_PREFETCH", "1") == "1"
+model_load_report = {}
+
+# 多进程模式 (serve.py) 下由 supervisor 在 fork 之前加载共享的只读模型状态，
+# 工作进程启动时不再重复加载
+shared_state_loaded = False
 feature_order = [
     'cap-diameter', 'cap-shape', 'cap-surface', 'cap-color', 'does-bruise-or-bleed',
     'gill-attachment', 'gill-spacing', 'gill-color', 'stem-height', 'stem-width',
@@ -34,31 +112,272 @@ feature_order = [
     'has-ring', 'ring-type', 'spore-print-color', 'habitat', 'season'
 ]
 
+
+@dataclass
+class ModelSet:
+    """一个版本的全部模型状态。热更新时整体替换，同一次打分只使用同一个快照，不会混用两个版本"""
+    lgb_model: Any = None
+    xgb_model: Any = None
+    meta_model: Any = None
+    label_encoders: Any = None
+    feature_encoder: Optional[FeatureEncoder] = None
+    compiled_ensemble: Any = None
+    cascade_band: Optional[CascadeBand] = None
+    report: Dict[str, Any] = field(default_factory=dict)
+    version: Optional[str] = None
+
+
+# 读取 / 替换上面这组全局变量时持有，保证快照与替换都是原子的
+swap_lock = threading.Lock()
+model_version = None  # 当前版本名 (原目录布局时为 None)
+
+
+def current_models() -> ModelSet:
+    """当前全局模型状态的快照"""
+    with swap_lock:
+        encoder = get_feature_encoder() if label_encoders is not None else feature_encoder
+        return ModelSet(lgb_model, xgb_model, meta_model, label_encoders, encoder, compiled_ensemble,
+                        cascade_band, model_load_report, model_version)
+
+
+def install(models: ModelSet):
+    """把一组模型状态原子地换入全局变量"""
+    global lgb_model, xgb_model, meta_model, label_encoders, feature_encoder, compiled_ensemble, cascade_band
+    global model_load_report, model_version
+    with swap_lock:
+        lgb_model, xgb_model, meta_model = models.lgb_model, models.xgb_model, models.meta_model
+        label_encoders, feature_encoder = models.label_encoders, models.feature_encoder
+        compiled_ensemble, cascade_band = models.compiled_ensemble, models.cascade_band
+        model_load_report, model_version = models.report, models.version
+
+
+def full_stack(models: ModelSet) -> ModelSet:
+    """同一组模型，但不走级联 (parity 记录与校验都针对完整 Stacking 的输出)"""
+    return replace(models, cascade_band=None)
+
+
 @app.on_event("startup")
-def load_models():
-    global lgb_model, xgb_model, meta_model, label_encoders
+def load_models_on_startup():
+    if shared_state_loaded:
+        print(f"✅ Using shared model state (pid={os.getpid()}, engine={INFERENCE_ENGINE})")
+        return
+    load_models()
+
+
+def model_base_dir() -> str:
     # 从环境变量读取模型目录，默认为项目根目录下的 models
-    model_dir = os.getenv("MODEL_DIR", os.path.join(os.getcwd(), "models"))
-    
+    return os.getenv("MODEL_DIR", os.path.join(os.getcwd(), "models"))
+
+
+def load_models():
+    """加载 MODEL_DIR (版本化布局时为 CURRENT 指向的版本) 并换入"""
+    model_dir, version = model_versions.resolve(model_base_dir())
+    install(load_model_set(model_dir, version))
+    if prediction_cache is not None:
+        prediction_cache.clear()
+
+
+def load_model_set(model_dir: str, version: Optional[str] = None) -> ModelSet:
+    """从一个模型目录加载全部状态，不改动全局变量 (热更新时在后台线程中调用)"""
+    bundle_dir = os.path.join(model_dir, "bundle")
+    start = time.perf_counter()
+
+    if MODEL_FORMAT == "bundle" or (
+        MODEL_FORMAT == "auto" and os.path.exists(os.path.join(bundle_dir, "manifest.json"))
+    ):
+        models = load_bundle(bundle_dir)
+    else:
+        try:
+            # 加载所有模型
+            timings = {}
+
+            def timed_load(name):
+                t0 = time.perf_counter()
+                model = joblib.load(os.path.join(model_dir, f"{name}.pkl"))
+                timings[name] = round((time.perf_counter() - t0) * 1000, 2)
+                return model
+
+            models = ModelSet(timed_load("lgb_model"), timed_load("xgb_model"), timed_load("meta_model"),
+                              timed_load("label_encoders"))
+            models.feature_encoder = FeatureEncoder.from_label_encoders(models.label_encoders)
+
+            print(f"✅ Models loaded successfully from {model_dir}")
+        except Exception as e:
+            print(f"❌ Failed to load models from {model_dir}: {e}")
+            raise RuntimeError(f"Model loading failed: {e}")
+
+        if INFERENCE_ENGINE != "native":
+            t0 = time.perf_counter()
+            models.compiled_ensemble = load_compiled_ensemble(model_dir, models)
+            timings["compiled"] = round((time.perf_counter() - t0) * 1000, 2)
+        models.report = {"format": "pickle", "path": model_dir, "load_ms": timings}
+
+    report = models.report
+    report["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    if version is not None:
+        report["version"] = version
+    print(f"⏱️ Model artifacts ({report['format']}): "
+          + ", ".join(f"{name} {ms:.1f} ms" for name, ms in report["load_ms"].items())
+          + f" | total {report['total_ms']:.1f} ms")
+    models.cascade_band = load_cascade_band(model_dir)
+    models.version = version
+    return models
+
+
+def load_cascade_band(model_dir: str) -> Optional[CascadeBand]:
+    if not CASCADE:
+        return None
+    band = CascadeBand.parse(CASCADE_BAND) if CASCADE_BAND else CascadeBand.load(model_dir)
+    if band is None:
+        print(f"⚠️ CASCADE=1 but {model_dir}/cascade.json not found; run src/cascade.py to calibrate. "
+              "Using the full stack")
+    else:
+        print(f"✅ Cascade inference enabled: LGB probability in [{band.low:.5f}, {band.high:.5f}] "
+              "escalates to XGB + meta model")
+    return band
+
+
+def load_bundle(bundle_dir: str) -> ModelSet:
+    """加载原生格式 bundle：词表 / 元模型系数 / mmap 的 compiled 数组，booster 延迟加载"""
     try:
-        # 加载所有模型
-        lgb_model = joblib.load(os.path.join(model_dir, "lgb_model.pkl"))
-        xgb_model = joblib.load(os.path.join(model_dir, "xgb_model.pkl"))
-        meta_model = joblib.load(os.path.join(model_dir, "meta_model.pkl"))
-        label_encoders = joblib.load(os.path.join(model_dir, "label_encoders.pkl"))
-        
-        print(f"✅ Models loaded successfully from {model_dir}")
+        bundle = ModelBundle.load(bundle_dir, verify=MODEL_VERIFY)
     except Exception as e:
-        print(f"❌ Failed to load models from {model_dir}: {e}")
+        print(f"❌ Failed to load model bundle from {bundle_dir}: {e}")
         raise RuntimeError(f"Model loading failed: {e}")
 
+    models = ModelSet(bundle.lgb, bundle.xgb, bundle.meta_model, bundle.vocabularies)
+    models.feature_encoder = FeatureEncoder(bundle.vocabularies, source=models.label_encoders)
+    if INFERENCE_ENGINE != "native":
+        models.compiled_ensemble = bundle.compiled
+        if models.compiled_ensemble is None:  # bundle 未包含展平树时从原生 booster 现场导出
+            models.compiled_ensemble = load_compiled_ensemble(bundle_dir, models)
+    if MODEL_PREFETCH and (INFERENCE_ENGINE != "compiled" or models.compiled_ensemble is None):
+        bundle.prefetch()
+    # 报告与 bundle 共享同一个耗时字典，booster 延迟加载后会出现在 /stats/models 中
+    models.report = {"format": "bundle", "path": bundle_dir, "load_ms": bundle.timings, "bundle": bundle}
+    print(f"✅ Model bundle loaded from {bundle_dir} (created {bundle.manifest.get('created')})")
+    return models
+
+
+def load_compiled_ensemble(model_dir: str, models: ModelSet):
+    """优先加载 compiled_ensemble.py 导出的 <model_dir>/compiled，否则从已加载的模型现场导出"""
+    compiled_dir = os.path.join(model_dir, "compiled")
+    try:
+        if os.path.exists(os.path.join(compiled_dir, "ensemble.json")):
+            ensemble = CompiledEnsemble.load(compiled_dir)
+        else:
+            ensemble = CompiledEnsemble.from_models(models.lgb_model, models.xgb_model, models.meta_model)
+        print(f"✅ Compiled ensemble ready (engine={INFERENCE_ENGINE}, "
+              f"lgb trees={ensemble.lgb.n_trees}, xgb trees={ensemble.xgb.n_trees})")
+        return ensemble
+    except Exception as e:
+        if INFERENCE_ENGINE == "compiled":
+            raise RuntimeError(f"Compiled ensemble loading failed: {e}")
+        print(f"⚠️ Compiled ensemble unavailable, falling back to native engine: {e}")
+        return None
+
+
+def load_shared_state(model_dir: str):
+    """
+    多进程模式下在 supervisor (fork 之前) 调用：只加载类别词表与内存映射的 compiled ensemble。
+    不初始化 LightGBM / XGBoost (二者的 OpenMP 线程池在 fork 后不可用)，
+    工作进程通过 fork 继承这些只读状态，节点数组由各进程共享同一份页缓存。
+    优先使用 <model_dir>/bundle (无需 sklearn)，否则读取 label_encoders.pkl 与 <model_dir>/compiled；
+    版本化布局时加载 CURRENT 指向的版本 (SIGHUP 滚动重启前会重新调用)
+    """
+    global shared_state_loaded
+    model_dir, version = model_versions.resolve(model_dir)
+    bundle_dir = os.path.join(model_dir, "bundle")
+    models = ModelSet(version=version, report={"format": "shared", "path": model_dir, "load_ms": {}})
+    if version is not None:
+        models.report["version"] = version
+    if MODEL_FORMAT != "pickle" and os.path.exists(os.path.join(bundle_dir, "manifest.json")):
+        bundle = ModelBundle.load(bundle_dir, verify=MODEL_VERIFY)
+        if bundle.compiled is None:
+            raise RuntimeError(f"Bundle {bundle_dir} has no compiled ensemble; re-export it with compiled arrays")
+        compiled_dir = os.path.join(bundle_dir, "compiled")
+        models.label_encoders = bundle.vocabularies
+        models.feature_encoder = FeatureEncoder(models.label_encoders, source=models.label_encoders)
+        models.compiled_ensemble = bundle.compiled
+    else:
+        compiled_dir = os.path.join(model_dir, "compiled")
+        models.label_encoders = joblib.load(os.path.join(model_dir, "label_encoders.pkl"))
+        models.feature_encoder = FeatureEncoder.from_label_encoders(models.label_encoders)
+        models.compiled_ensemble = CompiledEnsemble.load(compiled_dir, mmap_mode="r")
+    # 预先触发各列 pd.Index 的哈希表构建，避免每个工作进程首个大批量请求时各建一份
+    preprocess_data(pd.DataFrame({col: ["nan"] * 128 for col in categorical_cols}), models.feature_encoder)
+    models.cascade_band = load_cascade_band(model_dir)
+    install(models)
+    shared_state_loaded = True
+    if prediction_cache is not None:
+        prediction_cache.clear()
+    print(f"✅ Shared model state loaded from {compiled_dir} "
+          f"(lgb trees={models.compiled_ensemble.lgb.n_trees}, xgb trees={models.compiled_ensemble.xgb.n_trees})")
+
 
 # ----------------------------
-# 3. 预处理函数 (修正版)
+# 3. 预处理函数
 # ----------------------------
-def preprocess_data(input_data: List[Dict[str, Any]]) -> pd.DataFrame:
-    """将 JSON 输入转换为预处理后的 DataFrame"""
-    df = pd.DataFrame(input_data)
+numeric_cols = ['cap-diameter', 'stem-height', 'stem-width']
+categorical_cols = [col for col in feature_order if col not in numeric_cols]
+
+# 预测结果缓存：以编码后的特征行为键 (PREDICTION_CACHE_SIZE=0 关闭)，
+# PREDICTION_CACHE_ROUND 为数值列参与计算键之前保留的小数位 (默认不取整，只命中完全相同的行)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 100000))
+PREDICTION_CACHE_ROUND = os.getenv("PREDICTION_CACHE_ROUND")
+# /explain 的逐特征贡献与预测结果共用缓存键，另存最多 EXPLAIN_CACHE_SIZE 行 (0 关闭)
+EXPLAIN_CACHE_SIZE = int(os.getenv("EXPLAIN_CACHE_SIZE", 10000))
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    round_decimals=int(PREDICTION_CACHE_ROUND) if PREDICTION_CACHE_ROUND else None,
+    numeric_positions=[feature_order.index(col) for col in numeric_cols],
+    max_explanations=EXPLAIN_CACHE_SIZE,
+) if PREDICTION_CACHE_SIZE > 0 else None
+
+# 预测审计日志 (AUDIT_LOG=1)：每条预测的输入、概率、模型版本与打分耗时先进入内存缓冲区 (最多 AUDIT_BUFFER_ROWS 行)，
+# 由后台线程批量写入 AUDIT_DIR 下的 gzip NDJSON 分段 (见 audit_log.py)，请求路径上没有磁盘 I/O。
+# 分段超过 AUDIT_SEGMENT_MB 或 AUDIT_SEGMENT_SECONDS 时轮转，AUDIT_MAX_SEGMENTS>0 时只保留最近的分段；
+# 缓冲区满时 AUDIT_POLICY=drop 丢弃并计数，block 时打分线程最多等待 AUDIT_BLOCK_TIMEOUT 秒
+AUDIT_LOG = os.getenv("AUDIT_LOG", "0") == "1"
+AUDIT_DIR = os.getenv("AUDIT_DIR", os.path.join(os.getcwd(), "cache", "audit"))
+AUDIT_BUFFER_ROWS = int(os.getenv("AUDIT_BUFFER_ROWS", 100000))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0))
+AUDIT_SEGMENT_MB = float(os.getenv("AUDIT_SEGMENT_MB", 64))
+AUDIT_SEGMENT_SECONDS = float(os.getenv("AUDIT_SEGMENT_SECONDS", 3600))
+AUDIT_MAX_SEGMENTS = int(os.getenv("AUDIT_MAX_SEGMENTS", 0))
+AUDIT_POLICY = os.getenv("AUDIT_POLICY", "drop")
+AUDIT_BLOCK_TIMEOUT = float(os.getenv("AUDIT_BLOCK_TIMEOUT", 5))
+audit_log = None
+
+
+def get_feature_encoder() -> FeatureEncoder:
+    """返回与当前 label_encoders 对应的查表编码器 (编码器被替换时自动重建)"""
+    global feature_encoder
+    if feature_encoder is None or feature_encoder.source is not label_encoders:
+        feature_encoder = FeatureEncoder.from_label_encoders(label_encoders)
+    return feature_encoder
+
+
+def synthetic_rows(encoder: FeatureEncoder, n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """按词表随机生成 API 输入格式的样本 (含缺失值)，用于预热与没有 parity.json 时的一致性检查"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for col in feature_order:
+        if col in numeric_cols:
+            columns[col] = np.round(rng.uniform(0, 20, n), 2).tolist()
+        else:
+            pool = [str(c) for c in encoder.tables[col].classes if str(c) != "nan"] + [None]
+            columns[col] = [pool[i] for i in rng.integers(len(pool), size=n)]
+    return [{"id": i, **{col: columns[col][i] for col in feature_order}} for i in range(n)]
+
+
+def preprocess_data(input_data: Union[List[Dict[str, Any]], Dict[str, List[Any]], pd.DataFrame],
+                    encoder: Optional[FeatureEncoder] = None) -> pd.DataFrame:
+    """
+    将 JSON 输入 (按行 List[Dict] / 按列 Dict[str, List] / DataFrame) 转换为预处理后的 DataFrame。
+    encoder 默认为当前模型的编码器；热更新时传入与模型快照对应的编码器
+    """
+    df = input_data.copy() if isinstance(input_data, pd.DataFrame) else pd.DataFrame(input_data)
     
     # 1. 确保所有列存在
     for col in feature_order:
@@ -66,48 +385,135 @@ def preprocess_data(input_data: List[Dict[str, Any]]) -> pd.DataFrame:
             df[col] = None  # 产生 NaN/None
 
     # 2. 显式处理数值列 (防止传入字符串导致模型报错)
-    numeric_cols = ['cap-diameter', 'stem-height', 'stem-width']
     for col in numeric_cols:
         # 强制转为 float，无法转换的变为 NaN (模型能处理数值 NaN)
         df[col] = pd.to_numeric(df[col], errors='coerce')
 
     # 3. 处理类别列
-    categorical_cols = [col for col in feature_order if col not in numeric_cols]
-    
-    for col in categorical_cols:
-        le = label_encoders[col]
-        
-        # -------------------------------------------------------
-        # 修正逻辑：模拟训练时的 astype(str) 行为
-        # -------------------------------------------------------
-        # 训练时: .astype(str) 将 NaN 变成了 "nan"
-        # 因此，这里我们要把 None/NaN 显式变成 "nan" 字符串以匹配编码器
-        df[col] = df[col].astype(str) 
-        
-        # 处理 python 的 'None' 字符串问题 (pd.DataFrame(None) -> None -> str() -> 'None')
-        # 如果你的训练数据来源于 CSV，空值通常是 float NaN -> 'nan'
-        # 如果 JSON 传入 null，pandas 可能是 None -> 'None'
-        # 统一映射一下：
-        df[col] = df[col].replace({'None': 'nan', 'nan': 'nan', '<NA>': 'nan'})
-
-        # 处理未见过的类别 (Handle Unseen Labels)
-        # 逻辑：如果是已知类别 -> 保持
-        #       如果是未知类别 -> 尝试归类为 'nan' (假设训练集有空值)
-        #       如果 'nan' 也不在编码器里 (训练集该列全满) -> 归类为第一个已知类别 (Fallback)
-        
-        fallback_value = 'nan' if 'nan' in le.classes_ else le.classes_[0]
-        
-        df[col] = df[col].apply(lambda x: x if x in le.classes_ else fallback_value)
-        
-        # 编码
-        df[col] = le.transform(df[col])
-    
-    # 保持特征顺序
-    return df[feature_order]
+    # 与训练时 astype(str) + LabelEncoder 的编码完全一致：
+    #   - None / NaN / 'None' / '<NA>' 统一视为 'nan'
+    #   - 未见过的类别归为 'nan'；若编码器中没有 'nan'，则归为第一个已知类别 (Fallback)
+    # 查找表在模型加载时构建，这里每列只做一次向量化查表，结果为 int8/int16
+    with stages("preprocess"):
+        if encoder is None:
+            encoder = get_feature_encoder()
+        for col in categorical_cols:
+            df[col] = encoder.encode_column(col, df[col])
+
+        # 保持特征顺序
+        return df[feature_order]
 
 # ----------------------------
 # 4. 预测接口
 # ----------------------------
+def run_ensemble(X: pd.DataFrame, models: Optional[ModelSet] = None):
+    """对预处理后的特征执行 Stacking 推理，返回 (中毒概率, 预测类别)；models 默认为当前模型的快照"""
+    if models is None:
+        models = current_models()
+    use_compiled = models.compiled_ensemble is not None and (
+        INFERENCE_ENGINE == "compiled" or len(X) <= COMPILED_MAX_ROWS or models.lgb_model is None
+    )
+    if models.cascade_band is not None:
+        return run_cascade(X, use_compiled, models)
+    if use_compiled:
+        with stages("compiled"):
+            return models.compiled_ensemble.predict(X.to_numpy(dtype=np.float64))
+
+    # 基模型预测
+    with stages("lgb"):
+        lgb_proba = models.lgb_model.predict_proba(X)[:, 1]
+    with stages("xgb"):
+        xgb_proba = models.xgb_model.predict_proba(X)[:, 1]
+
+    with stages("meta"):
+        # 元模型输入
+        meta_features = np.column_stack([lgb_proba, xgb_proba])
+
+        # 最终预测：线性输出只算一次，等价于 predict_proba(...)[:, 1] 与 predict(...)
+        decision = models.meta_model.decision_function(meta_features)
+        final_proba = 1.0 / (1.0 + np.exp(-decision))
+        final_pred = models.meta_model.classes_[(decision > 0).astype(int)]
+    return final_proba, final_pred
+
+
+def run_cascade(X: pd.DataFrame, use_compiled: bool, models: ModelSet):
+    """级联推理：XGBoost 只对 LGB 概率落在 cascade_band 内的行执行"""
+    compiled_ensemble = models.compiled_ensemble
+    if use_compiled:
+        X_np = X.to_numpy(dtype=np.float64)
+        with stages("compiled_lgb"):
+            lgb_proba = 1.0 / (1.0 + np.exp(-compiled_ensemble.lgb.margin(X_np)))
+
+        def xgb_proba(rows):
+            with stages("compiled_xgb"):
+                return 1.0 / (1.0 + np.exp(-compiled_ensemble.xgb.margin(X_np[rows])))
+
+        coef, intercept = meta_coefficients(compiled_ensemble)
+    else:
+        with stages("lgb"):
+            lgb_proba = models.lgb_model.predict_proba(X)[:, 1]
+
+        def xgb_proba(rows):
+            with stages("xgb"):
+                return models.xgb_model.predict_proba(X.iloc[rows])[:, 1]
+
+        coef, intercept = meta_coefficients(models.meta_model)
+    final_proba, final_pred, escalated = cascade_predict(lgb_proba, xgb_proba, coef, intercept, models.cascade_band)
+    n_escalated = int(escalated.sum())
+    cascade_rows.inc(n_escalated, "escalated")
+    cascade_rows.inc(len(escalated) - n_escalated, "lgb_only")
+    return final_proba, final_pred
+
+
+def record_batch(rows: int):
+    batch_rows.observe(rows)
+    rows_scored.inc(rows)
+
+
+def fill_misses(keys: List[bytes], missing: np.ndarray, compute, store, *outputs: np.ndarray):
+    """
+    缓存未命中的行 (批内去重后) 只计算一次：compute(行号) 返回与 outputs 一一对应的数组，
+    store(去重后的键, *结果) 写回缓存，再把结果按原顺序填入 outputs 的未命中位置
+    """
+    first_seen = {}
+    for i in np.flatnonzero(missing):
+        first_seen.setdefault(keys[i], i)
+    rows = np.fromiter(first_seen.values(), dtype=np.intp, count=len(first_seen))
+    results = compute(rows)
+    store(list(first_seen), *results)
+
+    slot = dict(zip(first_seen, range(len(rows))))
+    positions = np.flatnonzero(missing)
+    take = np.fromiter((slot[keys[i]] for i in positions), dtype=np.intp, count=len(positions))
+    for output, result in zip(outputs, results):
+        output[positions] = np.asarray(result)[take]
+
+
+def run_ensemble_cached(X: pd.DataFrame, models: Optional[ModelSet] = None):
+    """带预测缓存的 run_ensemble：只对未命中的行 (批内去重后) 推理，再按原顺序合并"""
+    record_batch(len(X))
+    if models is None:
+        models = current_models()
+    if prediction_cache is None:
+        return run_ensemble(X, models)
+    # 缓存按模型对象的身份失效：热更新换入新版本后旧条目不会再命中
+    owner = (models.lgb_model, models.xgb_model, models.meta_model, models.compiled_ensemble,
+             models.label_encoders, models.cascade_band)
+    prediction_cache.bind(*owner)
+
+    with stages("cache_lookup"):
+        keys = prediction_cache.keys(X.to_numpy(dtype=np.float64))
+        final_proba, final_pred, missing = prediction_cache.lookup(keys)
+    misses = int(missing.sum())
+    cache_rows.inc(len(keys) - misses, "hit")
+    cache_rows.inc(misses, "miss")
+    if misses:
+        fill_misses(keys, missing, lambda rows: run_ensemble(X.iloc[rows], models),
+                    lambda unique, proba, pred: prediction_cache.store(unique, proba, pred, owner),
+                    final_proba, final_pred)
+    return final_proba, final_pred
+
+
 @app.post("/predict")
 async def predict(data: List[Dict[str, Any]]):
     """
@@ -140,36 +546,585 @@ async def predict(data: List[Dict[str, Any]]):
       }
     ]
     """
+    # 读取请求体 + JSON 解析 + 校验：从进入中间件到进入处理函数
+    start = metrics.request_start()
+    if start is not None:
+        stages.observe("parse", time.perf_counter() - start, start)
     if not data:
         raise HTTPException(status_code=400, detail="Empty input data")
-    
-    # 预处理
-    X = preprocess_data(data)
-    
-    # 基模型预测
-    lgb_proba = lgb_model.predict_proba(X)[:, 1]
-    xgb_proba = xgb_model.predict_proba(X)[:, 1]
-    
-    # 元模型输入
-    meta_features = np.column_stack([lgb_proba, xgb_proba])
-    
-    # 最终预测
-    final_proba = meta_model.predict_proba(meta_features)[:, 1]
-    final_pred = meta_model.predict(meta_features)
-    
+
+    # 预处理 + 推理 (开启微批时与其他并发请求合并执行)
+    final_proba, final_pred = await score_async(data, len(data))
+
     # 构建结果
-    results = []
-    for i, item in enumerate(data):
-        results.append({
-            "id": item["id"],
-            "predicted_class": "p" if final_pred[i] == 1 else "e",
-            "probability_poisonous": float(final_proba[i])
-        })
-    
+    with stages("response"):
+        return JSONResponse([
+            {
+                "id": item["id"],
+                "predicted_class": "p" if pred == 1 else "e",
+                "probability_poisonous": float(proba),
+            }
+            for item, proba, pred in zip(data, final_proba, final_pred)
+        ])
+
+
+def score_payloads(payloads: List[Union[List[Dict[str, Any]], pd.DataFrame]]):
+    """
+    把多个请求的原始输入合并成一个批次，只做一次预处理与推理，
+    再按各请求的行数切分，返回 [(中毒概率, 预测类别), ...]
+    """
+    start = time.perf_counter()
+    with stages("frame"):
+        if all(isinstance(p, list) for p in payloads):
+            df = pd.DataFrame(list(itertools.chain.from_iterable(payloads)))
+        else:
+            df = pd.concat([p if isinstance(p, pd.DataFrame) else pd.DataFrame(p) for p in payloads],
+                           ignore_index=True)
+    # 整批只取一次模型快照：预处理与推理使用同一版本的编码器与模型
+    models = current_models()
+    final_proba, final_pred = run_ensemble_cached(preprocess_data(df, models.feature_encoder), models)
+
+    offsets = np.cumsum([len(p) for p in payloads])[:-1]
+    results = list(zip(np.split(final_proba, offsets), np.split(final_pred, offsets)))
+    if audit_log is not None:
+        batch_ms = (time.perf_counter() - start) * 1000
+        for payload, (proba, pred) in zip(payloads, results):
+            audit_log.record(payload, proba, pred, models.version, "predict", batch_ms)
     return results
 
+
+def explain_rows(X: pd.DataFrame, models: Optional[ModelSet] = None):
+    """
+    逐特征贡献 (元模型 logit 上，见 explain.py)：返回 (base_value, 贡献矩阵, 中毒概率, 预测类别)。
+    整批一次计算，命中缓存的行 (批内去重后) 不再重复计算
+    """
+    if models is None:
+        models = current_models()
+    if models.lgb_model is None or models.xgb_model is None:
+        raise HTTPException(status_code=503, detail="Explanations need the native LightGBM / XGBoost boosters, "
+                                                    "which this process did not load (shared compiled state)")
+
+    def compute(rows: pd.DataFrame):
+        with stages("explain"):
+            base, contributions, _ = explain.explain(models.lgb_model, models.xgb_model, models.meta_model, rows,
+                                                     models.cascade_band)
+        return base, contributions
+
+    if prediction_cache is None or prediction_cache.max_explanations <= 0:
+        base, contributions = compute(X)
+    else:
+        owner = (models.lgb_model, models.xgb_model, models.meta_model, models.compiled_ensemble,
+                 models.label_encoders, models.cascade_band)
+        prediction_cache.bind(*owner)
+        with stages("cache_lookup"):
+            keys = prediction_cache.keys(X.to_numpy(dtype=np.float64))
+            base, contributions, missing = prediction_cache.lookup_explanations(keys, len(feature_order))
+        if missing.any():
+            fill_misses(keys, missing, lambda rows: compute(X.iloc[rows]),
+                        lambda unique, b, c: prediction_cache.store_explanations(unique, b, c, owner),
+                        base, contributions)
+    logit = base + contributions.sum(axis=1)
+    return base, contributions, 1.0 / (1.0 + np.exp(-logit)), (logit > 0).astype(np.int64)
+
+
+def explain_payload(data: List[Dict[str, Any]], top: Optional[int] = None) -> Dict[str, Any]:
+    record_batch(len(data))
+    models = current_models()
+    base, contributions, proba, pred = explain_rows(preprocess_data(data, models.feature_encoder), models)
+    ids = np.array([row.get("id") for row in data], dtype=object)
+    columns = columnar_io.build_columns(ids, proba, pred)
+    columns.update(feature_order=feature_order, base_value=base, contributions=contributions)
+    if top:
+        columns["top_features"] = explain.top_features(contributions, feature_order, top)
+    return columns
+
+
+async def score_async(payload: Union[List[Dict[str, Any]], pd.DataFrame], rows: int):
+    """单个请求的打分入口：开启微批时提交到调度器，否则直接计算"""
+    if batcher is None:
+        return score_payloads([payload])[0]
+    try:
+        return await batcher.submit(payload, rows)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+async def score_frame(df: Union[pd.DataFrame, np.ndarray]) -> Dict[str, Any]:
+    """对原始 DataFrame 或已编码特征矩阵打分，返回列式结果"""
+    if len(df) == 0:
+        raise HTTPException(status_code=400, detail="Empty input data")
+
+    if isinstance(df, np.ndarray):
+        # 已按 feature_order 编码好的特征矩阵，跳过预处理
+        ids = None
+        X = pd.DataFrame(df, columns=feature_order)
+        models = current_models()
+        start = time.perf_counter()
+        final_proba, final_pred = await run_in_threadpool(run_ensemble_cached, X, models)
+        if audit_log is not None:
+            audit_log.record(X, final_proba, final_pred, models.version, "binary",
+                             (time.perf_counter() - start) * 1000, encoded=True)
+    else:
+        ids = df["id"].to_numpy() if "id" in df.columns else None
+        final_proba, final_pred = await score_async(df, len(df))
+    return columnar_io.build_columns(ids, final_proba, final_pred)
+
+
+# /explain 单次请求的行数上限 (超过返回 413)：TreeSHAP 比打分慢约两个数量级，大批量会长时间占用工作线程
+EXPLAIN_MAX_ROWS = int(os.getenv("EXPLAIN_MAX_ROWS", 1000))
+
+
+@app.post("/explain", response_class=columnar_io.ColumnarResponse)
+async def explain_predictions(data: List[Dict[str, Any]], top: Optional[int] = Query(None, ge=1)):
+    """
+    逐特征贡献解释，请求体与 /predict 相同。返回列式结果：
+    {"id", "predicted_class", "probability_poisonous", "feature_order": [20 个特征],
+     "base_value": [...], "contributions": [[20 个值], ...], "top_features": [[...], ...] (指定 top 时)}
+    贡献在元模型的 logit 上：base_value + Σ contributions = logit(probability_poisonous)，正值推向有毒
+    """
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty input data")
+    if len(data) > EXPLAIN_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(data)} rows, /explain limit is {EXPLAIN_MAX_ROWS}")
+    return columnar_io.ColumnarResponse(await run_in_threadpool(explain_payload, data, top))
+
+
+@app.post("/predict/columnar", response_class=columnar_io.ColumnarResponse)
+async def predict_columnar(request: Request):
+    """
+    列式 JSON 批量预测，请求体为 {column: [values]}，跳过按行 dict 的构造与校验
+
+    返回: {"id": [...], "predicted_class": [...], "probability_poisonous": [...]}
+    未提供 id 列时 id 为行号
+    """
+    df = columnar_io.parse_columnar_json(await request.body())
+    return columnar_io.ColumnarResponse(await score_frame(df))
+
+
+@app.post("/predict/binary")
+async def predict_binary(request: Request):
+    """
+    二进制批量预测：
+    - Content-Type: application/vnd.apache.arrow.stream (或 .file)：Arrow IPC 表，列名同 JSON 字段
+    - Content-Type: application/x-npy：结构化数组，或已编码的 (n, 20) 数值特征矩阵
+
+    默认返回列式 JSON；Accept 为 Arrow stream 时返回 Arrow IPC
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body = await request.body()
+    if content_type in (columnar_io.ARROW_STREAM, columnar_io.ARROW_FILE):
+        df = columnar_io.read_arrow(body, content_type)
+    elif content_type == columnar_io.NPY:
+        df = columnar_io.read_npy(body, feature_order)
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type or 'missing'}")
+
+    columns = await score_frame(df)
+    if columnar_io.ARROW_STREAM in request.headers.get("accept", ""):
+        return columnar_io.ArrowResponse(columns)
+    return columnar_io.ColumnarResponse(columns)
+
+
+def score_stream_chunk(lines: List[bytes], fmt: str, header: bytes, first_row: int) -> bytes:
+    """解析并打分流式请求中的一块，返回该块的 NDJSON 结果 (在线程池中执行)"""
+    if fmt == "csv":
+        df = columnar_io.parse_csv_lines(header, lines, categorical_cols)
+    else:
+        df = columnar_io.parse_ndjson_lines(lines, first_line=first_row + 1)
+    ids = df["id"].to_numpy() if "id" in df.columns else np.arange(first_row, first_row + len(df))
+    # 批量文件打分不经过预测缓存，避免一次性冲掉交互请求的缓存条目
+    record_batch(len(df))
+    models = current_models()
+    start = time.perf_counter()
+    final_proba, final_pred = run_ensemble(preprocess_data(df, models.feature_encoder), models)
+    if audit_log is not None:
+        audit_log.record(df, final_proba, final_pred, models.version, "stream", (time.perf_counter() - start) * 1000)
+    return columnar_io.ndjson_lines(columnar_io.build_columns(ids, final_proba, final_pred))
+
+
+# /predict/stream 每次解析与推理的行数
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", 10000))
+
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request):
+    """
+    流式批量预测：请求体为 NDJSON (application/x-ndjson，每行一个样本) 或带表头的 CSV (text/csv)，
+    每读满 STREAM_CHUNK_ROWS 行就预处理、推理并立即写回该块的 NDJSON 结果，
+    服务端内存只与块大小有关。中途遇到无法解析的数据时输出一行 {"error": ...} 并结束
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in columnar_io.NDJSON_TYPES:
+        fmt = "ndjson"
+    elif content_type == columnar_io.CSV:
+        fmt = "csv"
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type or 'missing'}")
+
+    spool = columnar_io.ResultSpool()
+
+    async def produce():
+        header, rows = b"", 0
+        try:
+            async for lines in columnar_io.iter_line_chunks(request.stream(), STREAM_CHUNK_ROWS):
+                if fmt == "csv" and not header:
+                    header, lines = lines[0], lines[1:]
+                    if not lines:
+                        continue
+                spool.write(await run_in_threadpool(score_stream_chunk, lines, fmt, header, rows))
+                rows += len(lines)
+        except ValueError as e:
+            spool.write((json.dumps({"error": str(e), "rows_scored": rows}) + "\n").encode("utf-8"))
+        finally:
+            spool.close()
+
+    async def results():
+        producer = asyncio.create_task(produce())
+        try:
+            async for data in spool:
+                yield data
+            await producer
+        finally:
+            producer.cancel()
+            spool.discard()
+
+    return columnar_io.BodyStreamingResponse(results(), media_type=columnar_io.NDJSON)
+
+@app.on_event("startup")
+async def start_batcher():
+    global batcher
+    if MICRO_BATCH:
+        batcher = MicroBatcher(
+            score_payloads,
+            max_batch_rows=MICRO_BATCH_MAX_ROWS,
+            max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+            max_queue=MICRO_BATCH_MAX_QUEUE,
+            workers=MICRO_BATCH_WORKERS,
+        )
+        await batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    global batcher
+    if batcher is not None:
+        await batcher.stop()
+        batcher = None
+
+
+@app.on_event("startup")
+async def start_audit_log():
+    # 在工作进程中启动 (serve.py 的 supervisor 不执行启动事件)，分段文件名带 pid，各进程互不冲突
+    global audit_log
+    if AUDIT_LOG:
+        audit_log = AuditLog(
+            AUDIT_DIR,
+            max_rows=AUDIT_BUFFER_ROWS,
+            flush_interval=AUDIT_FLUSH_INTERVAL,
+            segment_max_bytes=int(AUDIT_SEGMENT_MB * 1024 * 1024),
+            segment_max_seconds=AUDIT_SEGMENT_SECONDS,
+            max_segments=AUDIT_MAX_SEGMENTS,
+            policy=AUDIT_POLICY,
+            block_timeout=AUDIT_BLOCK_TIMEOUT,
+        ).start()
+
+
+@app.on_event("shutdown")
+async def stop_audit_log():
+    global audit_log
+    if audit_log is not None:
+        # 在批处理器停止之后执行：写完缓冲区中剩余的记录并完成当前分段
+        await asyncio.to_thread(audit_log.close)
+        audit_log = None
+
+
+@app.get("/stats/models")
+async def model_stats():
+    """模型格式、各 artifact 的加载耗时 (ms) 与原生 booster 是否已加载"""
+    report = dict(model_load_report)
+    bundle = report.pop("bundle", None)
+    if bundle is not None:
+        report.update(bundle.report())
+    return report
+
+
+@app.get("/stats/cache")
+async def cache_stats():
+    """预测缓存统计：条目数、命中 / 未命中 / 淘汰 / 失效次数"""
+    if prediction_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **prediction_cache.stats()}
+
+
+@app.get("/stats/batcher")
+async def batcher_stats():
+    """微批调度统计：队列深度、批次数、平均批大小与批大小分布"""
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+
+@app.get("/stats/audit")
+async def audit_stats():
+    """审计日志统计：缓冲行数、已写入 / 丢弃行数、分段数与平均刷新耗时"""
+    if audit_log is None:
+        return {"enabled": False}
+    return {"enabled": True, **audit_log.stats()}
+
+
+@app.get("/stats/cascade")
+async def cascade_stats():
+    """级联推理统计：不确定区间、累计行数与升级到 XGBoost + 元模型的行比例"""
+    if cascade_band is None:
+        return {"enabled": False}
+    escalated, lgb_only = cascade_rows.value("escalated"), cascade_rows.value("lgb_only")
+    total = escalated + lgb_only
+    return {
+        "enabled": True,
+        "low": cascade_band.low,
+        "high": cascade_band.high,
+        "rows": int(total),
+        "escalated": int(escalated),
+        "escalated_fraction": escalated / total if total else 0.0,
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的指标：分阶段耗时、批大小、打分行数、缓存命中与 HTTP 请求统计"""
+    return metrics.metrics_response()
+
+# ----------------------------
+# 5. 模型热更新
+# ----------------------------
+# POST /admin/models/reload 在后台线程中加载新版本 (MODEL_DIR/versions/<name>，见 model_versions.py)，
+# 预热全部推理路径并用 parity.json 校验结果后，在锁内一次性替换模型引用 (微秒级)。
+# 正在执行的批次继续使用各自取到的旧快照，新请求立即使用新版本，服务不中断；
+# 上一版本保留在内存中，POST /admin/models/rollback 可立即切回。
+# MODEL_WATCH_INTERVAL>0 时每隔该秒数检查 CURRENT，发生变化后自动热更新
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", 0))
+# 新旧版本在 parity 样本上的预测类别一致率低于该值时拒绝切换 (默认 0 不检查)
+MODEL_RELOAD_MIN_AGREEMENT = float(os.getenv("MODEL_RELOAD_MIN_AGREEMENT", 0))
+PARITY_TOLERANCE = 1e-5
+# 设置后 /admin 接口需要携带请求头 X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+previous_models = None
+reload_lock = threading.Lock()
+reload_history = collections.deque(maxlen=20)
+model_reloads = metrics.REGISTRY.counter("classifier_model_reloads_total", "Model reloads by result", ("result",))
+model_watcher = None
+
+
+class ReloadError(RuntimeError):
+    """新版本未通过检查 (或无法热更新)，当前版本保持不变"""
+
+
+def warmup(models: ModelSet) -> float:
+    """
+    换入之前把新模型的每条推理路径各跑一次：bundle 中 booster 的延迟加载、compiled 数组的页缓存、
+    编码器 pd.Index 的哈希表都在这里完成，切换后的第一个请求不会变慢。返回耗时 (ms)
+    """
+    start = time.perf_counter()
+    X = preprocess_data(synthetic_rows(models.feature_encoder, max(MICRO_BATCH_MAX_ROWS, COMPILED_MAX_ROWS + 1), seed=1),
+                        models.feature_encoder)
+    for n in sorted({1, COMPILED_MAX_ROWS + 1, len(X)}):
+        run_ensemble(X.iloc[:n], models)
+        if models.cascade_band is not None:
+            run_ensemble(X.iloc[:n], full_stack(models))
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def check_parity(models: ModelSet, model_dir: str, current: Optional[ModelSet] = None) -> Dict[str, Any]:
+    """
+    新版本必须在 parity.json 的样本上复现发布时记录的概率 (native 与 compiled 引擎分别检查)，
+    概率必须有限且在 [0, 1] 内；没有 parity.json 时用按词表生成的样本，只检查两种引擎彼此一致。
+    另外计算与当前版本的预测类别一致率，低于 MODEL_RELOAD_MIN_AGREEMENT 时拒绝
+    """
+    parity = model_versions.read_parity(model_dir)
+    if parity is not None:
+        rows, expected = parity["rows"], np.asarray(parity["proba"], dtype=np.float64)
+    else:
+        rows, expected = synthetic_rows(models.feature_encoder, model_versions.PARITY_ROWS), None
+    X = preprocess_data(rows, models.feature_encoder)
+
+    stack = full_stack(models)
+    engines = {}
+    if stack.lgb_model is not None:
+        engines["native"] = replace(stack, compiled_ensemble=None)
+    if stack.compiled_ensemble is not None:
+        engines["compiled"] = replace(stack, lgb_model=None)
+    report = {"source": "parity.json" if parity is not None else "synthetic", "rows": len(X), "max_abs_diff": {}}
+    pred = None
+    for engine, engine_models in engines.items():
+        proba, pred = run_ensemble(X, engine_models)
+        proba = np.asarray(proba, dtype=np.float64)
+        if not (np.isfinite(proba).all() and (proba >= 0).all() and (proba <= 1).all()):
+            raise ReloadError(f"{engine} engine produced invalid probabilities")
+        if expected is None:
+            expected = proba
+            continue
+        diff = float(np.abs(proba - expected).max()) if len(proba) else 0.0
+        report["max_abs_diff"][engine] = diff
+        if diff > PARITY_TOLERANCE:
+            raise ReloadError(f"{engine} engine deviates from the recorded probabilities by {diff:.3g}")
+
+    if current is not None and current.label_encoders is not None:
+        current_pred = run_ensemble(preprocess_data(rows, current.feature_encoder), full_stack(current))[1]
+        agreement = float(np.mean(np.asarray(pred) == np.asarray(current_pred)))
+        report["agreement"] = agreement
+        if agreement < MODEL_RELOAD_MIN_AGREEMENT:
+            raise ReloadError(f"Only {agreement:.2%} of predictions agree with version {current.version}, "
+                              f"below MODEL_RELOAD_MIN_AGREEMENT={MODEL_RELOAD_MIN_AGREEMENT}")
+    return report
+
+
+def reload_models(version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    热更新到指定版本 (默认 CURRENT 指向的版本)：加载 → 预热 → 一致性检查 → 原子替换。
+    任何一步失败都抛出异常并记录在 reload_history 中，当前版本不受影响
+    """
+    global previous_models
+    if shared_state_loaded:
+        raise ReloadError("Workers share the supervisor's model state; send SIGHUP to serve.py to reload")
+    if not reload_lock.acquire(blocking=False):
+        raise ReloadError("Another model reload is in progress")
+    try:
+        base = model_base_dir()
+        if version is None:
+            model_dir, version = model_versions.resolve(base)
+        else:
+            try:
+                model_dir = model_versions.version_dir(base, version)
+            except ValueError as e:
+                raise ReloadError(str(e))
+            if not os.path.isdir(model_dir):
+                raise ReloadError(f"Unknown model version: {version}")
+
+        entry = {"version": version, "path": model_dir, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        reload_history.append(entry)
+        try:
+            start = time.perf_counter()
+            models = load_model_set(model_dir, version)
+            entry["load_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            entry["warmup_ms"] = warmup(models)
+            current = current_models()
+            entry["parity"] = check_parity(models, model_dir, current)
+        except Exception as e:
+            entry.update(result="rejected", error=str(e))
+            model_reloads.inc(1, "rejected")
+            print(f"❌ Model reload to {model_dir} rejected, keeping version {current_models().version}: {e}")
+            raise
+
+        start = time.perf_counter()
+        install(models)
+        entry["swap_us"] = round((time.perf_counter() - start) * 1e6, 1)
+        previous_models = current
+        if version is not None and model_versions.read_current(base) != version:
+            model_versions.write_current(base, version)
+        entry["result"] = "ok"
+        model_reloads.inc(1, "ok")
+        print(f"🔄 Model version {version or model_dir} installed (load {entry['load_ms']:.0f} ms, "
+              f"warmup {entry['warmup_ms']:.0f} ms, swap {entry['swap_us']:.0f} µs)")
+        return entry
+    finally:
+        reload_lock.release()
+
+
+def rollback_models() -> Dict[str, Any]:
+    """切回热更新之前的版本 (仍在内存中，无需重新加载)"""
+    global previous_models
+    if not reload_lock.acquire(blocking=False):
+        raise ReloadError("Another model reload is in progress")
+    try:
+        if previous_models is None:
+            raise ReloadError("No previous model version to roll back to")
+        current = current_models()
+        start = time.perf_counter()
+        install(previous_models)
+        entry = {"version": previous_models.version, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "result": "rollback", "swap_us": round((time.perf_counter() - start) * 1e6, 1)}
+        previous_models = current
+        if entry["version"] is not None:
+            model_versions.write_current(model_base_dir(), entry["version"])
+        reload_history.append(entry)
+        model_reloads.inc(1, "rollback")
+        print(f"↩️ Rolled back to model version {entry['version']}")
+        return entry
+    finally:
+        reload_lock.release()
+
+
+def check_admin_token(request: Request):
+    if ADMIN_TOKEN and not secrets.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+async def run_admin(action, *args):
+    try:
+        return await run_in_threadpool(action, *args)
+    except ReloadError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model reload failed: {e}")
+
+
+@app.post("/admin/models/reload")
+async def admin_reload_models(request: Request, version: Optional[str] = None):
+    """热更新到 version (默认 CURRENT)。未通过预热 / 一致性检查时返回 409，当前版本继续服务"""
+    check_admin_token(request)
+    return await run_admin(reload_models, version)
+
+
+@app.post("/admin/models/rollback")
+async def admin_rollback_models(request: Request):
+    """立即切回上一个版本"""
+    check_admin_token(request)
+    return await run_admin(rollback_models)
+
+
+@app.get("/admin/models")
+async def admin_models(request: Request):
+    """当前 / 上一版本、磁盘上的全部版本与最近的热更新记录"""
+    check_admin_token(request)
+    return {
+        "version": model_version,
+        "previous": previous_models.version if previous_models is not None else None,
+        "versions": model_versions.list_versions(model_base_dir()),
+        "history": list(reload_history),
+    }
+
+
+async def watch_current():
+    """MODEL_WATCH_INTERVAL>0 时轮询 CURRENT，指向新版本后自动热更新 (被拒绝的版本不再重试)"""
+    base, rejected = model_base_dir(), None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        name = model_versions.read_current(base)
+        if name is None or name == model_version or name == rejected:
+            continue
+        try:
+            await run_in_threadpool(reload_models, name)
+        except Exception:
+            rejected = name
+
+
+@app.on_event("startup")
+async def start_model_watcher():
+    global model_watcher
+    if MODEL_WATCH_INTERVAL > 0 and not shared_state_loaded:
+        model_watcher = asyncio.create_task(watch_current())
+
+
+@app.on_event("shutdown")
+async def stop_model_watcher():
+    global model_watcher
+    if model_watcher is not None:
+        model_watcher.cancel()
+        model_watcher = None
+
 # ----------------------------
-# 5. 健康检查
+# 6. 健康检查
 # ----------------------------
 @app.get("/")
 async def root():
@@ -0,0 +1,273 @@
+import asyncio
+import collections
+import io
+import json
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，缺失时退回标准库 json
+    orjson = None
+
+# ----------------------------
+# 列式 / 二进制请求体解析与列式响应
+# ----------------------------
+# 批量打分时按行的 JSON 对象数组 (List[Dict]) 会为每一行构造 dict 并逐个校验，
+# 这里直接把 {column: [values]}、Arrow IPC、.npy 请求体解析成 DataFrame / 特征矩阵。
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+NPY = "application/x-npy"
+NDJSON = "application/x-ndjson"
+NDJSON_TYPES = (NDJSON, "application/jsonl", "application/json-lines")
+CSV = "text/csv"
+
+
+def loads_json(body: bytes) -> Any:
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def parse_columnar_json(body: bytes) -> pd.DataFrame:
+    """解析 {column: [values]} 格式的请求体"""
+    try:
+        payload = loads_json(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+
+    if not isinstance(payload, dict) or not all(isinstance(v, list) for v in payload.values()):
+        raise HTTPException(status_code=400, detail="Columnar body must be an object of {column: [values]}")
+    lengths = {len(v) for v in payload.values()}
+    if len(lengths) > 1:
+        raise HTTPException(status_code=400, detail=f"Columns have different lengths: {sorted(lengths)}")
+    return pd.DataFrame(payload)
+
+
+def read_arrow(body: bytes, content_type: str) -> pd.DataFrame:
+    """解析 Arrow IPC (stream / file) 请求体"""
+    import pyarrow as pa
+
+    try:
+        if content_type == ARROW_FILE:
+            table = pa.ipc.open_file(pa.BufferReader(body)).read_all()
+        else:
+            table = pa.ipc.open_stream(pa.BufferReader(body)).read_all()
+    except pa.ArrowInvalid as e:
+        raise HTTPException(status_code=400, detail=f"Invalid Arrow IPC body: {e}")
+    return table.to_pandas()
+
+
+def read_npy(body: bytes, feature_order: List[str]):
+    """
+    解析 .npy 请求体：
+    - 结构化数组 (字段名即列名)：返回原始值 DataFrame，仍需预处理
+    - 二维数值数组 (n, 20)：视为已按 feature_order 编码好的特征矩阵，直接返回 ndarray
+    """
+    try:
+        arr = np.load(io.BytesIO(body), allow_pickle=False)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid .npy body: {e}")
+
+    if arr.dtype.names:
+        return pd.DataFrame({name: arr[name] for name in arr.dtype.names})
+    if arr.ndim == 2 and arr.shape[1] == len(feature_order) and np.issubdtype(arr.dtype, np.number):
+        return arr
+    raise HTTPException(
+        status_code=400,
+        detail=f"Unsupported .npy payload: expected a structured array or a numeric (n, {len(feature_order)}) matrix",
+    )
+
+
+def build_columns(ids: Optional[np.ndarray], proba: np.ndarray, pred: np.ndarray) -> Dict[str, Any]:
+    """构造列式结果：{"id": [...], "predicted_class": [...], "probability_poisonous": [...]}"""
+    if ids is None:
+        ids = np.arange(len(proba))
+    elif ids.dtype.kind not in "iuf":
+        ids = ids.tolist()  # 字符串 / 混合类型 id 无法直接按 numpy 序列化
+    return {
+        "id": ids,
+        "predicted_class": np.where(pred == 1, "p", "e").tolist(),
+        "probability_poisonous": np.ascontiguousarray(proba, dtype=np.float64),
+    }
+
+
+class ColumnarResponse(Response):
+    """列式 JSON 响应：有 orjson 时直接序列化 numpy 数组，否则 tolist 后交给 json"""
+    media_type = "application/json"
+
+    def render(self, content: Dict[str, Any]) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(
+            {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in content.items()},
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+
+class ArrowResponse(Response):
+    """Arrow IPC stream 响应，供二进制客户端直接读回列式结果"""
+    media_type = ARROW_STREAM
+
+    def render(self, content: Dict[str, Any]) -> bytes:
+        import pyarrow as pa
+
+        table = pa.table({k: np.asarray(v) for k, v in content.items()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+# ----------------------------
+# 流式 NDJSON / CSV 批量打分
+# ----------------------------
+# 请求体按到达的字节块逐行切分，凑满 chunk_rows 行交给调用方解析与打分，
+# 内存中只保留当前块和未完成的半行，与输入文件大小无关。
+# 多数 HTTP/1.1 客户端 (requests / httpx) 发完整个请求体才开始读响应，若读请求体与写响应
+# 在同一个协程里交替进行，响应写满 socket 缓冲后就不再读请求体，双方互相等待。
+# 因此读取与打分放在独立任务中，结果先进入 ResultSpool (超出内存上限的部分落到临时文件)。
+
+async def iter_line_chunks(byte_stream: AsyncIterator[bytes], chunk_rows: int) -> AsyncIterator[List[bytes]]:
+    """把字节流切成每块最多 chunk_rows 个非空行 (去掉行尾的 \r)"""
+    pending = b""
+    lines: List[bytes] = []
+    async for data in byte_stream:
+        if not data:
+            continue
+        parts = (pending + data).split(b"\n")
+        pending = parts.pop()
+        for line in parts:
+            line = line.rstrip(b"\r")
+            if line.strip():
+                lines.append(line)
+                if len(lines) >= chunk_rows:
+                    yield lines
+                    lines = []
+    pending = pending.rstrip(b"\r")
+    if pending.strip():
+        lines.append(pending)
+    if lines:
+        yield lines
+
+
+def parse_ndjson_lines(lines: List[bytes], first_line: int = 1) -> pd.DataFrame:
+    """每行一个 JSON 对象；出错时的 ValueError 带上全局行号"""
+    records = []
+    for i, line in enumerate(lines):
+        try:
+            record = loads_json(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON on line {first_line + i}: {e}")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {first_line + i} is not a JSON object")
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def parse_csv_lines(header: bytes, lines: List[bytes], str_columns: Sequence[str]) -> pd.DataFrame:
+    """
+    以表头 + 当前块的行解析 CSV。类别列固定按字符串读取，
+    避免某一块里恰好全为数字 / 全为空时推断出不同的类型
+    """
+    try:
+        return pd.read_csv(
+            io.BytesIO(header + b"\n" + b"\n".join(lines)),
+            dtype={col: str for col in str_columns},
+        )
+    except (ValueError, pd.errors.ParserError) as e:
+        raise ValueError(f"Invalid CSV chunk: {e}")
+
+
+def ndjson_lines(columns: Dict[str, Any]) -> bytes:
+    """把 build_columns 的列式结果写成 NDJSON，每行一个结果对象"""
+    ids = columns["id"].tolist() if isinstance(columns["id"], np.ndarray) else columns["id"]
+    rows = zip(ids, columns["predicted_class"], columns["probability_poisonous"].tolist())
+    if orjson is not None:
+        dumps = orjson.dumps
+        return b"".join(
+            dumps({"id": i, "predicted_class": c, "probability_poisonous": p}) + b"\n" for i, c, p in rows
+        )
+    return "".join(
+        json.dumps({"id": i, "predicted_class": c, "probability_poisonous": p}, separators=(",", ":")) + "\n"
+        for i, c, p in rows
+    ).encode("utf-8")
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    边读请求体边写响应的流式响应。
+    StreamingResponse 在 ASGI spec < 2.4 时会并发监听断开事件，那个协程会与 request.stream()
+    抢读 (并丢弃) 尚未读完的请求体消息；这里只写响应，客户端断开由 request.stream() 抛出
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+class ResultSpool:
+    """
+    单生产者 / 单消费者的结果缓冲：生产者写入永不阻塞，内存中最多保留 memory_limit 字节，
+    客户端读得慢时后续结果按顺序追加到临时文件，消费者读空文件后重新回到内存缓冲
+    """
+
+    def __init__(self, memory_limit: int = 8 << 20, read_size: int = 1 << 20):
+        self.memory_limit = memory_limit
+        self.read_size = read_size
+        self.spilled_bytes = 0
+        self._memory = collections.deque()
+        self._memory_bytes = 0
+        self._file = None
+        self._read_pos = 0
+        self._write_pos = 0
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def write(self, data: bytes):
+        # 文件中还有未读数据时必须继续写文件，保证输出顺序
+        if self._write_pos == self._read_pos and self._memory_bytes + len(data) <= self.memory_limit:
+            self._memory.append(data)
+            self._memory_bytes += len(data)
+        else:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile()
+            self._file.seek(self._write_pos)
+            self._file.write(data)
+            self._write_pos += len(data)
+            self.spilled_bytes += len(data)
+        self._ready.set()
+
+    def close(self):
+        self._closed = True
+        self._ready.set()
+
+    def discard(self):
+        self._memory.clear()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def __aiter__(self):
+        while True:
+            if self._memory:
+                data = self._memory.popleft()
+                self._memory_bytes -= len(data)
+                yield data
+            elif self._read_pos < self._write_pos:
+                self._file.seek(self._read_pos)
+                data = self._file.read(min(self.read_size, self._write_pos - self._read_pos))
+                self._read_pos += len(data)
+                if self._read_pos == self._write_pos:  # 文件已读空，复用并回到内存缓冲
+                    self._file.seek(0)
+                    self._file.truncate()
+                    self._read_pos = self._write_pos = 0
+                yield data
+            elif self._closed:
+                return
+            else:
+                self._ready.clear()
+                await self._ready.wait()
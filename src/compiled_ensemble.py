@@ -0,0 +1,311 @@
+"""
+编译后的 Stacking 推理引擎：LightGBM + XGBoost + 逻辑回归元模型
+
+导出步骤把两个 booster 的所有树展平成连续的 NumPy 节点数组 (全局节点编号)，
+逻辑回归元模型折叠为两个权重和一个截距。推理时所有树按层同步前进，
+一次向量化遍历完成整套 Stacking 打分，不再经过三个库各自的输入转换与线程调度。
+
+用法 (项目根目录):
+    python src/compiled_ensemble.py --model-dir models --out models/compiled
+"""
+import argparse
+import json
+import os
+from typing import Dict, Tuple
+
+import numpy as np
+
+# LightGBM 的缺失值类型
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_LGB_MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+# LightGBM 判断“零值”的阈值 (kZeroThreshold)
+_ZERO_THRESHOLD = 1e-35
+
+# 单次向量化遍历的最大行数，(rows, trees) 中间矩阵保持在 CPU 缓存可容纳的规模
+CHUNK_ROWS = 256
+
+_FOREST_FIELDS = ("feature", "threshold", "left", "nan_left", "zero_default", "value", "roots")
+
+
+class Forest:
+    """
+    展平后的树集合。所有节点按全局编号存放，右孩子固定为 left + 1；
+    叶子节点的阈值为 +inf 且左孩子指向自身，因此遍历 max_depth 层后每棵树都停在叶子上。
+
+    比较规则统一为 x <= threshold：
+    - XGBoost 的 x < t 在导出时改写为 x <= prev_float32(t)
+    - NaN 的走向预先算好存入 nan_left (LightGBM 缺失类型为 None 时 NaN 按 0 比较)
+    - zero_default 标记 LightGBM 缺失类型为 Zero 的切分，0 值走默认方向 (即 nan_left)
+    """
+
+    def __init__(self, feature, threshold, left, nan_left, zero_default, value, roots,
+                 max_depth: int, base_margin: float, dtype: str):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.nan_left = nan_left
+        self.zero_default = zero_default
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.base_margin = float(base_margin)
+        # 特征与阈值的比较精度：LightGBM 为 float64，XGBoost 为 float32
+        self.dtype = np.dtype(dtype)
+        self.has_zero_default = bool(zero_default.any())
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def margin(self, X: np.ndarray) -> np.ndarray:
+        """返回每行的原始得分 (logit)"""
+        X = np.ascontiguousarray(X, dtype=self.dtype)
+        if len(X) == 1:
+            return np.array([self._margin_row(X[0])])
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), CHUNK_ROWS):
+            out[start:start + CHUNK_ROWS] = self._margin_block(X[start:start + CHUNK_ROWS])
+        return out
+
+    def _next(self, node, x, check_nan: bool):
+        """根据特征值 x 计算 node 的下一跳，node 与 x 形状相同"""
+        go_left = x <= self.threshold[node]
+        if check_nan:
+            # NaN <= t 恒为 False，只需补上 NaN 走左子树的情况
+            go_left |= np.isnan(x) & self.nan_left[node]
+        if self.has_zero_default:
+            is_zero = (np.abs(x) <= _ZERO_THRESHOLD) & self.zero_default[node]
+            go_left = np.where(is_zero, self.nan_left[node], go_left)
+        return self.left[node] + ~go_left
+
+    def _margin_block(self, X: np.ndarray) -> np.ndarray:
+        n_features = X.shape[1]
+        flat = X.ravel()
+        offsets = (np.arange(len(X), dtype=np.int32) * n_features)[:, None]
+        check_nan = bool(np.isnan(flat).any())
+        node = np.broadcast_to(self.roots, (len(X), self.n_trees))
+        for _ in range(self.max_depth):
+            node = self._next(node, flat[offsets + self.feature[node]], check_nan)
+        return self.base_margin + self.value[node].sum(axis=1)
+
+    def _margin_row(self, x: np.ndarray) -> float:
+        """单行快速路径：只维护 (n_trees,) 的一维节点向量"""
+        check_nan = bool(np.isnan(x).any())
+        node = self.roots
+        for _ in range(self.max_depth):
+            node = self._next(node, x[self.feature[node]], check_nan)
+        return self.base_margin + float(self.value[node].sum())
+
+    # ---------- 序列化 ----------
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in _FOREST_FIELDS}
+
+    def params(self) -> Dict:
+        return {"max_depth": self.max_depth, "base_margin": self.base_margin, "dtype": self.dtype.name}
+
+
+class _ForestBuilder:
+    """按全局编号累积节点，分裂节点的两个孩子总是分配在相邻位置"""
+
+    def __init__(self):
+        self.feature, self.threshold, self.left = [], [], []
+        self.nan_left, self.zero_default, self.value = [], [], []
+        self.roots = []
+        self.max_depth = 0
+
+    def alloc(self, count: int) -> int:
+        start = len(self.feature)
+        for _ in range(count):
+            self.feature.append(0)
+            self.threshold.append(np.inf)
+            self.left.append(0)
+            self.nan_left.append(True)
+            self.zero_default.append(False)
+            self.value.append(0.0)
+        return start
+
+    def set_split(self, i, feature, threshold, nan_left, zero_default=False) -> int:
+        """把节点 i 设为分裂节点，返回左孩子编号 (右孩子为其 +1)"""
+        children = self.alloc(2)
+        self.feature[i], self.threshold[i] = feature, threshold
+        self.left[i] = children
+        self.nan_left[i], self.zero_default[i] = nan_left, zero_default
+        return children
+
+    def set_leaf(self, i, value, depth):
+        self.left[i] = i
+        self.value[i] = value
+        self.max_depth = max(self.max_depth, depth)
+
+    def build(self, base_margin: float, dtype: str) -> Forest:
+        return Forest(
+            feature=np.asarray(self.feature, dtype=np.int32),
+            threshold=np.asarray(self.threshold, dtype=dtype),
+            left=np.asarray(self.left, dtype=np.int32),
+            nan_left=np.asarray(self.nan_left, dtype=bool),
+            zero_default=np.asarray(self.zero_default, dtype=bool),
+            value=np.asarray(self.value, dtype=np.float64),
+            roots=np.asarray(self.roots, dtype=np.int32),
+            max_depth=self.max_depth,
+            base_margin=base_margin,
+            dtype=dtype,
+        )
+
+
+def forest_from_lightgbm(booster) -> Forest:
+    """从 lightgbm.Booster 导出 (仅支持二分类、数值型切分)"""
+    dump = booster.dump_model(num_iteration=booster.best_iteration or None)
+    objective = dump["objective"].split()
+    if objective[0] != "binary" or dump.get("average_output"):
+        raise NotImplementedError(f"Unsupported LightGBM objective: {dump['objective']}")
+    sigmoid = dict(p.split(":") for p in objective[1:]).get("sigmoid", "1")
+    if float(sigmoid) != 1.0:
+        raise NotImplementedError(f"Unsupported LightGBM sigmoid parameter: {sigmoid}")
+
+    builder = _ForestBuilder()
+
+    def visit(node, i, depth):
+        if "leaf_value" in node:
+            builder.set_leaf(i, node["leaf_value"], depth)
+            return
+        if node["decision_type"] != "<=":
+            raise NotImplementedError("Categorical LightGBM splits are not supported")
+        missing_type = _LGB_MISSING_TYPES[node["missing_type"]]
+        threshold = node["threshold"]
+        # 缺失类型为 None 时 NaN 按 0 参与比较，否则走默认方向
+        nan_left = (0.0 <= threshold) if missing_type == MISSING_NONE else node["default_left"]
+        left = builder.set_split(i, node["split_feature"], threshold, nan_left, missing_type == MISSING_ZERO)
+        visit(node["left_child"], left, depth + 1)
+        visit(node["right_child"], left + 1, depth + 1)
+
+    for tree in dump["tree_info"]:
+        root = builder.alloc(1)
+        builder.roots.append(root)
+        visit(tree["tree_structure"], root, 0)
+    return builder.build(base_margin=0.0, dtype="float64")
+
+
+def forest_from_xgboost(booster) -> Forest:
+    """从 xgboost.Booster 导出 (仅支持 gbtree + binary:logistic、数值型切分)"""
+    model = json.loads(booster.save_raw("json"))["learner"]
+    if model["objective"]["name"] != "binary:logistic" or model["gradient_booster"]["name"] != "gbtree":
+        raise NotImplementedError("Only gbtree boosters with binary:logistic are supported")
+
+    trees = model["gradient_booster"]["model"]["trees"]
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is not None:
+        trees = trees[:int(best_iteration) + 1]
+
+    # base_score 以概率形式保存 (XGBoost 3.x 中为 "[5E-1]" 这样的向量字符串)
+    base_score = float(model["learner_model_param"]["base_score"].strip("[]"))
+    base_margin = float(np.log(base_score / (1.0 - base_score)))
+
+    builder = _ForestBuilder()
+    for tree in trees:
+        if any(tree["split_type"]):
+            raise NotImplementedError("Categorical XGBoost splits are not supported")
+        left, right = tree["left_children"], tree["right_children"]
+        conditions = tree["split_conditions"]
+
+        root = builder.alloc(1)
+        builder.roots.append(root)
+        # (XGBoost 节点编号, 全局编号, 深度)，XGBoost 的孩子编号不一定相邻，需要重新分配
+        stack = [(0, root, 0)]
+        while stack:
+            j, i, depth = stack.pop()
+            if left[j] == -1:
+                builder.set_leaf(i, float(np.float32(conditions[j])), depth)
+                continue
+            # XGBoost 在 float32 下比较 x < t，等价于 x <= t 的前一个 float32；缺失值走 default_left
+            threshold = np.nextafter(np.float32(conditions[j]), np.float32(-np.inf))
+            child = builder.set_split(i, tree["split_indices"][j], threshold, bool(tree["default_left"][j]))
+            stack.append((left[j], child, depth + 1))
+            stack.append((right[j], child + 1, depth + 1))
+    return builder.build(base_margin=base_margin, dtype="float32")
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class CompiledEnsemble:
+    """LGB + XGB 两个森林与折叠后的逻辑回归元模型"""
+
+    def __init__(self, lgb: Forest, xgb: Forest, coef: Tuple[float, float], intercept: float):
+        self.lgb = lgb
+        self.xgb = xgb
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    @classmethod
+    def from_models(cls, lgb_model, xgb_model, meta_model) -> "CompiledEnsemble":
+        """从 sklearn 包装的 LGBMClassifier / XGBClassifier / LogisticRegression 导出"""
+        return cls(
+            lgb=forest_from_lightgbm(lgb_model.booster_),
+            xgb=forest_from_xgboost(xgb_model.get_booster()),
+            coef=meta_model.coef_.ravel(),
+            intercept=meta_model.intercept_[0],
+        )
+
+    def base_proba(self, X: np.ndarray):
+        """两个基模型的中毒概率"""
+        return _sigmoid(self.lgb.margin(X)), _sigmoid(self.xgb.margin(X))
+
+    def predict(self, X: np.ndarray):
+        """返回 (中毒概率, 预测类别)，元模型的线性输出只计算一次"""
+        X = np.asarray(X, dtype=np.float64)
+        lgb_proba, xgb_proba = self.base_proba(X)
+        decision = self.coef[0] * lgb_proba + self.coef[1] * xgb_proba + self.intercept
+        return _sigmoid(decision), (decision > 0).astype(np.int64)
+
+    # ---------- 序列化 ----------
+    def save(self, path: str):
+        """保存为目录：每个节点数组一个 .npy (可内存映射) + ensemble.json"""
+        os.makedirs(path, exist_ok=True)
+        for prefix, forest in (("lgb", self.lgb), ("xgb", self.xgb)):
+            for name, arr in forest.arrays().items():
+                np.save(os.path.join(path, f"{prefix}_{name}.npy"), arr)
+        meta = {
+            "lgb": self.lgb.params(),
+            "xgb": self.xgb.params(),
+            "meta": {"coef": self.coef.tolist(), "intercept": self.intercept},
+        }
+        with open(os.path.join(path, "ensemble.json"), "w") as f:
+            json.dump(meta, f, indent=4)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "r") -> "CompiledEnsemble":
+        with open(os.path.join(path, "ensemble.json")) as f:
+            meta = json.load(f)
+
+        def load_forest(prefix):
+            arrays = {
+                name: np.load(os.path.join(path, f"{prefix}_{name}.npy"), mmap_mode=mmap_mode)
+                for name in _FOREST_FIELDS
+            }
+            return Forest(**arrays, **meta[prefix])
+
+        return cls(load_forest("lgb"), load_forest("xgb"), meta["meta"]["coef"], meta["meta"]["intercept"])
+
+
+def main():
+    import joblib
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--out", default=None, help="输出目录，默认 <model-dir>/compiled")
+    args = parser.parse_args()
+
+    ensemble = CompiledEnsemble.from_models(
+        joblib.load(os.path.join(args.model_dir, "lgb_model.pkl")),
+        joblib.load(os.path.join(args.model_dir, "xgb_model.pkl")),
+        joblib.load(os.path.join(args.model_dir, "meta_model.pkl")),
+    )
+    out = args.out or os.path.join(args.model_dir, "compiled")
+    ensemble.save(out)
+    print(f"✅ Compiled ensemble saved to {out} "
+          f"(lgb: {ensemble.lgb.n_trees} trees, xgb: {ensemble.xgb.n_trees} trees)")
+
+
+if __name__ == "__main__":
+    main()
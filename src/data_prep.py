@@ -0,0 +1,265 @@
+"""
+训练数据准备：快速读取 train.csv / test.csv，编码为紧凑的数值矩阵并缓存
+
+train_model.ipynb 中的做法是 pandas 默认类型读取 (类别列为 Python 字符串对象)，再对每个类别列
+astype(str) + 在 train+test 拼接结果上拟合 LabelEncoder，3M 行需要数 GB 内存且每次运行都重复。
+这里用 pyarrow 多线程读取，类别列直接读成字典编码 (每个唯一字符串只存一份)，再把字典映射到
+与 LabelEncoder 完全相同的编码 (排序后的位置，缺失值为 'nan')：类别列为 int8 / int16，数值列为 float32。
+
+编码结果与词表写入缓存目录 (Parquet + JSON)，缓存键为输入文件的 sha256；
+词表导出的 label_encoders.pkl 与 classifier_api.preprocess_data 在推理时的编码一致。
+
+用法 (项目根目录):
+    python src/data_prep.py --train kaggle/input/train.csv --test kaggle/input/test.csv
+    python src/data_prep.py --train ... --test ... --export-encoders models/label_encoders.pkl
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+try:
+    from src.classifier_api import categorical_cols, feature_order, numeric_cols
+    from src.model_bundle import file_sha256
+except ImportError:  # 以脚本方式运行 (python src/data_prep.py)
+    from classifier_api import categorical_cols, feature_order, numeric_cols
+    from model_bundle import file_sha256
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不统计峰值内存
+    resource = None
+
+# 编码方式变化时递增，使旧缓存失效
+DATA_PREP_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join("cache", "data_prep")
+TARGET = "class"
+TARGET_MAP = {"e": 0, "p": 1}
+# pandas.read_csv 默认识别为缺失值的字符串 (pandas._libs.parsers.STR_NA_VALUES，astype(str) 后都成为 'nan')，
+# pyarrow 按同一集合处理；' ' 不在其中，在 notebook 中是单独的一个类别
+PANDAS_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+@dataclass
+class PreparedData:
+    X_train: pd.DataFrame            # feature_order 列，类别列为 LabelEncoder 编码 (int8/int16)，数值列 float32
+    y: Optional[pd.Series]           # 0 = e, 1 = p (int8)
+    X_test: Optional[pd.DataFrame]
+    test_ids: Optional[pd.Series]
+    vocabularies: Dict[str, List[str]]
+    report: Dict[str, Any] = field(default_factory=dict)
+
+    def label_encoders(self):
+        """与 notebook 中拟合结果相同的 LabelEncoder 字典，可直接保存为 models/label_encoders.pkl"""
+        from sklearn.preprocessing import LabelEncoder
+
+        encoders = {}
+        for col, classes in self.vocabularies.items():
+            le = LabelEncoder()
+            le.classes_ = np.asarray(classes, dtype=object)
+            encoders[col] = le
+        return encoders
+
+
+# ----------------------------
+# 1. 读取
+# ----------------------------
+def read_csv(path: str) -> pa.Table:
+    """类别列读成字典编码的字符串，数值列读成 float32"""
+    column_types = {col: pa.dictionary(pa.int32(), pa.string()) for col in categorical_cols}
+    column_types.update({col: pa.float32() for col in numeric_cols})
+    column_types[TARGET] = pa.dictionary(pa.int32(), pa.string())
+    return pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types=column_types, null_values=PANDAS_NA_VALUES, strings_can_be_null=True,
+    ))
+
+
+def column_values(table: pa.Table, col: str) -> set:
+    """某列全部 chunk 中出现的字符串 (缺失记为 'nan')"""
+    values = set()
+    for chunk in table.column(col).chunks:
+        values.update(v for v in chunk.dictionary.to_pylist() if v is not None)
+        if chunk.null_count:
+            values.add("nan")
+    return values
+
+
+def encode_column(table: pa.Table, col: str, index: pd.Index, dtype) -> np.ndarray:
+    """把字典编码列映射到词表中的位置：每个 chunk 只对字典 (唯一值) 查表，再按 indices 取值"""
+    parts = []
+    nan_code = index.get_loc("nan") if "nan" in index else -1
+    for chunk in table.column(col).chunks:
+        remap = index.get_indexer(chunk.dictionary.to_numpy(zero_copy_only=False)).astype(dtype)
+        remap = np.append(remap, np.asarray(nan_code, dtype=dtype))  # 最后一项给缺失值
+        indices = chunk.indices.fill_null(len(remap) - 1).to_numpy()
+        parts.append(remap[indices])
+    return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+
+def encode_tables(train: pa.Table, test: Optional[pa.Table]):
+    """
+    与 notebook 相同的编码：词表为 train (+ test) 中 astype(str) 后出现的全部字符串的排序结果，
+    编码值为其在词表中的位置
+    """
+    vocabularies = {}
+    frames = []
+    for col in categorical_cols:
+        values = column_values(train, col)
+        if test is not None:
+            values |= column_values(test, col)
+        vocabularies[col] = sorted(values)
+
+    for table in (train, test):
+        if table is None:
+            frames.append(None)
+            continue
+        columns = {}
+        for col in feature_order:
+            if col in numeric_cols:
+                columns[col] = table.column(col).to_numpy()
+            else:
+                vocab = vocabularies[col]
+                dtype = np.int8 if len(vocab) <= np.iinfo(np.int8).max + 1 else np.int16
+                columns[col] = encode_column(table, col, pd.Index(vocab, dtype=object), dtype)
+        frames.append(pd.DataFrame(columns))
+    return frames[0], frames[1], vocabularies
+
+
+# ----------------------------
+# 2. 缓存
+# ----------------------------
+def cache_key(train_path: str, test_path: Optional[str]) -> str:
+    digest = hashlib.sha256(f"v{DATA_PREP_VERSION}:{','.join(feature_order)}".encode())
+    for path in (train_path, test_path):
+        digest.update(file_sha256(path).encode() if path else b"-")
+    return digest.hexdigest()[:20]
+
+
+def write_cache(path: str, data: PreparedData, meta: Dict[str, Any]):
+    tmp = path + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    train = data.X_train.assign(**{TARGET: data.y.to_numpy()}) if data.y is not None else data.X_train
+    pq.write_table(pa.Table.from_pandas(train, preserve_index=False), os.path.join(tmp, "train.parquet"))
+    if data.X_test is not None:
+        test = data.X_test.assign(id=data.test_ids.to_numpy()) if data.test_ids is not None else data.X_test
+        pq.write_table(pa.Table.from_pandas(test, preserve_index=False), os.path.join(tmp, "test.parquet"))
+    with open(os.path.join(tmp, "vocabularies.json"), "w", encoding="utf-8") as f:
+        json.dump(data.vocabularies, f, ensure_ascii=False)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    # 整个目录写完后再改名，中断时不会留下半成品缓存
+    os.replace(tmp, path)
+
+
+def read_cache(path: str) -> PreparedData:
+    train = pd.read_parquet(os.path.join(path, "train.parquet"))
+    y = train.pop(TARGET) if TARGET in train.columns else None
+    X_test = test_ids = None
+    if os.path.exists(os.path.join(path, "test.parquet")):
+        X_test = pd.read_parquet(os.path.join(path, "test.parquet"))
+        test_ids = X_test.pop("id") if "id" in X_test.columns else None
+    with open(os.path.join(path, "vocabularies.json"), encoding="utf-8") as f:
+        vocabularies = json.load(f)
+    return PreparedData(train[feature_order], y, X_test[feature_order] if X_test is not None else None,
+                        test_ids, vocabularies)
+
+
+# ----------------------------
+# 3. 入口
+# ----------------------------
+def load_training_data(train_path: str, test_path: Optional[str] = None, cache_dir: str = DEFAULT_CACHE_DIR,
+                       refresh: bool = False) -> PreparedData:
+    """
+    返回编码好的训练 / 测试矩阵。缓存命中时直接读取 Parquet；
+    未提供 test_path 时词表只来自 train (notebook 的词表包含 test 中出现的值)
+    """
+    start = time.perf_counter()
+    key = cache_key(train_path, test_path)
+    hash_s = time.perf_counter() - start
+    path = os.path.join(cache_dir, key) if cache_dir else None
+    report: Dict[str, Any] = {"key": key, "hash_s": round(hash_s, 3)}
+
+    if path and os.path.exists(path) and not refresh:
+        data = read_cache(path)
+        report["cache"] = "hit"
+    else:
+        read_start = time.perf_counter()
+        train = read_csv(train_path)
+        test = read_csv(test_path) if test_path else None
+        report["read_s"] = round(time.perf_counter() - read_start, 3)
+
+        encode_start = time.perf_counter()
+        X_train, X_test, vocabularies = encode_tables(train, test)
+        y = None
+        if TARGET in train.column_names:
+            labels = train.column(TARGET).to_pandas().astype(object).map(TARGET_MAP)
+            y = pd.Series(labels.to_numpy(dtype=np.int8), name=TARGET)
+        test_ids = pd.Series(test.column("id").to_numpy(), name="id") if test is not None else None
+        del train, test
+        report["encode_s"] = round(time.perf_counter() - encode_start, 3)
+
+        data = PreparedData(X_train, y, X_test, test_ids, vocabularies)
+        report["cache"] = "miss" if path else "disabled"
+        if path:
+            write_start = time.perf_counter()
+            write_cache(path, data, {
+                "version": DATA_PREP_VERSION,
+                "train": os.path.abspath(train_path),
+                "test": os.path.abspath(test_path) if test_path else None,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            })
+            report["write_s"] = round(time.perf_counter() - write_start, 3)
+
+    frames = [data.X_train] + ([data.X_test] if data.X_test is not None else [])
+    report.update({
+        "rows_train": len(data.X_train),
+        "rows_test": len(data.X_test) if data.X_test is not None else 0,
+        "memory_mb": round(sum(int(f.memory_usage(deep=True).sum()) for f in frames) / 1e6, 1),
+        "load_s": round(time.perf_counter() - start, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1) if resource is not None else None,
+    })
+    data.report = report
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--train", default=os.path.join("kaggle", "input", "train.csv"))
+    parser.add_argument("--test", default=os.path.join("kaggle", "input", "test.csv"))
+    parser.add_argument("--no-test", action="store_true", help="只处理 train.csv (词表不包含 test 中的值)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--refresh", action="store_true", help="忽略已有缓存重新编码")
+    parser.add_argument("--export-encoders", default=None, help="把词表导出为 label_encoders.pkl")
+    args = parser.parse_args(argv)
+
+    data = load_training_data(args.train, None if args.no_test else args.test, args.cache_dir, args.refresh)
+    print(f"⏱️ {json.dumps(data.report, ensure_ascii=False)}")
+    if args.export_encoders:
+        import joblib
+
+        joblib.dump(data.label_encoders(), args.export_encoders)
+        print(f"✅ Label encoders saved to {args.export_encoders}")
+
+
+if __name__ == "__main__":
+    main()
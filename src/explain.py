@@ -0,0 +1,88 @@
+"""
+Stacking 模型的逐特征贡献：说明 20 个特征各自把元模型的判断推向有毒还是可食用
+
+整批一次计算，不逐行循环：两个基模型各调用一次原生 TreeSHAP 输出，再用元模型的线性权重合并。
+
+- explain(...)       返回 (base_value, 贡献矩阵, 元模型 logit)
+- top_features(...)  每行 |贡献| 最大的 k 个特征名
+
+服务端入口为 POST /explain (见 classifier_api.py)，结果与预测共用缓存键。
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+try:
+    from src.cascade import CascadeBand, meta_coefficients
+except ImportError:  # 以脚本方式运行
+    from cascade import CascadeBand, meta_coefficients
+
+# ----------------------------
+# Stacking 模型的逐特征贡献 (TreeSHAP)
+# ----------------------------
+# 两个基模型用各自原生的 pred_contrib 输出 (LightGBM pred_contrib / XGBoost pred_contribs，整批一次计算)
+# 得到 margin 上的逐特征贡献 φ 与 bias，再换算到元模型的 logit 上：
+#   1. 基模型概率 p = σ(m)，m = bias + Σφ。按 φ_i 在 m - bias 中的占比分配 p - σ(bias)
+#      (m == bias 时取斜率 σ'(m))，各特征的概率贡献之和恰好等于 p - σ(bias)
+#   2. 元模型 decision = c0·p_lgb + c1·p_xgb + b 是线性的，两个基模型的贡献按权重相加
+# 因此 base_value + Σ contributions = 元模型 logit = logit(probability_poisonous)，与 /predict 一致。
+# 级联推理时未升级的行按 (c0 + c1)·p_lgb + b 解释，XGBoost 只对升级的行计算
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def margin_contributions(model, kind: str, X) -> np.ndarray:
+    """(n, n_features + 1) 的 margin 贡献，最后一列为 bias；迭代数与 predict_proba 相同"""
+    if kind == "lgb":
+        # num_iteration 缺省时使用 best_iteration (与 LGBMClassifier.predict_proba 一致)
+        contrib = model.booster_.predict(X, pred_contrib=True)
+    else:
+        import xgboost
+
+        booster = model.get_booster()
+        best = booster.attr("best_iteration")
+        iteration_range = (0, int(best) + 1) if best is not None else (0, 0)
+        contrib = booster.predict(xgboost.DMatrix(X), pred_contribs=True, iteration_range=iteration_range)
+    return np.asarray(contrib, dtype=np.float64)
+
+
+def probability_contributions(contrib: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """margin 贡献 -> (σ(bias), 概率空间的逐特征贡献, 概率)"""
+    bias, phi = contrib[:, -1], contrib[:, :-1]
+    margin = bias + phi.sum(axis=1)
+    p, p0 = _sigmoid(margin), _sigmoid(bias)
+    delta = margin - bias
+    flat = np.abs(delta) < 1e-12
+    slope = np.where(flat, p * (1.0 - p), (p - p0) / np.where(flat, 1.0, delta))
+    return p0, phi * slope[:, None], p
+
+
+def explain(lgb_model, xgb_model, meta_model, X, band: Optional[CascadeBand] = None):
+    """
+    返回 (base_value (n,), contributions (n, n_features), logit (n,))，
+    base_value + contributions.sum(axis=1) == logit，logit 为元模型的 decision
+    """
+    coef, intercept = meta_coefficients(meta_model)
+    lgb_base, lgb_phi, lgb_proba = probability_contributions(margin_contributions(lgb_model, "lgb", X))
+    escalated = band.escalate(lgb_proba) if band is not None else np.ones(len(lgb_proba), dtype=bool)
+
+    # 未升级的行：元模型输入为 (p_lgb, p_lgb)
+    base = (coef[0] + coef[1]) * lgb_base + intercept
+    contributions = (coef[0] + coef[1]) * lgb_phi
+    rows = np.flatnonzero(escalated)
+    if len(rows):
+        X_rows = X if len(rows) == len(X) else X.iloc[rows]
+        xgb_base, xgb_phi, _ = probability_contributions(margin_contributions(xgb_model, "xgb", X_rows))
+        base[rows] = coef[0] * lgb_base[rows] + coef[1] * xgb_base + intercept
+        contributions[rows] = coef[0] * lgb_phi[rows] + coef[1] * xgb_phi
+    return base, contributions, base + contributions.sum(axis=1)
+
+
+def top_features(contributions: np.ndarray, names, k: int):
+    """每行按 |贡献| 从大到小的前 k 个特征名"""
+    k = min(k, contributions.shape[1])
+    order = np.argsort(-np.abs(contributions), axis=1, kind="stable")[:, :k]
+    names = np.asarray(names, dtype=object)
+    return names[order].tolist()
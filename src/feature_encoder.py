@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Mapping, Sequence, Any
+
+# ----------------------------
+# 类别特征查表编码引擎
+# ----------------------------
+# 训练时每一列都经过 astype(str) + LabelEncoder，编码值就是字符串在 classes_ 中的位置。
+# 推理时原先逐行 apply + 线性扫描 classes_，这里在模型加载时把每个编码器预先转成
+# 哈希查找表 (pd.Index)，整列一次 get_indexer 完成编码。
+
+# 行数不超过该值时直接用 dict 逐个查表，避免 pandas 的固定开销 (单行请求)
+SMALL_BATCH_ROWS = 64
+
+
+class ColumnTable:
+    """单列的查找表：字符串 -> 编码值，未知/缺失统一映射到 fallback_code"""
+
+    def __init__(self, classes: Sequence[str]):
+        classes = np.asarray(classes, dtype=object)
+        self.classes = classes
+        # 旧逻辑：'nan' 在编码器中则未知值归为 'nan'，否则归为第一个类别
+        nan_positions = np.flatnonzero(classes == 'nan')
+        self.fallback_code = int(nan_positions[0]) if len(nan_positions) else 0
+
+        # 'None' / '<NA>' 在旧逻辑中会先被替换成 'nan'，因此不能直接命中自身的编码
+        keep = ~np.isin(classes, ['None', '<NA>'])
+        self.index = pd.Index(classes[keep], dtype=object)
+        self.codes = np.flatnonzero(keep)
+        self.lookup = dict(zip(self.index, self.codes.tolist()))
+        self.dtype = np.int8 if len(classes) <= np.iinfo(np.int8).max + 1 else np.int16
+
+    def encode(self, values: pd.Series) -> np.ndarray:
+        """整列向量化编码，返回紧凑整型数组"""
+        # None / NaN 经 str() 后为 'None' / 'nan'，查表时都会落到 fallback_code
+        if len(values) <= SMALL_BATCH_ROWS:
+            lookup, fallback = self.lookup, self.fallback_code
+            keys = (v if type(v) is str else str(v) for v in values.to_numpy(dtype=object))
+            return np.fromiter((lookup.get(k, fallback) for k in keys), dtype=self.dtype, count=len(values))
+
+        # 先 factorize 去重，只对唯一值查表；缺失值的 factorize 编码为 -1
+        codes, uniques = pd.factorize(values)
+        uniques = np.asarray(uniques, dtype=object)
+        if not all(type(v) is str for v in uniques):
+            # 含数值等非字符串时 (如 1 与 1.0 会被 factorize 合并)，按 astype(str) 逐值处理
+            codes = np.arange(len(values))
+            uniques = values.astype(str).to_numpy(dtype=object)
+
+        positions = self.index.get_indexer(uniques)
+        table = np.where(positions >= 0, self.codes[positions], self.fallback_code).astype(self.dtype)
+        # 末尾追加 fallback，使 -1 (缺失) 直接索引到它
+        table = np.append(table, np.asarray(self.fallback_code, dtype=self.dtype))
+        return table[codes]
+
+
+class FeatureEncoder:
+    """在模型加载时构建一次，负责全部类别列的查表编码"""
+
+    def __init__(self, vocabularies: Mapping[str, Sequence[str]], source: Any = None):
+        self.tables: Dict[str, ColumnTable] = {
+            col: ColumnTable(classes) for col, classes in vocabularies.items()
+        }
+        # 记录来源对象，便于判断全局 label_encoders 是否已被替换
+        self.source = source
+
+    @classmethod
+    def from_label_encoders(cls, label_encoders: Mapping[str, Any]) -> "FeatureEncoder":
+        # 也接受 bundle 中的 {列: 类别列表} (已是词表，没有 classes_)
+        vocabularies = {col: getattr(le, "classes_", le) for col, le in label_encoders.items()}
+        return cls(vocabularies, source=label_encoders)
+
+    @property
+    def columns(self):
+        return list(self.tables)
+
+    def encode_column(self, col: str, values: pd.Series) -> np.ndarray:
+        return self.tables[col].encode(values)
+
+    def encode_matrix(self, df: pd.DataFrame, columns: Sequence[str] = None) -> np.ndarray:
+        """把指定类别列编码为 (n_rows, n_cols) 的紧凑整型矩阵"""
+        columns = list(columns) if columns is not None else self.columns
+        dtype = np.result_type(*[self.tables[col].dtype for col in columns])
+        out = np.empty((len(df), len(columns)), dtype=dtype)
+        for j, col in enumerate(columns):
+            if col in df.columns:
+                out[:, j] = self.tables[col].encode(df[col])
+            else:
+                out[:, j] = self.tables[col].fallback_code
+        return out
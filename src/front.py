@@ -1,12 +1,21 @@
 import os
+import io
+import hashlib
+import uuid
 import streamlit as st
 from PIL import Image
-import io
-import base64
 import requests
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+try:
+    from src.image_prep import prepare_image
+except ImportError:  # streamlit run src/front.py
+    from image_prep import prepare_image
+
 # 加载环境变量
 load_dotenv()
 
@@ -14,6 +23,12 @@ load_dotenv()
 # 从环境变量读取 API 地址
 VLM_API_URL = os.getenv("VLM_API_URL", "http://127.0.0.1:8001/analyze-image")
 CLASSIFIER_API_URL = os.getenv("CLASSIFIER_API_URL", "http://127.0.0.1:8000/predict")
+# 设置后 "AI 提取特征" 调用合并服务的 /analyze-and-predict，一次往返同时得到特征与初步预测
+FUSED_API_URL = os.getenv("FUSED_API_URL")
+# 上传前在前端把图片长边缩到该值以内 (与视觉服务的 VLM_MAX_SIDE 一致时服务端不再重新编码)
+VLM_MAX_SIDE = int(os.getenv("VLM_MAX_SIDE", 1024))
+HTTP_POOL_SIZE = int(os.getenv("FRONT_HTTP_POOL_SIZE", 10))
+LATENCY_HISTORY = 20
 
 
 # --- 1. 完整的中英文特征映射配置表 ---
@@ -172,34 +187,127 @@ MUSHROOM_MAPPING = {
 }
 
 # --- 3. 辅助函数 ---
-@st.cache_data(show_spinner=False)
-def get_vlm_analysis(img_base64: str):
-    """调用 VLM API 提取特征并缓存结果"""
+def origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def root_url(url: str) -> str:
+    """接口地址所在服务 (或挂载点) 的根路径，如 .../classifier/predict -> .../classifier/"""
+    return url.rsplit("/", 1)[0] + "/"
+
+
+@st.cache_resource(show_spinner=False)
+def http_session(base: str) -> requests.Session:
+    """每个后端一个 keep-alive 连接池 (所有浏览器会话共享)，点击按钮时不再重新建立 TCP 连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource(show_spinner=False)
+def http_executor() -> ThreadPoolExecutor:
+    """并发发出彼此独立的后端请求"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="front-http")
+
+
+def call_backend(backend: str, method: str, url: str, **kwargs) -> dict:
+    """
+    经连接池发送请求并计时，返回 {"backend", "ms", "status", "data" | "error"}，不抛出异常。
+    会话在主线程中取得，本函数不调用 Streamlit API，可以放到线程池中执行
+    """
+    session = kwargs.pop("session", None) or requests
+    result = {"backend": backend}
+    start = time.perf_counter()
     try:
-        response = requests.post(
-            VLM_API_URL,
-            json={"image_base64": img_base64},
-            timeout=60
-        )
-        if response.status_code == 200:
-            return response.json()
+        resp = session.request(method, url, **kwargs)
+        result["status"] = resp.status_code
+        if resp.ok:
+            result["data"] = resp.json()
         else:
-            return {"error": f"VLM API 错误: {response.text}"}
+            result["error"] = f"HTTP {resp.status_code}: {resp.text[:500]}"
     except Exception as e:
-        return {"error": f"无法连接到视觉模型服务器: {e}"}
+        result["status"] = "error"
+        result["error"] = str(e)
+    result["ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def record_latency(result: dict, cached: bool = False):
+    """记录一次后端调用的耗时，显示在侧边栏"""
+    history = st.session_state.setdefault("latencies", [])
+    history.append({
+        "后端": result["backend"],
+        "耗时 (ms)": round(result["ms"], 1),
+        "状态": "cache" if cached else str(result["status"]),
+        "时间": time.strftime("%H:%M:%S"),
+    })
+    del history[:-LATENCY_HISTORY]
+
+
+def probe(backend: str, url: str) -> Future:
+    """在线程池中 GET 服务根路径：顺带建立 keep-alive 连接，后续真正的请求省去握手"""
+    return http_executor().submit(call_backend, f"{backend} (ping)", "GET", root_url(url),
+                                  session=http_session(origin(url)), timeout=5)
 
-def predict_toxicity(data_dict: dict):
 
+def prepare_upload(uploaded_file) -> dict:
+    """
+    每个上传文件只做一次：EXIF 方向校正并缩小到 VLM_MAX_SIDE 的 JPEG (视觉服务收到后原样转发)、
+    内容摘要 (VLM 结果缓存的键) 与页面预览图，保存在会话中，重复点击与页面重绘都直接复用
+    """
+    cache = st.session_state.get("upload")
+    if cache is not None and cache["file_id"] == uploaded_file.file_id:
+        return cache
+    prepared = prepare_image(uploaded_file.getvalue(), VLM_MAX_SIDE)
+    cache = {
+        "file_id": uploaded_file.file_id,
+        "data": prepared.data,
+        "mime": prepared.mime,
+        "digest": hashlib.sha256(prepared.data).hexdigest(),
+        "preview": Image.open(io.BytesIO(prepared.data)),
+        "size_in": prepared.size_in,
+        "size_out": prepared.size_out,
+    }
+    st.session_state["upload"] = cache
+    st.session_state.pop("ai_result", None)
+    st.session_state.pop("ai_prediction", None)
+    return cache
+
+
+class BackendError(Exception):
+    """后端调用失败；失败结果不进入 st.cache_data 缓存"""
+
+    def __init__(self, result: dict):
+        super().__init__(result["error"])
+        self.result = result
+
+
+@st.cache_data(show_spinner=False)
+def get_vlm_analysis(digest: str, _img_bytes: bytes, mime_type: str, url: str) -> dict:
+    """调用 VLM (或合并服务) 提取特征并按图片摘要缓存结果；_img_bytes 不参与缓存键的计算"""
+    result = call_backend(
+        "vlm" if url == VLM_API_URL else "fused", "POST", url, session=http_session(origin(url)),
+        data=_img_bytes, headers={"Content-Type": mime_type or "application/octet-stream"}, timeout=60,
+    )
+    if "error" in result:
+        raise BackendError(result)
+    return result
+
+
+def predict_toxicity(data_dict: dict):
     """调用分类器 API 预测毒性"""
-    # 构造 API 要求的 List[Dict] 格式，并补上 id
-    payload = [{**data_dict, "id": int(time.time())}]
-    try:
-        resp = requests.post(CLASSIFIER_API_URL, json=payload, timeout=10)
-        resp.raise_for_status()
-        return resp.json()[0] # 返回第一个预测结果
-    except Exception as e:
-        st.error(f"分类器调用失败: {e}")
+    # 构造 API 要求的 List[Dict] 格式，并补上每次请求唯一的 id
+    payload = [{**data_dict, "id": uuid.uuid4().hex}]
+    result = call_backend("classifier", "POST", CLASSIFIER_API_URL, session=http_session(origin(CLASSIFIER_API_URL)),
+                          json=payload, timeout=10)
+    record_latency(result)
+    if "error" in result:
+        st.error(f"分类器调用失败: {result['error']}")
         return None
+    return result["data"][0]  # 返回第一个预测结果
 
 # --- 4. Streamlit 页面布局 ---
 st.set_page_config(page_title="蘑菇毒性全流程检测", layout="wide")
@@ -209,29 +317,40 @@ st.markdown("---")
 uploaded_file = st.file_uploader("第一步：上传蘑菇照片", type=["jpg", "jpeg", "png"])
 
 if uploaded_file is not None:
-    image = Image.open(uploaded_file)
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    
+    try:
+        upload = prepare_upload(uploaded_file)
+    except ValueError as e:
+        st.error(f"无法读取图片: {e}")
+        st.stop()
+
     col_img, col_form = st.columns([1, 2])
-    
+
     with col_img:
-        st.image(image, caption="待分析样本", use_container_width=True)
+        st.image(upload["preview"], caption="待分析样本", use_container_width=True)
+        if upload["size_out"] != upload["size_in"]:
+            st.caption("{}x{} -> {}x{}".format(*upload["size_in"], *upload["size_out"]))
         analyze_btn = st.button("🚀 第二步：AI 提取特征", use_container_width=True)
 
     if analyze_btn:
         with st.spinner("视觉模型正在解析形态..."):
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            
-            result = get_vlm_analysis(img_str)
-            
-            if "error" in result:
-                st.error(result["error"])
-            else:
-                st.session_state['ai_result'] = result
+            # 不使用合并服务时，VLM 解析期间并发 ping 分类器，提前建立连接
+            warm = None if FUSED_API_URL else probe("classifier", CLASSIFIER_API_URL)
+            start = time.perf_counter()
+            try:
+                result = get_vlm_analysis(upload["digest"], upload["data"], upload["mime"],
+                                          FUSED_API_URL or VLM_API_URL)
+                # 返回得比该次调用本身的耗时还快，说明命中了缓存
+                record_latency(dict(result, ms=(time.perf_counter() - start) * 1000),
+                               cached=(time.perf_counter() - start) * 1000 < result["ms"])
+                features = result["data"]["features"] if FUSED_API_URL else result["data"]
+                st.session_state['ai_result'] = features
+                st.session_state['ai_prediction'] = result["data"].get("prediction") if FUSED_API_URL else None
                 st.toast("特征提取成功！请在右侧核对。", icon="✨")
+            except BackendError as e:
+                record_latency(e.result)
+                st.error(f"视觉模型服务调用失败: {e}")
+            if warm is not None:
+                record_latency(warm.result())
 
 
     # --- 5. 人工复核与毒性预测 ---
@@ -240,6 +359,10 @@ if uploaded_file is not None:
         
         with col_form:
             st.subheader("📝 第三步：特征核对与毒性检测")
+            ai_prediction = st.session_state.get('ai_prediction')
+            if ai_prediction:
+                st.info(f"AI 特征的初步预测：{'毒蘑菇' if ai_prediction['predicted_class'] == 'p' else '可食用'} "
+                        f"(中毒概率 {ai_prediction['probability_poisonous']:.2%})，请核对特征后确认")
             with st.form("refine_and_predict"):
                 final_data = {}
                 f_col1, f_col2 = st.columns(2)
@@ -304,4 +427,23 @@ st.sidebar.markdown("""
 2. **AI 分析**：提取菌盖、菌柄等 20 项形态特征。
 3. **人工复核**：由于视觉模型可能存在误差，请手动修正明显错误的特征。
 4. **毒性预测**：点击按钮，后端分类器将基于集成学习模型给出毒性判断。
-""")
\ No newline at end of file
+""")
+
+# --- 6. 后端调用耗时 ---
+st.sidebar.markdown("### ⏱️ 后端耗时")
+if st.sidebar.button("🩺 检查后端"):
+    checks = [probe("vlm", FUSED_API_URL or VLM_API_URL), probe("classifier", CLASSIFIER_API_URL)]
+    for check in checks:
+        record_latency(check.result())
+
+latencies = st.session_state.get("latencies", [])
+if latencies:
+    latest = {}
+    for item in latencies:
+        latest[item["后端"]] = item
+    for backend, item in latest.items():
+        st.sidebar.metric(backend, f"{item['耗时 (ms)']:.0f} ms", help=f"状态 {item['状态']}，{item['时间']}")
+    with st.sidebar.expander("最近调用"):
+        st.dataframe(list(reversed(latencies)), hide_index=True, use_container_width=True)
+else:
+    st.sidebar.caption("尚无调用记录")
@@ -0,0 +1,120 @@
+"""
+合并服务：在同一个进程中运行分类器与视觉特征提取服务
+
+- /classifier/...  与 classifier_api.py 完全相同的接口 (/predict、/predict/columnar ...)
+- /vlm/...         与 imgprocess_api.py 完全相同的接口 (/analyze-image ...)，人工复核流程照常使用
+- /metrics             两个服务共用的 Prometheus 指标 (分阶段耗时、批大小、缓存命中、VLM 失败等)
+- /analyze-and-predict  上传图片 -> VLM 提取特征 -> 预处理 -> Stacking 推理，一次请求完成；
+  VLM 解析出的特征字典直接交给 preprocess_data 与集成模型，不再经过 HTTP 与 JSON 的二次序列化，
+  响应中带有每个阶段的耗时 (同时以 Server-Timing 响应头返回)
+
+用法 (项目根目录):
+    python src/fused_app.py                     # 默认端口 8000，FUSED_PORT 可修改
+前端使用合并服务时设置:
+    VLM_API_URL=http://127.0.0.1:8000/vlm/analyze-image
+    CLASSIFIER_API_URL=http://127.0.0.1:8000/classifier/predict
+"""
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request, Response
+
+try:
+    import src.classifier_api as classifier_api
+    import src.imgprocess_api as imgprocess_api
+    from src import metrics
+except ImportError:  # 以脚本方式运行 (python src/fused_app.py)
+    import classifier_api
+    import imgprocess_api
+    import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 挂载的子应用不会收到 lifespan 事件：这里依次执行两者的启动 / 关闭钩子 (加载模型、创建 VLM 客户端等)
+    async with AsyncExitStack() as stack:
+        for sub in (classifier_api.app, imgprocess_api.app):
+            await stack.enter_async_context(sub.router.lifespan_context(sub))
+        yield
+
+
+app = FastAPI(title="Mushroom fused service", lifespan=lifespan)
+# 外层中间件统一记录 (子应用的中间件检测到后不再重复记录)，路由标签带挂载前缀
+app.add_middleware(metrics.MetricsMiddleware, app_name="fused")
+app.mount("/classifier", classifier_api.app)
+app.mount("/vlm", imgprocess_api.app)
+
+
+def server_timing(timings: dict) -> str:
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+@app.post("/analyze-and-predict", openapi_extra=imgprocess_api.IMAGE_REQUEST_BODY)
+async def analyze_and_predict(request: Request, response: Response, max_side: Optional[int] = None):
+    """
+    图片 -> 特征 -> 毒性预测。请求体与 /vlm/analyze-image 相同 (JSON base64 / 图片字节 / multipart)
+
+    返回: {"features": {...}, "prediction": {"predicted_class", "probability_poisonous"},
+           "image": {...}, "cache": "exact" | "near" | "miss" | null, "timings_ms": {...}}
+    """
+    start = time.perf_counter()
+    data, image_base64 = await imgprocess_api.read_upload(request)
+    read_ms = (time.perf_counter() - start) * 1000
+
+    extraction = await imgprocess_api.extract_features(data, image_base64, max_side)
+    if not isinstance(extraction.features, dict):
+        raise HTTPException(status_code=502, detail="VLM output is not a JSON object")
+
+    predict_start = time.perf_counter()
+    proba, pred = await classifier_api.score_async([extraction.features], 1)
+    predict_ms = (time.perf_counter() - predict_start) * 1000
+
+    prepared = extraction.prepared
+    timings = {
+        "read": read_ms,
+        "image_prep": prepared.prep_ms,
+        "vlm": extraction.vlm_ms or 0.0,
+        "predict": predict_ms,
+        "total": (time.perf_counter() - start) * 1000,
+    }
+    response.headers.update(extraction.headers())
+    response.headers["Server-Timing"] = server_timing(timings)
+    return {
+        "features": extraction.features,
+        "prediction": {
+            "predicted_class": "p" if pred[0] == 1 else "e",
+            "probability_poisonous": float(proba[0]),
+        },
+        "image": {
+            "bytes_in": prepared.bytes_in,
+            "bytes_out": prepared.bytes_out,
+            "size_in": list(prepared.size_in),
+            "size_out": list(prepared.size_out),
+        },
+        "cache": extraction.cache,
+        "timings_ms": {name: round(ms, 2) for name, ms in timings.items()},
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return metrics.metrics_response()
+
+
+@app.get("/")
+async def root():
+    return {
+        "status": "mushroom_fused_api_running",
+        "classifier": "/classifier",
+        "vlm": "/vlm",
+        "models_loaded": classifier_api.meta_model is not None,
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.getenv("FUSED_PORT", 8000))
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,91 @@
+import base64
+import io
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    from src.vlm_cache import pixel_fingerprint
+except ImportError:  # 以脚本方式运行
+    from vlm_cache import pixel_fingerprint
+
+# ----------------------------
+# VLM 调用前的图片预处理
+# ----------------------------
+# 手机照片动辄 4000px / 数 MB，VLM 的大部分 prefill 时间花在用不到的像素上。
+# 这里解码、按 EXIF 方向校正并把长边缩到 max_side 以内后重新编码为 JPEG；
+# 本身已经足够小且无需旋转的 JPEG 原样转发，避免重复压缩。
+
+EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class PreparedImage:
+    data: bytes                     # 发给 VLM 的图片字节
+    mime: str
+    bytes_in: int
+    size_in: Tuple[int, int]        # 原图 (宽, 高)，EXIF 校正前
+    size_out: Tuple[int, int]
+    prep_ms: float
+    fingerprint: Optional[Tuple[str, Optional[int]]] = None  # (内容哈希, dHash)，供 VLM 缓存使用
+    encoded: Optional[str] = None   # 已有的 base64 文本 (原样转发时使用)
+
+    @property
+    def bytes_out(self) -> int:
+        return len(self.data)
+
+    @property
+    def image_base64(self) -> str:
+        if self.encoded is not None:
+            return self.encoded
+        return base64.b64encode(self.data).decode("ascii")
+
+    def headers(self) -> dict:
+        """预处理前后的尺寸与字节数，作为响应头返回"""
+        return {
+            "X-Image-Bytes-In": str(self.bytes_in),
+            "X-Image-Bytes-Out": str(self.bytes_out),
+            "X-Image-Size-In": "{}x{}".format(*self.size_in),
+            "X-Image-Size-Out": "{}x{}".format(*self.size_out),
+            "X-Image-Prep-Ms": f"{self.prep_ms:.1f}",
+        }
+
+
+def prepare_image(data: bytes, max_side: int = 1024, quality: int = 85,
+                  fingerprint: bool = False) -> PreparedImage:
+    """
+    解码、EXIF 方向校正并缩小图片 (CPU 密集，调用方应放在工作线程中执行)
+
+    max_side <= 0 时不缩放。fingerprint=True 时同时计算缓存用的像素哈希。
+    无法识别为图片时抛出 ValueError
+    """
+    start = time.perf_counter()
+    try:
+        img = Image.open(io.BytesIO(data))
+        fmt, size_in = img.format, img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        needs_resize = max_side > 0 and max(size_in) > max_side
+        if needs_resize:
+            # JPEG 可在解码时按 1/2、1/4、1/8 降采样 (DCT 缩放)，比全尺寸解码再缩放快数倍
+            img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid image: {e}")
+
+    fp = pixel_fingerprint(img) if fingerprint else None
+    if fmt == "JPEG" and not needs_resize and orientation == 1:
+        out = data
+    else:
+        if needs_resize:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality)
+        out = buf.getvalue()
+    return PreparedImage(
+        data=out, mime="image/jpeg", bytes_in=len(data), size_in=size_in, size_out=img.size,
+        prep_ms=(time.perf_counter() - start) * 1000, fingerprint=fp,
+    )
@@ -1,21 +1,121 @@
 import os
 import json
 import re
-from typing import Optional, Dict, Any
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from openai import OpenAI
+import base64
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 import uvicorn
 from dotenv import load_dotenv
 
+try:
+    from src.vlm_client import VLMClient, VLMBusyError, VLMTimeoutError
+    from src.vlm_cache import VLMCache, image_fingerprint, version_key
+    from src.image_prep import PreparedImage, prepare_image
+    from src.vlm_output import schema_from_prompt, validate_features
+    from src.batch_analyze import ImageItem, fan_out, list_images, predict_rows, summarize
+    from src import metrics
+except ImportError:  # 以脚本方式运行 (python src/imgprocess_api.py)
+    from vlm_client import VLMClient, VLMBusyError, VLMTimeoutError
+    from vlm_cache import VLMCache, image_fingerprint, version_key
+    from image_prep import PreparedImage, prepare_image
+    from vlm_output import schema_from_prompt, validate_features
+    from batch_analyze import ImageItem, fan_out, list_images, predict_rows, summarize
+    import metrics
+
 # 加载环境变量
 load_dotenv()
 
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware, app_name="vlm")
+
+# 分阶段耗时 vlm_stage_seconds{stage=read|decode|cache_lookup|vlm|extract}、VLM 调用结果与失败原因计数 (GET /metrics)
+stages = metrics.Stages("vlm")
+vlm_images = metrics.REGISTRY.counter("vlm_images_total", "Images analyzed by outcome (cache_exact / cache_near / "
+                                        "vlm / failed)", ("result",))
+vlm_failures = metrics.REGISTRY.counter("vlm_failures_total", "VLM failures by reason", ("reason",))
 
 # 从环境变量读取 LM Studio 地址，默认为本地 1234 端口
 lm_studio_url = os.getenv("LM_STUDIO_BASE_URL", "http://localhost:1234/v1")
-client = OpenAI(base_url=lm_studio_url, api_key="lm-studio")
+
+# VLM 调用限流：同时进行的调用数、排队上限、单次调用超时与排队超时 (秒)
+VLM_MAX_CONCURRENCY = int(os.getenv("VLM_MAX_CONCURRENCY", 2))
+VLM_MAX_QUEUE = int(os.getenv("VLM_MAX_QUEUE", 16))
+VLM_TIMEOUT = float(os.getenv("VLM_TIMEOUT", 60))
+VLM_QUEUE_TIMEOUT = float(os.getenv("VLM_QUEUE_TIMEOUT", 30))
+client = None  # VLMClient，启动时创建 (连接池需要绑定到服务的事件循环)
+
+# VLM 结果持久化缓存 (VLM_CACHE=0 关闭)；VLM_CACHE_NEAR_DISTANCE > 0 时启用 dHash 近似查找
+# (汉明距离阈值，建议 4 左右；过大可能把不同的蘑菇照片视为同一张)
+VLM_CACHE = os.getenv("VLM_CACHE", "1") == "1"
+VLM_CACHE_PATH = os.getenv("VLM_CACHE_PATH", os.path.join(os.getcwd(), "cache", "vlm_cache.sqlite3"))
+VLM_CACHE_MAX_ENTRIES = int(os.getenv("VLM_CACHE_MAX_ENTRIES", 10000))
+VLM_CACHE_TTL = float(os.getenv("VLM_CACHE_TTL", 30 * 86400))
+VLM_CACHE_NEAR_DISTANCE = int(os.getenv("VLM_CACHE_NEAR_DISTANCE", 0))
+VLM_MODEL = os.getenv("VLM_MODEL", "local-model")
+VLM_MAX_TOKENS = 800
+VLM_TEMPERATURE = 0.1
+vlm_cache = None
+
+# 上传图片在调用 VLM 前缩小到的最长边 (像素，0 表示不缩放) 与重新编码的 JPEG 质量
+VLM_MAX_SIDE = int(os.getenv("VLM_MAX_SIDE", 1024))
+VLM_JPEG_QUALITY = int(os.getenv("VLM_JPEG_QUALITY", 85))
+# 累计的上传 / 预处理后字节数，用于观察缩放的效果
+upload_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "prep_ms": 0.0}
+
+# 流式调用 VLM：JSON 对象一闭合就取消生成 (VLM_STREAM=0 时等待完整输出)；VLM_LOG=1 时逐次打印耗时与 token 数
+VLM_STREAM = os.getenv("VLM_STREAM", "1") == "1"
+VLM_LOG = os.getenv("VLM_LOG", "1") == "1"
+
+# 批量接口：单次最多图片数、目录模式允许读取的根目录、暂时性失败的重试次数与首次退避秒数，
+# 以及 predict=true 时调用的分类器地址
+VLM_BATCH_MAX_IMAGES = int(os.getenv("VLM_BATCH_MAX_IMAGES", 500))
+VLM_BATCH_ROOT = os.path.realpath(os.getenv("VLM_BATCH_ROOT", os.getcwd()))
+VLM_BATCH_RETRIES = int(os.getenv("VLM_BATCH_RETRIES", 2))
+VLM_BATCH_BACKOFF = float(os.getenv("VLM_BATCH_BACKOFF", 0.5))
+CLASSIFIER_API_URL = os.getenv("CLASSIFIER_API_URL", "http://127.0.0.1:8000/predict")
+
+
+@app.on_event("startup")
+async def create_client():
+    global client
+    if client is None:
+        client = VLMClient(
+            base_url=lm_studio_url,
+            model=VLM_MODEL,
+            max_concurrency=VLM_MAX_CONCURRENCY,
+            max_queue=VLM_MAX_QUEUE,
+            timeout=VLM_TIMEOUT,
+            queue_timeout=VLM_QUEUE_TIMEOUT,
+        )
+
+
+@app.on_event("startup")
+def open_cache():
+    global vlm_cache
+    if VLM_CACHE and vlm_cache is None:
+        vlm_cache = VLMCache(
+            VLM_CACHE_PATH,
+            version=version_key(prompt, VLM_MODEL, VLM_MAX_TOKENS, VLM_TEMPERATURE, VLM_MAX_SIDE),
+            max_entries=VLM_CACHE_MAX_ENTRIES,
+            ttl_seconds=VLM_CACHE_TTL,
+            near_duplicate_distance=VLM_CACHE_NEAR_DISTANCE,
+        )
+
+
+@app.on_event("shutdown")
+async def close_client():
+    global client, vlm_cache
+    if client is not None:
+        await client.aclose()
+        client = None
+    if vlm_cache is not None:
+        vlm_cache.close()
+        vlm_cache = None
 
 
 class ImageRequest(BaseModel):
@@ -80,47 +180,338 @@ prompt = """
 }
 """
 
-@app.post("/analyze-image")
-async def analyze_image(request: ImageRequest):
-    try:
-        response = client.chat.completions.create(
-            model="local-model", 
-            messages=[
+# 20 个特征字段及其允许的取值，来自上面提示词中的特征表
+FEATURE_SCHEMA = schema_from_prompt(prompt)
+
+
+def parse_vlm_json(raw_content: str) -> Dict[str, Any]:
+    """从模型输出中提取 JSON 对象 (兼容 Markdown 代码块、前导文字与 Python 的 None)"""
+    raw_content = raw_content.strip()
+    # 使用正则表达式提取内容（处理模型可能输出的 Markdown 代码块或前导文字）
+    json_match = re.search(r"(\{.*\})", raw_content, re.DOTALL)
+    if not json_match:
+        raise json.JSONDecodeError(f"Model failed to generate a valid JSON object. Raw: {raw_content}",
+                                   raw_content, 0)
+    clean_json_str = json_match.group(1)
+    # 兼容性处理：防止模型输出 Python 的 None 而不是 JSON 的 null
+    clean_json_str = clean_json_str.replace(": None", ": null")
+    return json.loads(clean_json_str)
+
+
+def build_messages(image_base64: str, mime: str = "image/jpeg"):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
                 {
-                    "role": "user", 
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url", 
-                            "image_url": {"url": f"data:image/jpeg;base64,{request.image_base64}"}
-                        },
-                    ]
-                }
-            ],
-            max_tokens=800,
-            temperature=0.1, # 降低随机性，保证格式稳定
-        )
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{mime};base64,{image_base64}"}
+                },
+            ]
+        }
+    ]
+
+
+def decode_image(image_base64: str) -> bytes:
+    """base64 (可带 data URL 前缀) 解码为原始字节；不是合法 base64 时按原字符串处理"""
+    if image_base64.startswith("data:"):
+        image_base64 = image_base64.split(",", 1)[-1]
+    try:
+        return base64.b64decode(image_base64, validate=True)
+    except ValueError:
+        return image_base64.encode("utf-8")
+
+
+# 直接上传图片字节时接受的 Content-Type
+BINARY_IMAGE_TYPES = ("application/octet-stream", "image/jpeg", "image/png", "image/webp", "image/bmp",
+                      "image/gif", "image/tiff")
+
+
+async def read_upload(request: Request) -> tuple:
+    """
+    按 Content-Type 读取上传的图片，返回 (图片字节, 原始 base64 或 None)：
+    - application/json：{"image_base64": "..."} (兼容旧客户端)
+    - multipart/form-data：file 字段 (需要安装 python-multipart)
+    - image/* 或 application/octet-stream：请求体即图片字节，没有 base64 的 33% 膨胀
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("", "application/json"):
+        try:
+            body = ImageRequest.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+        return decode_image(body.image_base64), body.image_base64
+    if content_type == "multipart/form-data":
+        try:
+            form = await request.form()
+        except AssertionError as e:  # Starlette 在缺少 python-multipart 时抛出 AssertionError
+            raise HTTPException(status_code=415, detail=str(e))
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=422, detail="multipart upload needs a 'file' field")
+        return await upload.read(), None
+    if content_type in BINARY_IMAGE_TYPES:
+        return await request.body(), None
+    raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+
+
+def prepare_for_vlm(data: bytes, image_base64: Optional[str], max_side: int) -> PreparedImage:
+    """解码缩放上传的图片 (工作线程中执行)；JSON 中的内容无法解码为图片时按旧行为原样转发"""
+    try:
+        return prepare_image(data, max_side, VLM_JPEG_QUALITY, fingerprint=vlm_cache is not None)
+    except ValueError:
+        if image_base64 is None:
+            raise
+    return PreparedImage(
+        data=data, mime="image/jpeg", bytes_in=len(data), size_in=(0, 0), size_out=(0, 0), prep_ms=0.0,
+        fingerprint=image_fingerprint(data) if vlm_cache is not None else None, encoded=image_base64,
+    )
 
-        raw_content = response.choices[0].message.content.strip()
-
-        # 使用正则表达式提取内容（处理模型可能输出的 Markdown 代码块或前导文字）
-        json_match = re.search(r"(\{.*\})", raw_content, re.DOTALL)
-        
-        if json_match:
-            clean_json_str = json_match.group(1)
-            # 兼容性处理：防止模型输出 Python 的 None 而不是 JSON 的 null
-            clean_json_str = clean_json_str.replace(": None", ": null")
-            
-            result_dict = json.loads(clean_json_str)
-            return result_dict
-        else:
-            raise ValueError(f"Model failed to generate a valid JSON object. Raw: {raw_content}")
 
+@dataclass
+class Extraction:
+    features: Dict[str, Any]
+    prepared: PreparedImage
+    cache: Optional[str] = None  # exact / near / miss，未启用缓存时为 None
+    vlm_ms: Optional[float] = None  # 命中缓存时为 None
+    chunks: Optional[int] = None  # 流式调用收到的增量内容块数
+    issues: Optional[list] = None  # schema 校验发现的问题
+
+    def headers(self) -> Dict[str, str]:
+        headers = self.prepared.headers()
+        if self.cache is not None:
+            headers["X-VLM-Cache"] = self.cache
+        if self.vlm_ms is not None:
+            headers["X-VLM-Ms"] = f"{self.vlm_ms:.1f}"
+        if self.chunks is not None:
+            headers["X-VLM-Chunks"] = str(self.chunks)
+        if self.issues is not None:
+            headers["X-VLM-Schema-Issues"] = str(len(self.issues))
+        return headers
+
+
+async def extract_features(data: bytes, image_base64: Optional[str] = None,
+                           max_side: Optional[int] = None) -> Extraction:
+    """
+    图片字节 -> 形态特征字典：预处理 (工作线程) -> 缓存查找 -> VLM 调用 -> 解析 JSON -> 写缓存。
+    错误统一转换为 HTTPException，供 /analyze-image 与合并服务的 /analyze-and-predict 共用
+    """
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    side = VLM_MAX_SIDE if max_side is None else max_side
+    try:
+        with stages("decode"):
+            prepared = await asyncio.to_thread(prepare_for_vlm, data, image_base64, side)
+    except ValueError as e:
+        vlm_failures.inc(1, "bad_image")
+        raise HTTPException(status_code=400, detail=str(e))
+    upload_stats["images"] += 1
+    upload_stats["bytes_in"] += prepared.bytes_in
+    upload_stats["bytes_out"] += prepared.bytes_out
+    upload_stats["prep_ms"] += prepared.prep_ms
+
+    # 只有按默认尺寸缩放的图片才读写缓存 (缓存版本中包含 VLM_MAX_SIDE)
+    use_cache = vlm_cache is not None and side == VLM_MAX_SIDE and prepared.fingerprint is not None
+    try:
+        # 缓存查找：像素哈希已在预处理线程中算好，SQLite 读写放在线程中，不阻塞事件循环
+        kind = None
+        if use_cache:
+            with stages("cache_lookup"):
+                cached, kind = await asyncio.to_thread(vlm_cache.get, *prepared.fingerprint)
+            if cached is not None:
+                vlm_images.inc(1, f"cache_{kind}")
+                return Extraction(cached, prepared, kind)
+
+        start = time.perf_counter()
+        messages = build_messages(prepared.image_base64, prepared.mime)
+        stream_stats = None
+        # 流式调用在生成过程中增量解析 JSON，extract 阶段只剩 schema 校验
+        with stages("vlm"):
+            if VLM_STREAM:
+                result, stream_stats = await client.chat_json(
+                    messages, max_tokens=VLM_MAX_TOKENS, temperature=VLM_TEMPERATURE,
+                )
+            else:
+                raw_content = await client.chat(
+                    messages,
+                    max_tokens=VLM_MAX_TOKENS,
+                    temperature=VLM_TEMPERATURE, # 降低随机性，保证格式稳定
+                )
+        with stages("extract"):
+            if not VLM_STREAM:
+                result = parse_vlm_json(raw_content)
+            vlm_ms = (time.perf_counter() - start) * 1000
+            features, issues = validate_features(result, FEATURE_SCHEMA)
+        vlm_images.inc(1, "vlm")
+        if VLM_LOG:
+            detail = (f", first token {stream_stats['first_token_ms']:.0f} ms, {stream_stats['chunks']} chunks, "
+                      f"early stop={stream_stats['early_stop']}") if stream_stats else ""
+            print(f"⏱️ VLM result in {vlm_ms:.0f} ms{detail}"
+                  + (f"; schema issues: {', '.join(issues)}" if issues else ""))
+        if use_cache:
+            await asyncio.to_thread(vlm_cache.put, prepared.fingerprint[0], features, prepared.fingerprint[1])
+        return Extraction(features, prepared, kind, vlm_ms,
+                          stream_stats["chunks"] if stream_stats else None, issues)
+
+    except VLMBusyError as e:
+        # 排队已满：尽早拒绝，提示客户端稍后重试
+        record_failure("busy")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except VLMTimeoutError as e:
+        record_failure("timeout")
+        raise HTTPException(status_code=504, detail=str(e))
     except json.JSONDecodeError as je:
+        record_failure("parse")
         raise HTTPException(status_code=500, detail=f"JSON Parsing Error: {str(je)}")
     except Exception as e:
+        record_failure("error")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def record_failure(reason: str):
+    vlm_images.inc(1, "failed")
+    vlm_failures.inc(1, reason)
+
+
+# /analyze-image 与 /analyze-and-predict 共用的 OpenAPI 请求体说明
+IMAGE_REQUEST_BODY = {"requestBody": {"content": {
+    "application/json": {"schema": ImageRequest.model_json_schema()},
+    "image/jpeg": {"schema": {"type": "string", "format": "binary"}},
+    "multipart/form-data": {"schema": {"type": "object", "properties": {"file": {"type": "string", "format": "binary"}}}},
+}}}
+
+
+@app.post("/analyze-image", openapi_extra=IMAGE_REQUEST_BODY)
+async def analyze_image(request: Request, response: Response, max_side: Optional[int] = None):
+    """
+    提取蘑菇图片的形态特征。图片在工作线程中解码、按 EXIF 方向校正并缩小到 VLM_MAX_SIDE
+    (可用 ?max_side= 覆盖，0 表示不缩放) 后再发给 VLM。
+
+    响应头 X-Image-Bytes-In / X-Image-Bytes-Out、X-Image-Size-In / X-Image-Size-Out 给出预处理前后的
+    字节数与尺寸，X-Image-Prep-Ms 为预处理耗时，X-VLM-Ms 为 VLM 调用耗时
+    """
+    with stages("read"):
+        data, image_base64 = await read_upload(request)
+    extraction = await extract_features(data, image_base64, max_side)
+    response.headers.update(extraction.headers())
+    return extraction.features
+
+
+class BatchRequest(BaseModel):
+    directory: Optional[str] = None  # 相对 VLM_BATCH_ROOT 的服务器端目录
+    images: Optional[List[ImageRequest]] = None
+
+
+async def read_batch(request: Request) -> list:
+    """
+    批量接口的输入，返回 ImageItem 列表：
+    - multipart/form-data：多个 files 字段 (需要安装 python-multipart)
+    - application/json：{"directory": "img"} 读取服务器上 VLM_BATCH_ROOT 之下的目录，
+      或 {"images": [{"image_base64": ...}, ...]}
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        try:
+            form = await request.form(max_files=VLM_BATCH_MAX_IMAGES)
+        except AssertionError as e:  # Starlette 在缺少 python-multipart 时抛出 AssertionError
+            raise HTTPException(status_code=415, detail=str(e))
+        uploads = [f for f in form.getlist("files") if not isinstance(f, str)]
+        items = [ImageItem(i, f.filename or f"image-{i}", data=await f.read()) for i, f in enumerate(uploads)]
+    elif content_type in ("", "application/json"):
+        try:
+            body = BatchRequest.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+        if body.directory is not None:
+            directory = os.path.realpath(os.path.join(VLM_BATCH_ROOT, body.directory))
+            if os.path.commonpath([directory, VLM_BATCH_ROOT]) != VLM_BATCH_ROOT:
+                raise HTTPException(status_code=403, detail="Directory is outside VLM_BATCH_ROOT")
+            if not os.path.isdir(directory):
+                raise HTTPException(status_code=404, detail=f"No such directory: {body.directory}")
+            items = list_images(directory)
+        else:
+            items = [ImageItem(i, f"image-{i}", data=decode_image(img.image_base64), image_base64=img.image_base64)
+                     for i, img in enumerate(body.images or [])]
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+    if not items:
+        raise HTTPException(status_code=400, detail="No images in batch")
+    if len(items) > VLM_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(items)} images, limit is {VLM_BATCH_MAX_IMAGES}")
+    return items
+
+
+@app.post("/analyze-images")
+async def analyze_images(request: Request, concurrency: Optional[int] = None, retries: Optional[int] = None,
+                         predict: bool = False):
+    """
+    批量提取特征，以 NDJSON 流式返回，每张图片完成时立即输出一行：
+        {"type": "features", "index", "name", "status": "ok" | "error", "features" | "error", "attempts", "ms", ...}
+    predict=true 时全部完成后把成功的特征合并成一次 /predict 调用，再逐张输出
+        {"type": "prediction", "index", "name", "prediction": {...}}
+    最后一行为 {"type": "summary", ...}。concurrency 默认等于 VLM_MAX_CONCURRENCY，
+    暂时性失败 (排队已满 / 超时 / 5xx) 按指数退避重试 retries 次
+    """
+    items = await read_batch(request)
+    concurrency = max(1, min(concurrency or VLM_MAX_CONCURRENCY, VLM_MAX_CONCURRENCY + VLM_MAX_QUEUE))
+    retries = VLM_BATCH_RETRIES if retries is None else retries
+
+    async def lines():
+        start = time.perf_counter()
+        results = []
+        async for result in fan_out(items, extract_features, concurrency, retries, VLM_BATCH_BACKOFF):
+            results.append(result)
+            yield json.dumps({"type": "features", **result}, ensure_ascii=False) + "\n"
+        summary = summarize(results, time.perf_counter() - start)
+        if predict:
+            try:
+                for line in await predict_rows(results, CLASSIFIER_API_URL):
+                    yield json.dumps({"type": "prediction", **line}, ensure_ascii=False) + "\n"
+            except Exception as e:
+                summary["predict_error"] = str(e)
+        yield json.dumps({"type": "summary", **summary}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/")
+async def root():
+    """健康检查：不经过 VLM，调用进行中也能立即返回"""
+    return {"status": "mushroom_vlm_api_running", "vlm": client.stats() if client is not None else None}
+
+
+@app.get("/stats/vlm-cache")
+async def vlm_cache_stats():
+    """VLM 结果缓存统计：条目数、精确 / 近似命中、未命中、命中率与淘汰数"""
+    if vlm_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(vlm_cache.stats)}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的指标：分阶段耗时、VLM 调用结果与失败原因、HTTP 请求统计"""
+    return metrics.metrics_response()
+
+
+@app.get("/stats/vlm")
+async def vlm_stats():
+    """VLM 调用统计：进行中 / 排队 / 完成 / 拒绝 / 超时次数与平均延迟"""
+    if client is None:
+        return {"enabled": False}
+    images = upload_stats["images"]
+    return {
+        **client.stats(),
+        "uploads": {
+            **upload_stats,
+            "max_side": VLM_MAX_SIDE,
+            "avg_bytes_in": upload_stats["bytes_in"] / images if images else 0.0,
+            "avg_bytes_out": upload_stats["bytes_out"] / images if images else 0.0,
+            "avg_prep_ms": upload_stats["prep_ms"] / images if images else 0.0,
+        },
+    }
+
 if __name__ == "__main__":
     port = int(os.getenv("VLM_PORT", 8001))
     uvicorn.run(app, host="0.0.0.0", port=port)
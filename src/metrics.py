@@ -0,0 +1,324 @@
+"""
+低开销的服务指标：分阶段计时直方图 + 计数器，以 Prometheus 文本格式暴露在 /metrics
+
+- Stages(prefix)("preprocess") 上下文管理器：记录到 <prefix>_stage_seconds{stage=...} 直方图，每次只有两次
+  perf_counter 与一次加锁的桶计数，METRICS=0 时为空操作
+- Counter / Histogram：带标签的计数器与直方图，线程安全 (微批在线程池中执行)
+- MetricsMiddleware：纯 ASGI 中间件，按路由记录请求数与耗时；并按 PROFILE_SAMPLE_RATE 抽样
+  (或请求头 X-Profile: 1，抽样开启时才生效) 记录该请求内各阶段的时间区间，写出到 PROFILE_DIR：
+      <id>.trace.json   Chrome trace event 格式 (chrome://tracing / Perfetto / speedscope 可直接打开)
+      <id>.folded       折叠栈格式 (flamegraph.pl / speedscope)，每行 "request;stage;substage 自身微秒数"
+  抽样请求的响应头 X-Profile-Id 给出文件名。微批开启时模型推理在调度线程中执行，
+  只计入直方图，不出现在单个请求的 trace 中
+
+不依赖 prometheus_client；分类器与视觉服务 (及合并服务) 共用同一个进程内注册表。
+"""
+import asyncio
+import bisect
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+# 抽样记录单个请求分阶段 trace 的比例 (0 关闭) 与输出目录
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.getcwd(), "cache", "profiles"))
+
+# 阶段耗时 (秒) 的默认桶：0.1 ms ~ 60 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 批量行数的桶
+ROWS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000, 100000)
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels_text(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [每个桶的计数 (非累计，最后一个为 +Inf), 总和, 总数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, (list(e[0]), e[1], e[2])) for labels, e in self._values.items())
+        for labels, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels_text(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels_text(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels_text(self.labelnames, labels)} {n}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(name, lambda: Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        return self._get(name, lambda: Histogram(name, help, buckets, labelnames))
+
+    def _get(self, name, factory):
+        """同名指标只注册一次 (合并服务中两个模块各自声明时共享同一个对象)"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_requests = REGISTRY.counter("http_requests_total", "HTTP requests by route and status",
+                                 ("app", "route", "status"))
+http_seconds = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency by route",
+                                  labelnames=("app", "route"))
+
+
+# ----------------------------
+# 1. 分阶段计时
+# ----------------------------
+class Trace:
+    """一个被抽样请求内的阶段区间 (开始 / 结束 perf_counter、线程)"""
+
+    def __init__(self, name: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.thread = threading.get_ident()  # 事件循环线程
+        self.spans: List[Tuple[str, float, float, int]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float):
+        with self._lock:
+            self.spans.append((name, start, end, threading.get_ident()))
+
+    def events(self) -> List[dict]:
+        """Chrome trace event 格式 (微秒)"""
+        root = [{"name": self.name, "ph": "X", "ts": 0.0, "dur": round((self.end - self.start) * 1e6, 1),
+                 "pid": os.getpid(), "tid": self.thread}]
+        return root + [
+            {"name": name, "ph": "X", "ts": round((start - self.start) * 1e6, 1),
+             "dur": round((end - start) * 1e6, 1), "pid": os.getpid(), "tid": tid}
+            for name, start, end, tid in sorted(self.spans, key=lambda s: (s[1], -s[2]))
+        ]
+
+    def folded(self) -> List[str]:
+        """按时间包含关系还原嵌套，输出每个栈的自身耗时 (微秒)"""
+        spans = [(self.name, self.start, self.end)] + [
+            (name, start, end) for name, start, end, _ in sorted(self.spans, key=lambda s: (s[1], -s[2]))]
+        stack: List[Tuple[str, float, float]] = []
+        self_time: Dict[str, float] = {}
+        paths = []
+        for name, start, end in spans:
+            while stack and start >= stack[-1][2]:
+                stack.pop()
+            path = ";".join([s[0] for s in stack] + [name])
+            if stack:
+                parent = ";".join(s[0] for s in stack)
+                self_time[parent] = self_time.get(parent, 0.0) - (end - start)
+            self_time[path] = self_time.get(path, 0.0) + (end - start)
+            paths.append(path)
+            stack.append((name, start, end))
+        return [f"{path} {max(0, int(round(self_time[path] * 1e6)))}" for path in dict.fromkeys(paths)]
+
+    def write(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        with open(base + ".trace.json", "w") as f:
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, f)
+        with open(base + ".folded", "w") as f:
+            f.write("\n".join(self.folded()) + "\n")
+        return base
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class StageTimer:
+    """with timer("lgb"): ...  记录到直方图，并在抽样请求中记录时间区间"""
+
+    __slots__ = ("histogram", "name", "start")
+
+    def __init__(self, histogram: Histogram, name: str):
+        self.histogram = histogram
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.histogram.observe(end - self.start, self.name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(self.name, self.start, end)
+        return False
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+class Stages:
+    """某个服务的阶段计时器：stages("preprocess") 返回上下文管理器"""
+
+    def __init__(self, prefix: str, registry: Registry = REGISTRY):
+        self.histogram = registry.histogram(f"{prefix}_stage_seconds", f"{prefix} latency by stage",
+                                            labelnames=("stage",))
+
+    def __call__(self, name: str):
+        return StageTimer(self.histogram, name) if METRICS_ENABLED else _NOOP
+
+    def observe(self, name: str, seconds: float, start: Optional[float] = None):
+        """记录已知耗时的阶段 (如请求解析：从中间件收到请求到进入处理函数)"""
+        if not METRICS_ENABLED:
+            return
+        self.histogram.observe(seconds, name)
+        trace = _trace.get()
+        if trace is not None and start is not None:
+            trace.add(name, start, start + seconds)
+
+
+_request_start: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_start", default=None)
+
+
+def request_start() -> Optional[float]:
+    """当前请求进入中间件的 perf_counter 时间 (不在请求中时为 None)"""
+    return _request_start.get()
+
+
+# ----------------------------
+# 2. ASGI 中间件与 /metrics
+# ----------------------------
+class MetricsMiddleware:
+    """记录每个请求的路由、状态码与耗时；按抽样率为请求记录分阶段 trace"""
+
+    def __init__(self, app, app_name: str, sample_rate: Optional[float] = None, profile_dir: Optional[str] = None):
+        self.app = app
+        self.app_name = app_name
+        self.sample_rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.profile_dir = profile_dir or PROFILE_DIR
+
+    async def __call__(self, scope, receive, send):
+        # 合并服务中外层应用已在记录时，挂载的子应用不再重复记录
+        if scope["type"] != "http" or not METRICS_ENABLED or _request_start.get() is not None:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        token = _request_start.set(start)
+        trace = None
+        if self.sample_rate > 0 and (
+            random.random() < self.sample_rate or (b"x-profile", b"1") in scope.get("headers", ())
+        ):
+            trace = Trace(f"{scope['method']} {scope['path']}")
+            trace.start = start
+        trace_token = _trace.set(trace)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if trace is not None:
+                    message = {**message, "headers": list(message.get("headers", []))
+                               + [(b"x-profile-id", trace.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            # 按路由模板而不是实际路径统计 (避免标签基数无限增长)；挂载的子应用带上挂载前缀
+            route = getattr(scope.get("route"), "path", None)
+            route = scope.get("root_path", "") + route if route else "unmatched"
+            http_requests.inc(1, self.app_name, route, str(status[0]))
+            http_seconds.observe(elapsed, self.app_name, route)
+            _trace.reset(trace_token)
+            _request_start.reset(token)
+            if trace is not None:
+                trace.end = start + elapsed
+                await asyncio.to_thread(trace.write, self.profile_dir)
+
+
+def metrics_response():
+    from fastapi.responses import Response
+
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
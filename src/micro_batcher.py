@@ -0,0 +1,195 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# ----------------------------
+# 请求合并微批调度器
+# ----------------------------
+# 并发的小请求先进入队列，由单个收集协程在 max_batch_rows / max_wait_ms 的约束下合并成一批，
+# 在工作线程中只执行一次模型推理，再把结果切片按原顺序交还给各个调用方。
+# 事件循环本身不再执行 CPU 密集的 pandas / 树模型计算。
+
+# 批大小直方图的桶上界 (行数)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class QueueFullError(RuntimeError):
+    """等待队列已满，调用方应尽快拒绝请求 (503)"""
+
+
+class _Pending:
+    __slots__ = ("payload", "rows", "future", "enqueued_at")
+
+    def __init__(self, payload, rows, future):
+        self.payload = payload
+        self.rows = rows
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    batch_fn 接收一组 payload，返回与之一一对应的结果列表；它在工作线程中执行。
+    某一批执行失败时会逐个重试，避免一个异常请求拖垮同批的其他请求。
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_rows: int = 512,
+                 max_wait_ms: float = 2.0, max_queue: int = 10000, workers: int = 1):
+        self.batch_fn = batch_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._running = set()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed_batches = 0
+        self.max_queue_depth = 0
+        self.queue_wait_seconds = 0.0
+        self.batch_histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+    # ---------- 生命周期 ----------
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="micro-batch")
+        self._slots = asyncio.Semaphore(self.workers)
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        """停止接收新批次，等待进行中的批次完成"""
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        while self._queue is not None and not self._queue.empty():
+            pending = self._queue.get_nowait()
+            if not pending.future.done():
+                pending.future.set_exception(RuntimeError("Micro-batcher stopped"))
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    # ---------- 提交 ----------
+    async def submit(self, payload: Any, rows: int = 1):
+        """提交一个请求，等待其所在批次完成后返回对应结果"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(_Pending(payload, rows, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Micro-batch queue is full ({self._max_queue} requests)")
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            batch, rows = [first], first.rows
+            try:
+                deadline = loop.time() + self.max_wait
+                while rows < self.max_batch_rows:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        pending = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    batch.append(pending)
+                    rows += pending.rows
+
+                # 工作线程都在忙时在这里等待，队列中的请求会继续累积成更大的下一批
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(RuntimeError("Micro-batcher stopped"))
+                raise
+            task = asyncio.create_task(self._execute(batch, rows))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, batch: List[_Pending], rows: int):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            self.requests += len(batch)
+            self.rows += rows
+            self.batches += 1
+            self.queue_wait_seconds += sum(started - p.enqueued_at for p in batch)
+            self.batch_histogram[self._bucket(rows)] += 1
+
+            try:
+                results = await loop.run_in_executor(self._executor, self.batch_fn, [p.payload for p in batch])
+                outcomes = [(result, None) for result in results]
+            except Exception as e:
+                self.failed_batches += 1
+                if len(batch) == 1:
+                    outcomes = [(None, e)]
+                else:
+                    outcomes = [await self._run_single(p.payload) for p in batch]
+
+            for pending, (result, error) in zip(batch, outcomes):
+                if pending.future.done():  # 调用方已取消 (如客户端断开)
+                    continue
+                if error is not None:
+                    pending.future.set_exception(error)
+                else:
+                    pending.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    async def _run_single(self, payload):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self.batch_fn, [payload])
+            return results[0], None
+        except Exception as e:
+            return None, e
+
+    @staticmethod
+    def _bucket(rows: int) -> int:
+        for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+            if rows <= bound:
+                return i
+        return len(BATCH_SIZE_BUCKETS)
+
+    # ---------- 统计 ----------
+    def stats(self) -> Dict[str, Any]:
+        histogram = {f"le_{bound}": count for bound, count in zip(BATCH_SIZE_BUCKETS, self.batch_histogram)}
+        histogram["gt_" + str(BATCH_SIZE_BUCKETS[-1])] = self.batch_histogram[-1]
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight_batches": len(self._running),
+            "requests": self.requests,
+            "rows": self.rows,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "failed_batches": self.failed_batches,
+            "avg_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+            "avg_rows_per_batch": self.rows / self.batches if self.batches else 0.0,
+            "avg_queue_wait_ms": 1000 * self.queue_wait_seconds / self.requests if self.requests else 0.0,
+            "batch_rows_histogram": histogram,
+            "config": {
+                "max_batch_rows": self.max_batch_rows,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_queue": self._max_queue,
+                "workers": self.workers,
+            },
+        }
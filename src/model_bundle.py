@@ -0,0 +1,295 @@
+"""
+紧凑模型包 (bundle)：原生格式的 booster + JSON 词表 / 元模型系数 + 带校验和的 manifest
+
+joblib 的 sklearn 包装对象在加载时需要导入 lightgbm / xgboost / sklearn，且跨库版本不稳定。
+bundle 目录结构：
+    manifest.json        格式版本、特征顺序、库版本、每个文件的 sha256 与大小
+    lgb_model.txt        LightGBM 原生文本格式 (Booster.save_model)
+    xgb_model.ubj        XGBoost 原生 UBJSON 格式 (Booster.save_model)
+    vocabularies.json    每个类别列的 LabelEncoder.classes_
+    meta.json            逻辑回归元模型的 coef / intercept / classes
+    compiled/            compiled_ensemble.py 的展平树数组 (.npy，可内存映射)
+
+加载时只读 JSON 与 mmap 的 compiled 数组，不导入任何模型库；原生 booster 在第一次走
+native 引擎时才导入对应的库并加载 (也可在后台线程中预取)。每个 artifact 的加载耗时都会记录。
+
+用法 (项目根目录):
+    python src/model_bundle.py export --model-dir models          # 由 .pkl 导出到 models/bundle
+    python src/model_bundle.py verify models/bundle                # 校验 manifest 中的 sha256
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    from src.compiled_ensemble import CompiledEnsemble
+except ImportError:  # 以脚本方式运行
+    from compiled_ensemble import CompiledEnsemble
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+LGB_FILE = "lgb_model.txt"
+XGB_FILE = "xgb_model.ubj"
+VOCAB_FILE = "vocabularies.json"
+META_FILE = "meta.json"
+COMPILED_DIR = "compiled"
+
+
+class BundleError(RuntimeError):
+    """bundle 缺失文件、校验和不一致或格式版本不兼容"""
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ----------------------------
+# 1. 轻量模型对象 (接口与 sklearn 包装对象一致，供 run_ensemble 直接使用)
+# ----------------------------
+class LinearMetaModel:
+    """逻辑回归元模型：只保存系数，提供 decision_function / predict_proba / predict"""
+
+    def __init__(self, coef, intercept, classes):
+        self.coef_ = np.asarray(coef, dtype=np.float64).reshape(1, -1)
+        self.intercept_ = np.asarray(intercept, dtype=np.float64).reshape(1)
+        self.classes_ = np.asarray(classes)
+
+    def decision_function(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=np.float64) @ self.coef_[0] + self.intercept_[0]
+
+    def predict_proba(self, X) -> np.ndarray:
+        p = 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+        return np.column_stack([1.0 - p, p])
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+
+class LazyBooster:
+    """
+    原生 booster 的延迟加载包装：第一次 predict_proba 时才导入 lightgbm / xgboost 并读取模型文件。
+    提供 booster_ / get_booster()，与 sklearn 包装对象一样可交给 CompiledEnsemble.from_models
+    """
+
+    def __init__(self, kind: str, path: str, timings: Dict[str, float]):
+        self.kind = kind
+        self.path = path
+        self._timings = timings
+        self._booster = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._booster is not None
+
+    def load(self):
+        if self._booster is not None:
+            return self._booster
+        with self._lock:
+            if self._booster is None:
+                start = time.perf_counter()
+                if self.kind == "lgb":
+                    import lightgbm
+
+                    booster = lightgbm.Booster(model_file=self.path)
+                else:
+                    import xgboost
+
+                    booster = xgboost.Booster(model_file=self.path)
+                self._timings[f"{self.kind}_booster"] = (time.perf_counter() - start) * 1000
+                self._booster = booster
+        return self._booster
+
+    @property
+    def booster_(self):
+        return self.load()
+
+    def get_booster(self):
+        return self.load()
+
+    def predict_proba(self, X) -> np.ndarray:
+        booster = self.load()
+        if self.kind == "lgb":
+            # num_iteration 缺省时 LightGBM 使用模型文件中记录的 best_iteration
+            p = booster.predict(X)
+        else:
+            import xgboost
+
+            best = booster.attr("best_iteration")
+            iteration_range = (0, int(best) + 1) if best is not None else (0, 0)
+            p = booster.predict(xgboost.DMatrix(X), iteration_range=iteration_range)
+        p = np.asarray(p, dtype=np.float64)
+        return np.column_stack([1.0 - p, p])
+
+
+# ----------------------------
+# 2. 导出
+# ----------------------------
+def export_bundle(lgb_model, xgb_model, meta_model, label_encoders, out_dir: str,
+                  feature_order=None, compiled: bool = True) -> Dict[str, Any]:
+    """把 sklearn 包装的模型与编码器导出为 bundle，返回 manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    lgb_model.booster_.save_model(os.path.join(out_dir, LGB_FILE))
+    xgb_model.get_booster().save_model(os.path.join(out_dir, XGB_FILE))
+    with open(os.path.join(out_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+        json.dump({col: [str(c) for c in le.classes_] for col, le in label_encoders.items()}, f, ensure_ascii=False)
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump({
+            "coef": np.asarray(meta_model.coef_, dtype=np.float64).ravel().tolist(),
+            "intercept": np.asarray(meta_model.intercept_, dtype=np.float64).ravel().tolist(),
+            "classes": np.asarray(meta_model.classes_).tolist(),
+        }, f)
+    if compiled:
+        CompiledEnsemble.from_models(lgb_model, xgb_model, meta_model).save(os.path.join(out_dir, COMPILED_DIR))
+
+    import lightgbm
+    import xgboost
+
+    files = {}
+    for root, _, names in os.walk(out_dir):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, out_dir).replace(os.sep, "/")
+            if rel != MANIFEST:
+                files[rel] = {"sha256": file_sha256(path), "bytes": os.path.getsize(path)}
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "feature_order": list(feature_order) if feature_order is not None else None,
+        "libraries": {"lightgbm": lightgbm.__version__, "xgboost": xgboost.__version__, "numpy": np.__version__},
+        "files": files,
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# ----------------------------
+# 3. 加载
+# ----------------------------
+class ModelBundle:
+    def __init__(self, path: str, manifest: Dict[str, Any], vocabularies, meta_model: LinearMetaModel,
+                 lgb: LazyBooster, xgb: LazyBooster, compiled: Optional[CompiledEnsemble],
+                 timings: Dict[str, float]):
+        self.path = path
+        self.manifest = manifest
+        self.vocabularies = vocabularies
+        self.meta_model = meta_model
+        self.lgb = lgb
+        self.xgb = xgb
+        self.compiled = compiled
+        self.timings = timings  # artifact -> 加载耗时 (ms)
+
+    @classmethod
+    def load(cls, path: str, verify: bool = True, mmap_mode: Optional[str] = "r") -> "ModelBundle":
+        timings: Dict[str, float] = {}
+
+        def timed(name, fn):
+            start = time.perf_counter()
+            result = fn()
+            timings[name] = (time.perf_counter() - start) * 1000
+            return result
+
+        def read_json(name):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                return json.load(f)
+
+        manifest_path = os.path.join(path, MANIFEST)
+        if not os.path.exists(manifest_path):
+            raise BundleError(f"No {MANIFEST} in {path}")
+        manifest = timed("manifest", lambda: read_json(MANIFEST))
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise BundleError(f"Unsupported bundle format version: {manifest.get('format_version')}")
+        if verify:
+            timed("verify", lambda: verify_bundle(path, manifest))
+
+        vocabularies = timed("vocabularies", lambda: {
+            col: np.asarray(classes, dtype=object) for col, classes in read_json(VOCAB_FILE).items()
+        })
+        meta = timed("meta", lambda: read_json(META_FILE))
+        meta_model = LinearMetaModel(meta["coef"], meta["intercept"], meta["classes"])
+        compiled = None
+        if os.path.exists(os.path.join(path, COMPILED_DIR, "ensemble.json")):
+            compiled = timed("compiled", lambda: CompiledEnsemble.load(os.path.join(path, COMPILED_DIR), mmap_mode))
+        return cls(
+            path, manifest, vocabularies, meta_model,
+            LazyBooster("lgb", os.path.join(path, LGB_FILE), timings),
+            LazyBooster("xgb", os.path.join(path, XGB_FILE), timings),
+            compiled, timings,
+        )
+
+    def prefetch(self) -> threading.Thread:
+        """在后台线程中加载原生 booster，不阻塞启动"""
+        thread = threading.Thread(target=lambda: (self.lgb.load(), self.xgb.load()),
+                                  name="bundle-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "created": self.manifest.get("created"),
+            "libraries": self.manifest.get("libraries"),
+            "bytes": sum(f["bytes"] for f in self.manifest["files"].values()),
+            "load_ms": {name: round(ms, 2) for name, ms in self.timings.items()},
+            "boosters_loaded": {"lgb": self.lgb.loaded, "xgb": self.xgb.loaded},
+        }
+
+
+def verify_bundle(path: str, manifest: Dict[str, Any]):
+    """逐个校验 manifest 中列出的文件，缺失或 sha256 不一致时抛出 BundleError"""
+    for rel, info in manifest["files"].items():
+        file_path = os.path.join(path, *rel.split("/"))
+        if not os.path.exists(file_path):
+            raise BundleError(f"Missing bundle file: {rel}")
+        if file_sha256(file_path) != info["sha256"]:
+            raise BundleError(f"Checksum mismatch: {rel}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="由 joblib 模型导出 bundle")
+    export.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    export.add_argument("--out", default=None, help="输出目录，默认 <model-dir>/bundle")
+    export.add_argument("--no-compiled", action="store_true", help="不包含展平树数组")
+    verify = sub.add_parser("verify", help="校验 bundle 的 sha256")
+    verify.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        bundle = ModelBundle.load(args.path, verify=True)
+        print(f"✅ Bundle OK: {json.dumps(bundle.report(), ensure_ascii=False)}")
+        return
+
+    import joblib
+
+    try:
+        from src.classifier_api import feature_order
+    except ImportError:
+        from classifier_api import feature_order
+
+    models = {}
+    for name in ("lgb_model", "xgb_model", "meta_model", "label_encoders"):
+        path = os.path.join(args.model_dir, f"{name}.pkl")
+        if not os.path.exists(path):
+            raise SystemExit(f"❌ Missing {path}; the bundle needs all four artifacts")
+        models[name] = joblib.load(path)
+    out = args.out or os.path.join(args.model_dir, "bundle")
+    manifest = export_bundle(**models, out_dir=out, feature_order=feature_order, compiled=not args.no_compiled)
+    total = sum(f["bytes"] for f in manifest["files"].values())
+    print(f"✅ Bundle saved to {out} ({len(manifest['files'])} files, {total / 1e6:.2f} MB)")
+
+
+if __name__ == "__main__":
+    main()
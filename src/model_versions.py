@@ -0,0 +1,175 @@
+"""
+版本化的模型目录：每次训练得到的模型发布为一个不可变的版本，服务按 CURRENT 加载，可热更新与回滚
+
+    models/
+        versions/
+            20260301-120000/    lgb_model.pkl / xgb_model.pkl / meta_model.pkl / label_encoders.pkl
+                                (可含 bundle/、compiled/、cascade.json) 与 parity.json
+            20260315-093000/
+        CURRENT                 当前版本名 (一行文本)
+
+没有 CURRENT 时 MODEL_DIR 本身就是唯一的版本 (原来的目录布局，不需要迁移)。
+parity.json 是发布时用原模型对一组固定样本算出的概率，服务加载该版本后必须复现这些结果才会切换。
+
+用法 (项目根目录):
+    python src/model_versions.py publish --from cache/new_models --activate [--data kaggle/input/train.csv]
+    python src/model_versions.py list
+    python src/model_versions.py activate 20260301-120000 --url http://127.0.0.1:8000   # 通知服务热更新
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+VERSIONS = "versions"
+CURRENT = "CURRENT"
+PARITY_FILE = "parity.json"
+PARITY_ROWS = 256
+
+
+def version_dir(model_dir: str, name: str) -> str:
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        raise ValueError(f"Invalid model version name: {name!r}")
+    return os.path.join(model_dir, VERSIONS, name)
+
+
+def read_current(model_dir: str) -> Optional[str]:
+    path = os.path.join(model_dir, CURRENT)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+
+def write_current(model_dir: str, name: str):
+    """原子地切换 CURRENT (写临时文件后 rename)"""
+    version_dir(model_dir, name)
+    path = os.path.join(model_dir, CURRENT)
+    with open(path + ".tmp", "w") as f:
+        f.write(name + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def resolve(model_dir: str) -> Tuple[str, Optional[str]]:
+    """(实际加载的目录, 版本名)；原布局返回 (model_dir, None)"""
+    name = read_current(model_dir)
+    if name is None:
+        return model_dir, None
+    return version_dir(model_dir, name), name
+
+
+def list_versions(model_dir: str) -> List[Dict[str, Any]]:
+    root = os.path.join(model_dir, VERSIONS)
+    if not os.path.isdir(root):
+        return []
+    current = read_current(model_dir)
+    versions = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path) or ".tmp" in name:
+            continue
+        versions.append({
+            "name": name,
+            "current": name == current,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(os.path.getmtime(path))),
+            "parity": os.path.exists(os.path.join(path, PARITY_FILE)),
+        })
+    return versions
+
+
+def read_parity(path: str) -> Optional[Dict[str, Any]]:
+    parity_path = os.path.join(path, PARITY_FILE)
+    if not os.path.exists(parity_path):
+        return None
+    with open(parity_path) as f:
+        return json.load(f)
+
+
+# ----------------------------
+# 1. 发布
+# ----------------------------
+def publish(model_dir: str, source_dir: str, name: Optional[str] = None, activate: bool = False,
+            data: Optional[str] = None, parity_rows: int = PARITY_ROWS) -> str:
+    """
+    把 source_dir 中的模型复制为新版本：先写到临时目录并生成 parity.json，完成后再 rename，
+    服务不会看到写了一半的版本。返回版本名
+    """
+    name = name or time.strftime("%Y%m%d-%H%M%S")
+    target = version_dir(model_dir, name)
+    if os.path.exists(target):
+        raise FileExistsError(f"Model version already exists: {target}")
+    tmp = f"{target}.tmp-{os.getpid()}"
+    shutil.copytree(source_dir, tmp, ignore=shutil.ignore_patterns(VERSIONS, CURRENT, "*.tmp*"))
+    try:
+        write_parity(tmp, data, parity_rows)
+        os.rename(tmp, target)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if activate:
+        write_current(model_dir, name)
+    return name
+
+
+def write_parity(path: str, data: Optional[str] = None, rows: int = PARITY_ROWS):
+    """用该目录中的模型对固定样本 (--data 的前 rows 行，否则按词表生成) 打分，写出 parity.json"""
+    try:
+        import src.classifier_api as api
+    except ImportError:
+        import classifier_api as api
+
+    models = api.load_model_set(path)
+    if data:
+        import pandas as pd
+
+        records = json.loads(pd.read_csv(data, nrows=rows).to_json(orient="records"))
+    else:
+        records = api.synthetic_rows(models.feature_encoder, rows)
+    proba, _ = api.run_ensemble(api.preprocess_data(records, models.feature_encoder), api.full_stack(models))
+    with open(os.path.join(path, PARITY_FILE), "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "rows": records,
+                   "proba": [float(p) for p in proba]}, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    pub = sub.add_parser("publish", help="把训练输出目录发布为新版本")
+    pub.add_argument("--from", dest="source", required=True, help="包含 4 个 .pkl (及可选 bundle/ compiled/) 的目录")
+    pub.add_argument("--name", default=None, help="版本名，默认为当前时间")
+    pub.add_argument("--activate", action="store_true", help="发布后写入 CURRENT")
+    pub.add_argument("--data", default=None, help="parity 样本 CSV (默认按词表生成)")
+    pub.add_argument("--parity-rows", type=int, default=PARITY_ROWS)
+    sub.add_parser("list", help="列出版本")
+    act = sub.add_parser("activate", help="切换 CURRENT (可用于回滚到任意旧版本)")
+    act.add_argument("name")
+    act.add_argument("--url", default=None, help="切换后调用服务的 POST /admin/models/reload")
+    args = parser.parse_args(argv)
+
+    if args.command == "publish":
+        name = publish(args.model_dir, args.source, args.name, args.activate, args.data, args.parity_rows)
+        print(f"✅ Published model version {name}" + (" (active)" if args.activate else ""))
+    elif args.command == "list":
+        for v in list_versions(args.model_dir):
+            print(f"{'*' if v['current'] else ' '} {v['name']:<24} {v['created']}  parity={v['parity']}")
+    else:
+        if not os.path.isdir(version_dir(args.model_dir, args.name)):
+            parser.error(f"unknown version {args.name}")
+        write_current(args.model_dir, args.name)
+        print(f"✅ CURRENT -> {args.name}")
+        if args.url:
+            import httpx
+
+            headers = {"X-Admin-Token": os.environ["ADMIN_TOKEN"]} if os.getenv("ADMIN_TOKEN") else {}
+            response = httpx.post(args.url.rstrip("/") + "/admin/models/reload", params={"version": args.name},
+                                  headers=headers, timeout=600)
+            print(json.dumps(response.json(), indent=2, ensure_ascii=False))
+            return 0 if response.is_success else 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
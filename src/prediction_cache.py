@@ -0,0 +1,156 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# ----------------------------
+# 预测结果 LRU 缓存
+# ----------------------------
+# 输入空间是 17 个低基数类别列 + 3 个浮点列，前端表单经常重复提交相同或几乎相同的样本
+# (只改一个字段再预测一次)。这里以预处理后的特征行为键缓存 (概率, 类别)：
+#   - 键为编码后特征行 (float64) 的 16 字节 blake2b 摘要，可选地先对数值列四舍五入
+#   - OrderedDict 实现容量受限的 LRU 淘汰，读写都在锁内完成 (微批推理可能有多个工作线程)
+#   - 缓存与生成它的模型对象绑定，模型或编码器被替换时整体失效
+#   - /explain 的逐特征贡献按同一个键另存一份 (容量 max_explanations)，与预测结果一起失效
+
+
+class PredictionCache:
+    def __init__(self, max_entries: int = 100000, round_decimals: Optional[int] = None,
+                 numeric_positions: Sequence[int] = (), max_explanations: int = 0):
+        self.max_entries = max_entries
+        self.max_explanations = max_explanations
+        self.round_decimals = round_decimals
+        self.numeric_positions = list(numeric_positions)
+        self._entries: "OrderedDict[bytes, Tuple[float, int]]" = OrderedDict()
+        self._explanations: "OrderedDict[bytes, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._owner: Tuple[Any, ...] = ()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.explanation_hits = 0
+        self.explanation_misses = 0
+
+    # ---------- 键 ----------
+    def keys(self, X: np.ndarray) -> List[bytes]:
+        """每一行特征的缓存键；NaN 统一成同一位模式，-0.0 与 0.0 视为相同"""
+        X = np.array(X, dtype=np.float64, order="C", copy=True)
+        if self.round_decimals is not None and self.numeric_positions:
+            X[:, self.numeric_positions] = np.round(X[:, self.numeric_positions], self.round_decimals)
+        X[np.isnan(X)] = np.nan
+        X += 0.0
+        blake2b = hashlib.blake2b
+        return [blake2b(row, digest_size=16).digest() for row in X]
+
+    # ---------- 失效 ----------
+    def bind(self, *owner):
+        """绑定当前模型对象；与上次绑定的对象不同 (按身份比较) 时清空缓存"""
+        with self._lock:
+            if self._owned_by(owner):
+                return
+            if self._entries or self._explanations:
+                self.invalidations += 1
+            self._entries.clear()
+            self._explanations.clear()
+            self._owner = owner
+
+    def _owned_by(self, owner: Tuple[Any, ...]) -> bool:
+        return len(owner) == len(self._owner) and all(a is b for a, b in zip(owner, self._owner))
+
+    def clear(self):
+        with self._lock:
+            if self._entries or self._explanations:
+                self.invalidations += 1
+            self._entries.clear()
+            self._explanations.clear()
+            self._owner = ()
+
+    # ---------- 读写 ----------
+    def lookup(self, keys: List[bytes]):
+        """返回 (概率, 类别, 未命中掩码)；未命中位置的值未定义"""
+        n = len(keys)
+        proba = np.empty(n, dtype=np.float64)
+        pred = np.empty(n, dtype=np.int64)
+        missing = np.ones(n, dtype=bool)
+        entries = self._entries
+        with self._lock:
+            for i, key in enumerate(keys):
+                hit = entries.get(key)
+                if hit is not None:
+                    entries.move_to_end(key)
+                    proba[i], pred[i] = hit
+                    missing[i] = False
+            hits = n - int(missing.sum())
+            self.hits += hits
+            self.misses += n - hits
+        return proba, pred, missing
+
+    def store(self, keys: List[bytes], proba: np.ndarray, pred: np.ndarray, owner: Optional[Tuple[Any, ...]] = None):
+        """owner 为计算这些结果时绑定的模型对象；期间缓存已切换到其他模型 (热更新) 时丢弃，不写入旧版本的结果"""
+        if self.max_entries <= 0:
+            return
+        entries = self._entries
+        with self._lock:
+            if owner is not None and not self._owned_by(owner):
+                return
+            for key, p, c in zip(keys, proba.tolist(), np.asarray(pred).tolist()):
+                entries[key] = (p, c)
+                entries.move_to_end(key)
+            overflow = len(entries) - self.max_entries
+            for _ in range(max(overflow, 0)):
+                entries.popitem(last=False)
+            self.evictions += max(overflow, 0)
+
+    def lookup_explanations(self, keys: List[bytes], n_features: int):
+        """返回 (base_value, 贡献矩阵, 未命中掩码)"""
+        n = len(keys)
+        base = np.empty(n, dtype=np.float64)
+        contributions = np.empty((n, n_features), dtype=np.float64)
+        missing = np.ones(n, dtype=bool)
+        entries = self._explanations
+        with self._lock:
+            for i, key in enumerate(keys):
+                hit = entries.get(key)
+                if hit is not None:
+                    entries.move_to_end(key)
+                    base[i], contributions[i] = hit
+                    missing[i] = False
+            hits = n - int(missing.sum())
+            self.explanation_hits += hits
+            self.explanation_misses += n - hits
+        return base, contributions, missing
+
+    def store_explanations(self, keys: List[bytes], base: np.ndarray, contributions: np.ndarray,
+                           owner: Optional[Tuple[Any, ...]] = None):
+        if self.max_explanations <= 0:
+            return
+        entries = self._explanations
+        with self._lock:
+            if owner is not None and not self._owned_by(owner):
+                return
+            for key, b, row in zip(keys, base.tolist(), contributions):
+                entries[key] = (b, row.copy())
+                entries.move_to_end(key)
+            for _ in range(max(len(entries) - self.max_explanations, 0)):
+                entries.popitem(last=False)
+
+    # ---------- 统计 ----------
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "round_decimals": self.round_decimals,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "explanations": len(self._explanations),
+            "max_explanations": self.max_explanations,
+            "explanation_hits": self.explanation_hits,
+            "explanation_misses": self.explanation_misses,
+        }
@@ -0,0 +1,272 @@
+"""
+分类器多进程服务 (pre-fork supervisor)
+
+supervisor 进程只做三件事：
+  1. 在 fork 之前加载一次只读模型状态 —— 类别词表 + 内存映射 (mmap) 的 compiled ensemble，
+     所有工作进程共享同一份物理页，内存不随进程数线性增长；
+  2. 绑定监听 socket 后 fork 出 N 个 uvicorn 工作进程，由内核在它们之间分发连接；
+  3. 监控工作进程：异常退出或达到 --max-requests 后自动补齐，收到 SIGTERM / SIGINT 时
+     通知全部工作进程优雅退出 (处理完进行中的请求)，超时后强制结束；SIGHUP 逐个滚动重启。
+
+模型目录为版本化布局 (见 model_versions.py) 时加载 CURRENT 指向的版本。SIGHUP 时 supervisor 先重新加载
+共享状态并做 parity 检查，通过后才滚动重启 (新进程 fork 自新状态)，未通过则保留原版本只重启进程。
+
+--engine compiled (默认) 时工作进程只用共享的 compiled 引擎推理 (每进程单线程)，
+--engine native 时每个工作进程各自加载原生 LightGBM / XGBoost (不共享，内存随进程数增长)。
+
+用法 (项目根目录):
+    python src/compiled_ensemble.py --model-dir models   # 首次运行前导出 (缺失时会自动导出)
+    python src/serve.py --workers 4 --port 8000
+"""
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+try:
+    import src.classifier_api as api
+except ImportError:  # 以脚本方式运行 (python src/serve.py)
+    import classifier_api as api
+
+# 工作进程启动后在该时间内退出视为启动失败，连续失败时放慢重启节奏
+MIN_WORKER_LIFETIME = 1.0
+RESPAWN_BACKOFF_MAX = 10.0
+
+
+def ensure_compiled(model_dir: str):
+    """
+    bundle 与 <model_dir>/compiled 中都没有展平树时在子进程中导出，
+    避免 supervisor 自身初始化 OpenMP 运行时
+    """
+    for subdir in (("bundle", "compiled"), ("compiled",)):
+        if os.path.exists(os.path.join(model_dir, *subdir, "ensemble.json")):
+            return
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compiled_ensemble.py")
+    print(f"⏳ Exporting compiled ensemble to {os.path.join(model_dir, 'compiled')}")
+    subprocess.run([sys.executable, script, "--model-dir", model_dir], check=True)
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def limit_threads(threads: int):
+    """限制工作进程内 BLAS / OpenMP 线程数，N 个进程 × 全核线程会严重超订"""
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:  # threadpoolctl 随 scikit-learn 安装，缺失时仅依赖环境变量
+        return
+    threadpool_limits(threads)
+
+
+class Supervisor:
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}  # pid -> 启动时间
+        self.sock = None
+        self.stopping = False
+        self.reload_requested = False
+        self.failures = 0
+
+    # ---------- 工作进程 ----------
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+        # 子进程：恢复默认信号处理，由 uvicorn 自行安装 SIGTERM / SIGINT 的优雅退出逻辑
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        code = 0
+        try:
+            self.run_worker()
+        except BaseException as e:  # 子进程绝不能回到 supervisor 的循环中
+            print(f"❌ Worker {os.getpid()} crashed: {e}", file=sys.stderr)
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def run_worker(self):
+        import uvicorn
+
+        args = self.args
+        limit_threads(args.threads_per_worker)
+        # 请求数上限加随机抖动，避免所有工作进程同时回收
+        max_requests = None
+        if args.max_requests:
+            max_requests = args.max_requests + random.randint(0, args.max_requests_jitter)
+        config = uvicorn.Config(
+            api.app,
+            log_level=args.log_level,
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=args.graceful_timeout,
+            timeout_keep_alive=args.keep_alive,
+        )
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    # ---------- 信号 ----------
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    # ---------- 主循环 ----------
+    def run(self):
+        args = self.args
+        self.sock = bind_socket(args.host, args.port)
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+
+        # 冻结已加载的对象，避免 fork 后各进程的 GC 遍历触碰共享页导致写时复制
+        gc.collect()
+        gc.freeze()
+        for _ in range(args.workers):
+            self.spawn()
+        print(f"🚀 Supervisor {os.getpid()} serving on {args.host}:{args.port} with {args.workers} workers "
+              f"(engine={args.engine})")
+
+        while not self.stopping:
+            self.reap()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload_shared_state()
+                self.rolling_restart()
+            if not self.stopping:
+                self.maintain()
+            time.sleep(0.2)
+        self.shutdown()
+
+    def reap(self):
+        """回收已退出的工作进程，区分正常回收 (max-requests) 与启动即崩溃"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0 and time.monotonic() - started < MIN_WORKER_LIFETIME:
+                self.failures += 1
+            else:
+                self.failures = 0
+            if not self.stopping:
+                print(f"♻️ Worker {pid} exited (code={code}), respawning")
+
+    def maintain(self):
+        missing = self.args.workers - len(self.workers)
+        if missing <= 0:
+            return
+        if self.failures:
+            # 连续启动失败时指数退避，避免疯狂 fork
+            time.sleep(min(RESPAWN_BACKOFF_MAX, 0.5 * 2 ** (self.failures - 1)))
+        for _ in range(missing):
+            self.spawn()
+
+    def reload_shared_state(self):
+        """重新加载 CURRENT 指向的共享状态；parity 检查失败时恢复原状态 (native 引擎由工作进程各自加载)"""
+        if self.args.engine != "compiled":
+            return
+        current = api.current_models()
+        try:
+            model_dir, _ = api.model_versions.resolve(self.args.model_dir)
+            ensure_compiled(model_dir)
+            api.load_shared_state(self.args.model_dir)
+            report = api.check_parity(api.current_models(), model_dir, current)
+            print(f"🔄 Shared model state reloaded (version {api.model_version}, parity {report})")
+        except Exception as e:
+            api.install(current)
+            print(f"❌ Model reload rejected, keeping version {current.version}: {e}", file=sys.stderr)
+        gc.collect()
+        gc.freeze()
+
+    def rolling_restart(self):
+        """逐个通知旧进程退出并等待替补就绪，保证任一时刻都有进程在接收连接"""
+        for pid in list(self.workers):
+            if self.stopping:
+                return
+            self.spawn()
+            self.terminate(pid)
+            deadline = time.monotonic() + self.args.graceful_timeout + 5
+            while pid in self.workers and time.monotonic() < deadline and not self.stopping:
+                self.reap()
+                time.sleep(0.1)
+
+    def terminate(self, pid: int, sig: int = signal.SIGTERM):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+    def shutdown(self):
+        print(f"🛑 Stopping {len(self.workers)} workers (graceful timeout {self.args.graceful_timeout}s)")
+        for pid in list(self.workers):
+            self.terminate(pid)
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            print(f"⚠️ Worker {pid} did not exit in time, killing")
+            self.terminate(pid, signal.SIGKILL)
+        while self.workers:
+            self.reap()
+            time.sleep(0.05)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("CLASSIFIER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CLASSIFIER_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CLASSIFIER_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--engine", choices=["compiled", "native"], default=os.getenv("SERVE_ENGINE", "compiled"),
+                        help="compiled: 共享 mmap 的展平树；native: 每个进程各自加载原生模型")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", os.path.join(os.getcwd(), "models")))
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("CLASSIFIER_MAX_REQUESTS", 0)),
+                        help="单个工作进程处理的请求数上限，达到后回收重启 (0 表示不限)")
+    parser.add_argument("--max-requests-jitter", type=int, default=1000)
+    parser.add_argument("--graceful-timeout", type=int, default=30)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    os.environ["MODEL_DIR"] = args.model_dir
+    if not hasattr(os, "fork"):
+        # Windows 没有 fork：退回单进程 uvicorn (模型在启动事件中加载)
+        import uvicorn
+
+        print("⚠️ os.fork is unavailable on this platform, serving with a single process")
+        uvicorn.run(api.app, host=args.host, port=args.port, log_level=args.log_level)
+        return
+
+    if args.engine == "compiled":
+        ensure_compiled(api.model_versions.resolve(args.model_dir)[0])
+        api.INFERENCE_ENGINE = "compiled"
+        api.load_shared_state(args.model_dir)
+    Supervisor(args).run()
+
+
+if __name__ == "__main__":
+    main()
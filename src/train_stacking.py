@@ -0,0 +1,378 @@
+"""
+Stacking 训练：LightGBM / XGBoost 的 5 折 OOF 与全量模型在进程池中并行训练，再拟合逻辑回归元模型
+
+train_model.ipynb 的 get_oof_preds 对每个模型逐折串行训练，且参数文件固定 device=gpu / cuda，
+在没有 GPU 的机器上无法运行。这里：
+- 每个 (模型, 折) 以及全量模型都是独立的任务，由 spawn 进程池并行执行；
+  总线程数 (--threads，默认 CPU 核数) 按进程数均分给每个任务 (n_jobs)，避免 OpenMP 超额订阅
+- GPU 不可用时 (LightGBM 没有 OpenCL 设备 / XGBoost 没有 CUDA) 自动改为 CPU
+- 训练数据来自 data_prep.py 的缓存，以 .npy 写入工作目录后由各进程内存映射读取，不随任务序列化
+- 每个任务的结果 (OOF / 测试集预测或全量模型) 单独落盘，中断后重新运行只训练缺失的任务；
+  参数、折数或数据变化时使用新的目录
+- 完成后写出 models/ 下的 lgb_model.pkl / xgb_model.pkl / meta_model.pkl / label_encoders.pkl，
+  已有的 compiled/ 与 bundle/ 会一并重新导出，避免服务继续加载旧模型
+- 两个基模型的 OOF 预测与标签保存为 <work_dir>/oof.npz，供 cascade.py 校准级联推理的不确定区间
+
+用法 (项目根目录):
+    python src/train_stacking.py --train kaggle/input/train.csv --test kaggle/input/test.csv
+    python src/train_stacking.py ... --workers 1      # 串行 (与 notebook 相同的执行方式)，用于对比耗时
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    from src.data_prep import DEFAULT_CACHE_DIR, PreparedData, load_training_data
+except ImportError:  # 以脚本方式运行 (python src/train_stacking.py)
+    from data_prep import DEFAULT_CACHE_DIR, PreparedData, load_training_data
+
+MODELS = ("lgb", "xgb")
+PARAM_FILES = {"lgb": "best_lgb_params.json", "xgb": "best_xgb_params.json"}
+DEFAULT_WORK_DIR = os.path.join("cache", "train_stacking")
+FULL = "full"
+
+
+# ----------------------------
+# 1. 参数与设备
+# ----------------------------
+def load_params(params_dir: str) -> Dict[str, Dict[str, Any]]:
+    params = {}
+    for kind, name in PARAM_FILES.items():
+        with open(os.path.join(params_dir, name)) as f:
+            params[kind] = json.load(f)
+    return params
+
+
+def gpu_available(kind: str) -> bool:
+    """用几十行数据试训一轮判断 GPU 是否可用 (两个库都只在真正训练时才报告设备问题)"""
+    X = np.random.default_rng(0).random((64, 2))
+    y = (X[:, 0] > 0.5).astype(int)
+    try:
+        if kind == "lgb":
+            import lightgbm as lgb
+
+            lgb.train({"device": "gpu", "verbosity": -1}, lgb.Dataset(X, y), num_boost_round=1)
+            return True
+        import xgboost as xgb
+
+        if not xgb.build_info().get("USE_CUDA"):
+            return False
+        # 没有可见 GPU 时 XGBoost 只给出警告并退回 CPU
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            xgb.train({"device": "cuda", "tree_method": "hist"}, xgb.DMatrix(X, y), num_boost_round=1)
+        return not any("GPU" in str(w.message) for w in caught)
+    except Exception:
+        return False
+
+
+def resolve_device(kind: str, params: Dict[str, Any], device: str = "auto") -> Dict[str, Any]:
+    """device=auto 时保留参数文件中的 GPU 设置 (若可用)，否则改为 CPU；cpu / gpu 强制指定"""
+    params = dict(params)
+    wants_gpu = str(params.get("device", "cpu")).lower() in ("gpu", "cuda") or device == "gpu"
+    use_gpu = device != "cpu" and wants_gpu and gpu_available(kind)
+    if device == "gpu" and not use_gpu:
+        raise RuntimeError(f"GPU requested but not available for {kind}")
+    if wants_gpu and not use_gpu:
+        print(f"⚠️ GPU not available for {kind}, training on CPU")
+    params["device"] = ("gpu" if kind == "lgb" else "cuda") if use_gpu else "cpu"
+    if kind == "xgb":
+        params.setdefault("tree_method", "hist")
+    return params
+
+
+def make_model(kind: str, params: Dict[str, Any], threads: int):
+    if kind == "lgb":
+        import lightgbm as lgb
+
+        return lgb.LGBMClassifier(**{**params, "n_jobs": threads})
+    import xgboost as xgb
+
+    return xgb.XGBClassifier(**{**params, "n_jobs": threads})
+
+
+def params_key(params: Dict[str, Any], n_splits: int, seed: int, data_key: str) -> str:
+    text = json.dumps([params, n_splits, seed, data_key], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+# ----------------------------
+# 2. 任务 (在工作进程中执行)
+# ----------------------------
+@dataclass
+class Job:
+    kind: str
+    fold: Any          # 折序号，或 FULL 表示全量模型
+    params: Dict[str, Any]
+    n_splits: int
+    seed: int
+    threads: int
+    output: str        # fold: .npz (val_idx / oof / test)，full: .pkl
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}/{self.fold if self.fold == FULL else f'fold{self.fold}'}"
+
+
+_DATA: Dict[str, Any] = {}
+
+
+def init_worker(data_dir: str, threads: int):
+    """工作进程初始化：限制 OpenMP / BLAS 线程数，内存映射训练数据"""
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    load_data(data_dir)
+
+
+def load_data(data_dir: str):
+    _DATA.clear()
+    for name in ("X", "y", "X_test"):
+        path = os.path.join(data_dir, f"{name}.npy")
+        _DATA[name] = np.load(path, mmap_mode="r") if os.path.exists(path) else None
+    with open(os.path.join(data_dir, "columns.json")) as f:
+        _DATA["columns"] = json.load(f)
+
+
+def frame(X: np.ndarray):
+    """带特征名的 DataFrame，使模型的 feature_names_in_ 与推理时的列一致"""
+    import pandas as pd
+
+    return pd.DataFrame(X, columns=_DATA["columns"], copy=False)
+
+
+def fold_indices(y: np.ndarray, n_splits: int, seed: int):
+    from sklearn.model_selection import StratifiedKFold
+
+    return list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed).split(np.zeros(len(y)), y))
+
+
+def run_job(job: Job) -> Dict[str, Any]:
+    import joblib
+
+    start = time.perf_counter()
+    X, y, X_test = _DATA["X"], np.asarray(_DATA["y"]), _DATA["X_test"]
+    model = make_model(job.kind, job.params, job.threads)
+    tmp = job.output + ".tmp"
+    result: Dict[str, Any] = {"job": job.name, "pid": os.getpid()}
+    if job.fold == FULL:
+        model.fit(frame(X), y)
+        joblib.dump(model, tmp)
+    else:
+        train_idx, val_idx = fold_indices(y, job.n_splits, job.seed)[job.fold]
+        model.fit(frame(X[train_idx]), y[train_idx])
+        oof = model.predict_proba(frame(X[val_idx]))[:, 1]
+        test = model.predict_proba(frame(X_test))[:, 1] if X_test is not None else np.empty(0)
+        with open(tmp, "wb") as f:
+            np.savez(f, val_idx=val_idx, oof=oof, test=test)
+        result["mcc"] = round(float(mcc(y[val_idx], oof)), 5)
+    # 写完再改名：中断时不会留下被当作已完成的半成品
+    os.replace(tmp, job.output)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def mcc(y_true, proba) -> float:
+    from sklearn.metrics import matthews_corrcoef
+
+    return matthews_corrcoef(y_true, (np.asarray(proba) > 0.5).astype(int))
+
+
+# ----------------------------
+# 3. 调度与元模型
+# ----------------------------
+def write_data(data: PreparedData, data_dir: str):
+    """把训练 / 测试矩阵写成 float32 .npy，供工作进程内存映射"""
+    if os.path.exists(os.path.join(data_dir, "columns.json")):
+        return
+    tmp = data_dir + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    np.save(os.path.join(tmp, "X.npy"), data.X_train.to_numpy(dtype=np.float32))
+    np.save(os.path.join(tmp, "y.npy"), data.y.to_numpy(dtype=np.int8))
+    if data.X_test is not None:
+        np.save(os.path.join(tmp, "X_test.npy"), data.X_test.to_numpy(dtype=np.float32))
+    with open(os.path.join(tmp, "columns.json"), "w") as f:
+        json.dump(list(data.X_train.columns), f)
+    os.replace(tmp, data_dir)
+
+
+def train(data: PreparedData, params: Dict[str, Dict[str, Any]], model_dir: Optional[str] = "models",
+          work_dir: str = DEFAULT_WORK_DIR, n_splits: int = 5, seed: int = 42, workers: Optional[int] = None,
+          threads: Optional[int] = None, device: str = "auto") -> Dict[str, Any]:
+    """
+    训练全部任务并拟合元模型，返回报告 (各任务耗时、OOF MCC、总耗时)。
+    workers=1 时在当前进程中串行执行，每个任务使用全部线程 (即 notebook 的执行方式)
+    """
+    start = time.perf_counter()
+    threads = threads or os.cpu_count() or 1
+    data_key = data.report.get("key") or hashlib.sha256(
+        np.ascontiguousarray(data.X_train.to_numpy(dtype=np.float32)).tobytes()).hexdigest()[:20]
+    data_dir = os.path.join(work_dir, f"data-{data_key}")
+    os.makedirs(work_dir, exist_ok=True)
+    write_data(data, data_dir)
+
+    resolved = {kind: resolve_device(kind, params[kind], device) for kind in MODELS}
+    jobs: List[Job] = []
+    for kind in MODELS:
+        job_dir = os.path.join(work_dir, f"{kind}-{params_key(resolved[kind], n_splits, seed, data_key)}")
+        os.makedirs(job_dir, exist_ok=True)
+        # 全量模型最大，先提交；各折交错排列，使两个模型的任务同时在跑
+        jobs.append(Job(kind, FULL, resolved[kind], n_splits, seed, 1, os.path.join(job_dir, "full.pkl")))
+        jobs += [Job(kind, k, resolved[kind], n_splits, seed, 1, os.path.join(job_dir, f"fold{k}.npz"))
+                 for k in range(n_splits)]
+    jobs.sort(key=lambda job: job.fold != FULL)
+
+    pending = [job for job in jobs if not os.path.exists(job.output)]
+    uses_gpu = any(p["device"] != "cpu" for p in resolved.values())
+    # GPU 任务共享同一块卡，默认串行；CPU 任务默认每个核一个进程
+    workers = max(1, min(workers or (1 if uses_gpu else threads), len(pending) or 1))
+    per_job = max(1, threads // workers)
+    for job in pending:
+        job.threads = per_job
+    print(f"🚀 {len(pending)} of {len(jobs)} jobs to run ({len(jobs) - len(pending)} resumed), "
+          f"workers={workers}, threads/job={per_job}")
+
+    results = []
+    run_start = time.perf_counter()
+    if workers == 1:
+        load_data(data_dir)
+        for job in pending:
+            results.append(run_job(job))
+            print(f"✅ {results[-1]}")
+    elif pending:
+        # spawn：父进程已初始化 OpenMP (GPU 探测)，fork 后子进程中的 OpenMP 可能死锁
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                 initializer=init_worker, initargs=(data_dir, per_job)) as pool:
+            futures = [pool.submit(run_job, job) for job in pending]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print(f"✅ {results[-1]}")
+    train_s = time.perf_counter() - run_start
+
+    report = stack(jobs, data, model_dir, n_splits)
+    report.update({
+        "device": {kind: p["device"] for kind, p in resolved.items()},
+        "workers": workers,
+        "threads_per_job": per_job,
+        "jobs_run": len(results),
+        "jobs_resumed": len(jobs) - len(pending),
+        "job_seconds": {r["job"]: r["seconds"] for r in results},
+        # 本次各任务耗时之和：同样线程数下串行执行所需的时间
+        "job_seconds_total": round(sum(r["seconds"] for r in results), 3),
+        "train_wall_s": round(train_s, 3),
+        "wall_s": round(time.perf_counter() - start, 3),
+    })
+    oof = report.pop("oof")
+    np.savez(os.path.join(work_dir, "oof.npz"), y=data.y.to_numpy(dtype=np.int8), **oof)
+    with open(os.path.join(work_dir, "report.json"), "w") as f:
+        json.dump({k: v for k, v in report.items() if k != "test_proba"}, f, indent=2)
+    return report
+
+
+def stack(jobs: List[Job], data: PreparedData, model_dir: Optional[str], n_splits: int) -> Dict[str, Any]:
+    """汇总各折的 OOF / 测试集预测，拟合逻辑回归元模型并写出 models/ 下的文件"""
+    import joblib
+    from sklearn.linear_model import LogisticRegression
+
+    y = data.y.to_numpy()
+    oof = {kind: np.zeros(len(y)) for kind in MODELS}
+    test = {kind: 0.0 for kind in MODELS}
+    full_models = {}
+    for job in jobs:
+        if job.fold == FULL:
+            full_models[job.kind] = joblib.load(job.output)
+            continue
+        with np.load(job.output) as saved:
+            oof[job.kind][saved["val_idx"]] = saved["oof"]
+            test[job.kind] = test[job.kind] + saved["test"] / n_splits
+
+    X_meta = np.column_stack([oof[kind] for kind in MODELS])
+    meta_model = LogisticRegression().fit(X_meta, y)
+    report: Dict[str, Any] = {
+        "oof_mcc": {kind: round(float(mcc(y, oof[kind])), 5) for kind in MODELS},
+        "stacking_oof_mcc": round(float(mcc(y, meta_model.predict_proba(X_meta)[:, 1])), 5),
+        "meta_coef": meta_model.coef_.ravel().round(4).tolist(),
+        "oof": oof,
+    }
+    if data.X_test is not None:
+        report["test_proba"] = meta_model.predict_proba(np.column_stack([test[kind] for kind in MODELS]))[:, 1]
+
+    if model_dir:
+        os.makedirs(model_dir, exist_ok=True)
+        artifacts = {
+            "lgb_model": full_models["lgb"], "xgb_model": full_models["xgb"],
+            "meta_model": meta_model, "label_encoders": data.label_encoders(),
+        }
+        for name, obj in artifacts.items():
+            path = os.path.join(model_dir, f"{name}.pkl")
+            joblib.dump(obj, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        report["exported"] = refresh_exports(model_dir, artifacts)
+        print(f"✅ Models saved to {model_dir}")
+    return report
+
+
+def refresh_exports(model_dir: str, artifacts: Dict[str, Any]) -> List[str]:
+    """服务优先加载 bundle/ 与 compiled/：已存在时用新模型重新导出"""
+    try:
+        from src.compiled_ensemble import CompiledEnsemble
+        from src.model_bundle import export_bundle
+    except ImportError:
+        from compiled_ensemble import CompiledEnsemble
+        from model_bundle import export_bundle
+
+    exported = []
+    compiled_dir = os.path.join(model_dir, "compiled")
+    if os.path.exists(os.path.join(compiled_dir, "ensemble.json")):
+        CompiledEnsemble.from_models(
+            artifacts["lgb_model"], artifacts["xgb_model"], artifacts["meta_model"]).save(compiled_dir)
+        exported.append(compiled_dir)
+    bundle_dir = os.path.join(model_dir, "bundle")
+    if os.path.exists(os.path.join(bundle_dir, "manifest.json")):
+        export_bundle(artifacts["lgb_model"], artifacts["xgb_model"], artifacts["meta_model"],
+                      artifacts["label_encoders"], bundle_dir)
+        exported.append(bundle_dir)
+    return exported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--train", default=os.path.join("kaggle", "input", "train.csv"))
+    parser.add_argument("--test", default=os.path.join("kaggle", "input", "test.csv"))
+    parser.add_argument("--no-test", action="store_true", help="不读取 test.csv (不输出测试集预测)")
+    parser.add_argument("--params-dir", default="models_params")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="data_prep 的缓存目录")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="各折结果目录 (断点续训)")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数 (GPU 时为 1)")
+    parser.add_argument("--threads", type=int, default=None, help="总线程数，按进程数均分")
+    parser.add_argument("--device", choices=("auto", "cpu", "gpu"), default="auto")
+    parser.add_argument("--submission", default=None, help="写出 Kaggle 提交文件 (id,class)")
+    args = parser.parse_args(argv)
+
+    data = load_training_data(args.train, None if args.no_test else args.test, args.cache_dir)
+    print(f"⏱️ Data: {json.dumps(data.report)}")
+    report = train(data, load_params(args.params_dir), args.model_dir, args.work_dir, args.folds, args.seed,
+                   args.workers, args.threads, args.device)
+    test_proba = report.pop("test_proba", None)
+    if args.submission and test_proba is not None:
+        import pandas as pd
+
+        pd.DataFrame({"id": data.test_ids, "class": np.where(test_proba > 0.5, "p", "e")}).to_csv(
+            args.submission, index=False)
+        print(f"✅ Submission saved to {args.submission}")
+    print(f"⏱️ {json.dumps(report)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+超参数搜索：Optuna study 持久化到本地 SQLite，多进程并行试验，验证集早停 + 剪枝
+
+train_model.ipynb 中 objective_lgb / objective_xgb 逐个运行 50 次试验，每次都完整训练 500 棵树，
+study 只在内存中，内核崩溃即全部丢失。这里：
+- study 保存在 SQLite (默认 cache/tune/optuna.sqlite3)，中断后重新运行会接着已有的试验继续，
+  直到 (完成 + 剪枝) 的试验数达到 --trials
+- --workers 个进程共享同一个 study 并行试验，总线程数按进程数均分
+- 每次试验以 --max-rounds 为上限，验证集 logloss 连续 --early-stopping 轮不下降即停止；
+  每 REPORT_EVERY 轮向 pruner (median / hyperband) 报告一次，明显落后的试验提前剪枝
+- 搜索空间、训练 / 验证划分与目标 (验证集 MCC) 与 notebook 相同；最优参数按原格式写回
+  models_params/best_*_params.json，n_estimators 取最优试验早停时的轮数
+- 报告每小时试验数、各状态的试验数与最优 MCC 随时间的变化
+
+用法 (项目根目录):
+    python src/tune.py lgb --trials 50 --workers 4
+    python src/tune.py xgb --trials 50 --workers 4 --pruner hyperband
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import optuna
+
+try:
+    from src.data_prep import DEFAULT_CACHE_DIR, load_training_data
+    from src.train_stacking import PARAM_FILES, load_data, make_model, mcc, resolve_device, write_data
+    from src import train_stacking
+except ImportError:  # 以脚本方式运行 (python src/tune.py)
+    from data_prep import DEFAULT_CACHE_DIR, load_training_data
+    from train_stacking import PARAM_FILES, load_data, make_model, mcc, resolve_device, write_data
+    import train_stacking
+
+DEFAULT_STORAGE = "sqlite:///" + os.path.join("cache", "tune", "optuna.sqlite3").replace(os.sep, "/")
+DEFAULT_WORK_DIR = os.path.join("cache", "tune")
+# 每隔多少轮向 pruner 报告一次验证集 logloss (每轮都写 SQLite 会拖慢训练)
+REPORT_EVERY = 10
+
+# notebook 中写入参数文件的固定参数
+FIXED_PARAMS = {
+    "lgb": {"objective": "binary", "metric": "binary_logloss", "verbosity": -1},
+    "xgb": {"objective": "binary:logistic", "eval_metric": "logloss", "tree_method": "hist"},
+}
+
+
+# ----------------------------
+# 1. 搜索空间 (与 notebook 相同)
+# ----------------------------
+def suggest(kind: str, trial: optuna.Trial) -> Dict[str, Any]:
+    if kind == "lgb":
+        return {
+            "learning_rate": trial.suggest_float("learning_rate", 0.01, 0.1, log=True),
+            "num_leaves": trial.suggest_int("num_leaves", 20, 255),
+            "max_depth": trial.suggest_int("max_depth", 3, 12),
+            "min_child_samples": trial.suggest_int("min_child_samples", 5, 100),
+            "subsample": trial.suggest_float("subsample", 0.5, 1.0),
+            "colsample_bytree": trial.suggest_float("colsample_bytree", 0.5, 1.0),
+        }
+    return {
+        "learning_rate": trial.suggest_float("learning_rate", 0.01, 0.1, log=True),
+        "max_depth": trial.suggest_int("max_depth", 3, 12),
+        "min_child_weight": trial.suggest_int("min_child_weight", 1, 10),
+        "subsample": trial.suggest_float("subsample", 0.5, 1.0),
+        "colsample_bytree": trial.suggest_float("colsample_bytree", 0.5, 1.0),
+        "gamma": trial.suggest_float("gamma", 1e-8, 1.0, log=True),
+    }
+
+
+def make_pruner(name: str, max_rounds: int) -> optuna.pruners.BasePruner:
+    if name == "hyperband":
+        return optuna.pruners.HyperbandPruner(min_resource=REPORT_EVERY * 5, max_resource=max_rounds,
+                                              reduction_factor=3)
+    if name == "median":
+        return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=REPORT_EVERY * 5,
+                                           interval_steps=REPORT_EVERY)
+    return optuna.pruners.NopPruner()
+
+
+# ----------------------------
+# 2. 剪枝回调
+# ----------------------------
+# study 方向为最大化 MCC，中间值报告为 -logloss，使 pruner 的比较方向一致
+def lgb_pruning_callback(trial: optuna.Trial):
+    def callback(env):
+        step = env.iteration + 1
+        if step % REPORT_EVERY:
+            return
+        _, _, logloss, _ = env.evaluation_result_list[0]
+        trial.report(-logloss, step)
+        if trial.should_prune():
+            raise optuna.TrialPruned(f"pruned at round {step}")
+
+    callback.order = 40  # 在 early_stopping (order=30) 之后执行
+    return callback
+
+
+def xgb_pruning_callback(trial: optuna.Trial):
+    import xgboost as xgb
+
+    class PruningCallback(xgb.callback.TrainingCallback):
+        def after_iteration(self, model, epoch, evals_log):
+            step = epoch + 1
+            if step % REPORT_EVERY == 0:
+                logloss = next(iter(next(iter(evals_log.values())).values()))[-1]
+                trial.report(-float(logloss), step)
+                if trial.should_prune():
+                    raise optuna.TrialPruned(f"pruned at round {step}")
+            return False
+
+    return PruningCallback()
+
+
+# ----------------------------
+# 3. 试验 (在工作进程中执行)
+# ----------------------------
+def objective(kind: str, params: Dict[str, Any], split, threads: int, max_rounds: int, early_stopping: int):
+    X = np.asarray(train_stacking._DATA["X"])
+    y = np.asarray(train_stacking._DATA["y"])
+    train_idx, val_idx = split
+    X_train, y_train = train_stacking.frame(X[train_idx]), y[train_idx]
+    X_val, y_val = train_stacking.frame(X[val_idx]), y[val_idx]
+
+    def run(trial: optuna.Trial) -> float:
+        trial_params = {**params, **suggest(kind, trial), "n_estimators": max_rounds}
+        if kind == "lgb":
+            import lightgbm as lgb
+
+            model = make_model(kind, trial_params, threads)
+            model.fit(X_train, y_train, eval_set=[(X_val, y_val)], callbacks=[
+                lgb.early_stopping(early_stopping, verbose=False), lgb_pruning_callback(trial)])
+            best_iteration = model.best_iteration_ or max_rounds
+        else:
+            model = make_model(kind, {**trial_params, "early_stopping_rounds": early_stopping,
+                                      "callbacks": [xgb_pruning_callback(trial)]}, threads)
+            model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+            best_iteration = model.best_iteration + 1
+        trial.set_user_attr("best_iteration", int(best_iteration))
+        # 两个库的 sklearn 接口在早停后都按最优轮数预测
+        return float(mcc(y_val, model.predict_proba(X_val)[:, 1]))
+
+    return run
+
+
+def worker(kind: str, study_name: str, storage: str, data_dir: str, params: Dict[str, Any], split,
+           n_trials: int, threads: int, max_rounds: int, early_stopping: int, pruner: str, seed: int) -> int:
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    load_data(data_dir)
+    study = optuna.load_study(study_name=study_name, storage=make_storage(storage),
+                              sampler=optuna.samplers.TPESampler(seed=seed),
+                              pruner=make_pruner(pruner, max_rounds))
+    # 所有进程合计 (含之前中断的运行) 达到 n_trials 个完成 / 剪枝的试验后停止
+    stop = optuna.study.MaxTrialsCallback(n_trials, states=(optuna.trial.TrialState.COMPLETE,
+                                                            optuna.trial.TrialState.PRUNED))
+    study.optimize(objective(kind, params, split, threads, max_rounds, early_stopping),
+                   n_trials=n_trials, callbacks=[stop])
+    return os.getpid()
+
+
+def make_storage(url: str):
+    if url.startswith("sqlite:///"):
+        os.makedirs(os.path.dirname(os.path.abspath(url[len("sqlite:///"):])), exist_ok=True)
+        # 多个进程同时写入时等待锁而不是立即报错
+        return optuna.storages.RDBStorage(url, engine_kwargs={"connect_args": {"timeout": 60}})
+    return url
+
+
+# ----------------------------
+# 4. 调度与报告
+# ----------------------------
+def progress(study: optuna.Study) -> Dict[str, Any]:
+    """各状态试验数、每小时试验数与最优 MCC 随时间的变化 (从第一个试验开始计时)"""
+    trials = [t for t in study.get_trials(deepcopy=False) if t.datetime_start is not None]
+    finished = sorted((t for t in trials if t.datetime_complete is not None), key=lambda t: t.datetime_complete)
+    counts = {state.name.lower(): sum(t.state == state for t in trials) for state in optuna.trial.TrialState}
+    report: Dict[str, Any] = {"trials": {k: v for k, v in counts.items() if v}}
+    if not finished:
+        return report
+    origin = min(t.datetime_start for t in trials)
+    elapsed = (finished[-1].datetime_complete - origin).total_seconds()
+    best_over_time: List[Dict[str, Any]] = []
+    for t in finished:
+        if t.state == optuna.trial.TrialState.COMPLETE and (
+            not best_over_time or t.value > best_over_time[-1]["mcc"]
+        ):
+            best_over_time.append({"elapsed_s": round((t.datetime_complete - origin).total_seconds(), 1),
+                                   "trial": t.number, "mcc": round(t.value, 5)})
+    report.update({
+        "elapsed_s": round(elapsed, 1),
+        "trials_per_hour": round(len(finished) / elapsed * 3600, 1) if elapsed else None,
+        "best_over_time": best_over_time,
+    })
+    return report
+
+
+def best_params(kind: str, study: optuna.Study, previous: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """notebook 的参数文件格式：最优搜索参数 + 固定参数；device 沿用原文件 (GPU 机器上仍使用 GPU)"""
+    best = study.best_trial
+    params = {**best.params, **FIXED_PARAMS[kind]}
+    params["device"] = (previous or {}).get("device", "gpu" if kind == "lgb" else "cuda")
+    params["n_estimators"] = best.user_attrs.get("best_iteration", params.get("n_estimators"))
+    return params
+
+
+def tune(kind: str, data, n_trials: int = 50, workers: int = 1, threads: Optional[int] = None,
+         storage: str = DEFAULT_STORAGE, study_name: Optional[str] = None, work_dir: str = DEFAULT_WORK_DIR,
+         max_rounds: int = 500, early_stopping: int = 50, pruner: str = "median", seed: int = 42,
+         device: str = "auto", base_params: Optional[Dict[str, Any]] = None) -> optuna.Study:
+    from sklearn.model_selection import train_test_split
+
+    threads = threads or os.cpu_count() or 1
+    workers = max(1, workers)
+    data_dir = os.path.join(work_dir, f"data-{data.report.get('key', 'memory')}")
+    os.makedirs(work_dir, exist_ok=True)
+    write_data(data, data_dir)
+    y = data.y.to_numpy()
+    # 与 notebook 相同的 80/20 分层划分
+    split = train_test_split(np.arange(len(y)), test_size=0.2, random_state=seed, stratify=y)
+    params = resolve_device(kind, {**FIXED_PARAMS[kind], **(base_params or {})}, device)
+
+    study_name = study_name or f"{kind}-{data.report.get('key', 'memory')}"
+    study = optuna.create_study(study_name=study_name, storage=make_storage(storage), direction="maximize",
+                                load_if_exists=True)
+    done = sum(t.state in (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+               for t in study.get_trials(deepcopy=False))
+    per_job = max(1, threads // workers)
+    print(f"🚀 Study {study_name}: {done} trials already finished, target {n_trials}, "
+          f"workers={workers}, threads/trial={per_job}, pruner={pruner}")
+    args = (kind, study_name, storage, data_dir, params, split, n_trials, per_job, max_rounds, early_stopping,
+            pruner)
+    if done < n_trials:
+        if workers == 1:
+            worker(*args, seed)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+                # 每个进程使用不同的采样种子，避免并行提出相同的参数
+                for future in [pool.submit(worker, *args, seed + i) for i in range(workers)]:
+                    future.result()
+    return optuna.load_study(study_name=study_name, storage=make_storage(storage))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", choices=("lgb", "xgb"))
+    parser.add_argument("--train", default=os.path.join("kaggle", "input", "train.csv"))
+    parser.add_argument("--trials", type=int, default=50, help="完成 + 剪枝的试验总数 (含之前的运行)")
+    parser.add_argument("--workers", type=int, default=1, help="并行试验的进程数")
+    parser.add_argument("--threads", type=int, default=None, help="总线程数，按进程数均分")
+    parser.add_argument("--max-rounds", type=int, default=500, help="每次试验的最大树数")
+    parser.add_argument("--early-stopping", type=int, default=50, help="验证集 logloss 不再下降的容忍轮数")
+    parser.add_argument("--pruner", choices=("median", "hyperband", "none"), default="median")
+    parser.add_argument("--storage", default=os.getenv("OPTUNA_STORAGE", DEFAULT_STORAGE))
+    parser.add_argument("--study-name", default=None, help="默认 <model>-<数据缓存键>")
+    parser.add_argument("--params-dir", default="models_params")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="data_prep 的缓存目录")
+    parser.add_argument("--device", choices=("auto", "cpu", "gpu"), default="auto")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dry-run", action="store_true", help="不写回 models_params")
+    args = parser.parse_args(argv)
+
+    data = load_training_data(args.train, None, args.cache_dir)
+    path = os.path.join(args.params_dir, PARAM_FILES[args.model])
+    previous = None
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+    start = time.perf_counter()
+    study = tune(args.model, data, args.trials, args.workers, args.threads, args.storage, args.study_name,
+                 max_rounds=args.max_rounds, early_stopping=args.early_stopping, pruner=args.pruner,
+                 seed=args.seed, device=args.device,
+                 base_params={"device": previous["device"]} if previous and "device" in previous else None)
+    report = progress(study)
+    report["run_wall_s"] = round(time.perf_counter() - start, 1)
+    print(f"⏱️ {json.dumps(report)}")
+    print(f"最优参数: {study.best_params}\n最高 MCC: {study.best_value:.5f}")
+    if not args.dry_run:
+        os.makedirs(args.params_dir, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(best_params(args.model, study, previous), f, indent=4)
+        print(f"✅ Params saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# ----------------------------
+# VLM 特征提取结果的持久化缓存 (SQLite)
+# ----------------------------
+# 键 = sha256(提示词 / 模型版本 + 解码后的像素)，同一张照片重新编码成不同的 base64 / JPEG
+# 容器也能命中；可选的 dHash 感知哈希近似查找用于捕获轻微缩放、重新压缩后的同一张照片。
+# 条目按 TTL 与最大条目数 (按最近访问时间 LRU) 淘汰，数据库使用 WAL 模式，可被多个进程共享。
+
+# dHash 的缩略图尺寸：(HASH_SIZE + 1) x HASH_SIZE 灰度图，得到 64 位哈希
+HASH_SIZE = 8
+# 每写入多少条检查一次淘汰
+EVICT_EVERY = 64
+
+
+def version_key(*parts: Any) -> str:
+    """提示词、模型名、生成参数的摘要；任一变化都会使旧缓存失效"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def image_fingerprint(data: bytes) -> Tuple[str, Optional[int]]:
+    """
+    返回 (内容哈希, dHash)。能解码为图片时对 EXIF 方向校正后的 RGB 像素取哈希，
+    否则退回原始字节的哈希 (dHash 为 None)
+    """
+    try:
+        from PIL import Image, ImageOps
+
+        with Image.open(io.BytesIO(data)) as img:
+            return pixel_fingerprint(ImageOps.exif_transpose(img).convert("RGB"))
+    except Exception:
+        return hashlib.sha256(data).hexdigest(), None
+
+
+def pixel_fingerprint(img) -> Tuple[str, int]:
+    """已解码 (且已按 EXIF 方向校正) 的 RGB 图片的 (内容哈希, dHash)"""
+    digest = hashlib.sha256(f"{img.width}x{img.height}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest(), dhash(img)
+
+
+def dhash(img) -> int:
+    """差值哈希：缩成 9x8 灰度图，比较每行相邻像素的明暗，得到 64 位整数"""
+    from PIL import Image
+
+    # BOX 为区域平均，对大图也很快，且对重新压缩 / 轻微缩放不敏感
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _signed(value: int) -> int:
+    """SQLite INTEGER 为有符号 64 位"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class VLMCache:
+    def __init__(self, path: str, version: str, max_entries: int = 10000, ttl_seconds: float = 30 * 86400,
+                 near_duplicate_distance: int = 0):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.near_duplicate_distance = near_duplicate_distance
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS vlm_cache (
+                    key TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    dhash INTEGER,
+                    result TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS vlm_cache_access ON vlm_cache (last_access)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS vlm_cache_version ON vlm_cache (version)")
+        # 当前版本条目的 dHash 常驻内存，近似查找时在内存中比较汉明距离
+        self._dhashes: Dict[str, int] = {}
+        if near_duplicate_distance > 0:
+            rows = self._db.execute(
+                "SELECT key, dhash FROM vlm_cache WHERE version = ? AND dhash IS NOT NULL", (version,)
+            ).fetchall()
+            self._dhashes = {key: value & ((1 << 64) - 1) for key, value in rows}
+        self._puts = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key(self, content_hash: str) -> str:
+        return hashlib.sha256(f"{self.version}:{content_hash}".encode()).hexdigest()
+
+    # ---------- 读写 ----------
+    def get(self, content_hash: str, image_dhash: Optional[int] = None) -> Tuple[Optional[Dict[str, Any]], str]:
+        """返回 (结果, 命中类型 exact / near / miss)"""
+        key = self.key(content_hash)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result FROM vlm_cache WHERE key = ? AND created >= ?", (key, now - self.ttl)
+            ).fetchone()
+            kind = "exact"
+            if row is None and image_dhash is not None and self.near_duplicate_distance > 0:
+                key = self._nearest(image_dhash)
+                kind = "near"
+                if key is not None:
+                    row = self._db.execute(
+                        "SELECT result FROM vlm_cache WHERE key = ? AND created >= ?", (key, now - self.ttl)
+                    ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, "miss"
+            self._db.execute("UPDATE vlm_cache SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        if kind == "exact":
+            self.exact_hits += 1
+        else:
+            self.near_hits += 1
+        return json.loads(row[0]), kind
+
+    def _nearest(self, image_dhash: int) -> Optional[str]:
+        best_key, best = None, self.near_duplicate_distance + 1
+        for key, value in self._dhashes.items():
+            distance = (value ^ image_dhash).bit_count()
+            if distance < best:
+                best_key, best = key, distance
+        return best_key
+
+    def put(self, content_hash: str, result: Dict[str, Any], image_dhash: Optional[int] = None):
+        key = self.key(content_hash)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO vlm_cache (key, version, dhash, result, created, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, self.version, _signed(image_dhash) if image_dhash is not None else None,
+                 json.dumps(result, ensure_ascii=False), now, now),
+            )
+            if image_dhash is not None and self.near_duplicate_distance > 0:
+                self._dhashes[key] = image_dhash
+            self.stores += 1
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """删除过期条目，再按最近访问时间淘汰超出 max_entries 的部分 (调用方持有锁)"""
+        removed = self._db.execute("DELETE FROM vlm_cache WHERE created < ?", (now - self.ttl,)).rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM vlm_cache").fetchone()[0]
+        if count > self.max_entries:
+            removed += self._db.execute(
+                "DELETE FROM vlm_cache WHERE key IN "
+                "(SELECT key FROM vlm_cache ORDER BY last_access LIMIT ?)", (count - self.max_entries,)
+            ).rowcount
+        if removed:
+            self.evictions += removed
+            live = {key for (key,) in self._db.execute("SELECT key FROM vlm_cache WHERE version = ?", (self.version,))}
+            self._dhashes = {key: value for key, value in self._dhashes.items() if key in live}
+
+    def evict(self):
+        with self._lock:
+            self._evict(time.time())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ---------- 统计 ----------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM vlm_cache").fetchone()[0]
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "path": self.path,
+            "version": self.version,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "near_duplicate_distance": self.near_duplicate_distance,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.near_hits) / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, APITimeoutError
+
+try:
+    from src.vlm_output import JSONObjectScanner, loads_object
+except ImportError:  # 以脚本方式运行
+    from vlm_output import JSONObjectScanner, loads_object
+
+# ----------------------------
+# 异步、连接池复用、限流的 VLM 客户端
+# ----------------------------
+# 同步的 OpenAI(...).chat.completions.create 在 async 接口中会阻塞整个事件循环。
+# 这里所有请求共用一个 httpx.AsyncClient 连接池，同时进行的 VLM 调用数由信号量限制，
+# 拿不到名额的请求在有界队列中等待；队列已满或等待超时时立即拒绝 (503)，而不是无限堆积。
+
+
+class VLMBusyError(RuntimeError):
+    """等待队列已满或排队超时，调用方应返回 503"""
+
+
+class VLMTimeoutError(RuntimeError):
+    """单次 VLM 调用超时，调用方应返回 504"""
+
+
+class VLMClient:
+    def __init__(self, base_url: str, api_key: str = "lm-studio", model: str = "local-model",
+                 max_concurrency: int = 2, max_queue: int = 16, timeout: float = 60.0,
+                 queue_timeout: float = 30.0, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._http = httpx.AsyncClient(
+            transport=transport,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=httpx.Timeout(timeout, connect=5.0),
+        )
+        # 重试由调用方决定；SDK 默认的自动重试会让排队时间不可控
+        self._client = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=self._http, max_retries=0)
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.acquired = 0
+        self.total_latency = 0.0
+        self.total_queue_wait = 0.0
+        # 流式调用统计：收到的增量内容块数、提前结束次数、首 token 与出结果耗时
+        self.streamed = 0
+        self.early_stops = 0
+        self.chunks = 0
+        self.total_first_token = 0.0
+        self.total_time_to_result = 0.0
+
+    async def aclose(self):
+        await self._client.close()
+        await self._http.aclose()
+
+    async def _acquire(self):
+        if not self._slots.locked():  # 有空闲名额时直接占用，不计入排队
+            await self._slots.acquire()
+            self.acquired += 1
+            return
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise VLMBusyError(f"VLM queue is full ({self.max_queue} waiting)")
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise VLMBusyError(f"Waited more than {self.queue_timeout}s for a VLM slot")
+        finally:
+            self.waiting -= 1
+        self.acquired += 1
+        self.total_queue_wait += time.perf_counter() - start
+
+    async def _run(self, call: Callable[[], Any]):
+        """占用一个名额执行 call()，统一处理超时、失败计数与延迟统计"""
+        await self._acquire()
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(call(), self.timeout)
+        except (asyncio.TimeoutError, APITimeoutError):
+            self.timeouts += 1
+            raise VLMTimeoutError(f"VLM call exceeded {self.timeout}s")
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+        self.completed += 1
+        self.total_latency += time.perf_counter() - start
+        return result
+
+    async def chat(self, messages: List[Dict[str, Any]], **kwargs) -> str:
+        """发送一次 chat.completions 请求并返回文本内容"""
+        response = await self._run(
+            lambda: self._client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+        )
+        return response.choices[0].message.content or ""
+
+    async def chat_json(self, messages: List[Dict[str, Any]], parse: Callable[[str], Any] = loads_object,
+                        **kwargs) -> Tuple[Any, Dict[str, Any]]:
+        """
+        流式请求，增量文本交给 JSONObjectScanner；第一个闭合且能被 parse 解析的顶层对象出现后
+        立即关闭流 (服务端检测到连接断开即停止生成)，不再等待模型输出后面的解释文字。
+
+        返回 (parse 结果, {"chunks", "first_token_ms", "time_to_result_ms", "early_stop"})，chunks 为收到的
+        增量内容块数 (不是 token 数：服务端只在流结束时给出 usage，提前关闭时拿不到)；early_stop 表示对象闭合时
+        服务端还没有发出带 finish_reason 的块，即关闭连接确实截断了生成。
+        输出结束仍没有可解析的对象时抛出 json.JSONDecodeError (ValueError 的子类)
+        """
+        start = time.perf_counter()
+
+        async def consume():
+            stream = await self._client.chat.completions.create(
+                model=self.model, messages=messages, stream=True, **kwargs
+            )
+            scanner = JSONObjectScanner()
+            chunks, first_token, finished = 0, None, False
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    finished = finished or choice.finish_reason is not None
+                    delta = choice.delta.content if choice.delta else None
+                    if not delta:
+                        continue
+                    chunks += 1
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    text = scanner.feed(delta)
+                    while text is not None:
+                        try:
+                            return parse(text), chunks, first_token, not finished
+                        except ValueError:  # 文字说明中的花括号等，继续寻找下一个对象
+                            text = scanner.feed("")
+            finally:
+                await stream.close()
+            raw = scanner.text()
+            raise json.JSONDecodeError(f"Model failed to generate a valid JSON object. Raw: {raw}", raw, 0)
+
+        result, chunks, first_token, early = await self._run(consume)
+        elapsed = time.perf_counter() - start
+        self.streamed += 1
+        self.chunks += chunks
+        self.early_stops += early
+        self.total_first_token += first_token or 0.0
+        self.total_time_to_result += elapsed
+        return result, {
+            "chunks": chunks,
+            "first_token_ms": (first_token or 0.0) * 1000,
+            "time_to_result_ms": elapsed * 1000,
+            "early_stop": early,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_latency_ms": 1000 * self.total_latency / self.completed if self.completed else 0.0,
+            "avg_queue_wait_ms": 1000 * self.total_queue_wait / self.acquired if self.acquired else 0.0,
+            "stream": {
+                "calls": self.streamed,
+                "early_stops": self.early_stops,
+                "avg_chunks": self.chunks / self.streamed if self.streamed else 0.0,
+                "avg_first_token_ms": 1000 * self.total_first_token / self.streamed if self.streamed else 0.0,
+                "avg_time_to_result_ms": 1000 * self.total_time_to_result / self.streamed if self.streamed else 0.0,
+            },
+            "config": {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "timeout_s": self.timeout,
+                "queue_timeout_s": self.queue_timeout,
+            },
+        }
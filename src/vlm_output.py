@@ -0,0 +1,119 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# ----------------------------
+# VLM 输出的增量解析与字段校验
+# ----------------------------
+# 流式接收时逐块喂给 JSONObjectScanner：它只跟踪花括号深度与字符串 / 转义状态，
+# 顶层对象一闭合就返回对象文本，调用方即可取消生成，不必等模型输出后面的解释文字。
+
+
+class JSONObjectScanner:
+    """增量查找顶层 JSON 对象 (感知字符串与转义，字符串中的花括号不计数)"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.pending = ""  # 已接收但尚未扫描的文本
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.current: List[str] = []  # 正在累积的对象文本
+
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """
+        追加一段文本；有顶层对象闭合时返回其完整文本，否则返回 None。
+        同一段文本中对象之后的剩余部分会在下一次 feed 时继续扫描
+        """
+        self.chunks.append(chunk)
+        text, self.pending = self.pending + chunk, ""
+        start = 0 if self.depth else None
+        for index, ch in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = self.depth > 0
+            elif ch == "{":
+                if self.depth == 0:
+                    start = index
+                self.depth += 1
+            elif ch == "}" and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.current.append(text[start:index + 1])
+                    obj, self.current = "".join(self.current), []
+                    self.pending = text[index + 1:]
+                    return obj
+        if self.depth:
+            self.current.append(text[start:])
+        return None
+
+
+# ----------------------------
+# 20 个特征字段的 schema (从提示词中的特征表解析，提示词是唯一的定义来源)
+# ----------------------------
+_ROW = re.compile(r"^\|\s*\d+\.[^|]*\|\s*`([^`]+)`\s*\|\s*([^|]+?)\s*\|\s*$")
+
+
+def schema_from_prompt(prompt: str) -> Dict[str, Optional[frozenset]]:
+    """
+    解析提示词的 Feature Mapping 表：{字段: 允许的编码集合}，数值字段 (Float) 为 None
+    """
+    schema: Dict[str, Optional[frozenset]] = {}
+    for line in prompt.splitlines():
+        match = _ROW.match(line.strip())
+        if not match:
+            continue
+        key, values = match.groups()
+        if values.lower().startswith("float"):
+            schema[key] = None
+        else:
+            schema[key] = frozenset(part.split(":", 1)[0].strip() for part in values.split(","))
+    return schema
+
+
+def validate_features(features: Dict[str, Any], schema: Dict[str, Optional[frozenset]]
+                      ) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    按 schema 规整 VLM 输出：补齐缺失字段 (null)、丢弃多余字段、数值字段转为 float、
+    不在允许集合中的类别值置为 null。返回 (规整后的特征, 问题列表)
+    """
+    clean: Dict[str, Any] = {}
+    issues: List[str] = []
+    for key, allowed in schema.items():
+        if key not in features:
+            issues.append(f"missing {key}")
+            clean[key] = None
+            continue
+        value = features[key]
+        if value is None:
+            clean[key] = None
+        elif allowed is None:
+            try:
+                clean[key] = float(value)
+            except (TypeError, ValueError):
+                issues.append(f"{key}: not a number ({value!r})")
+                clean[key] = None
+        elif isinstance(value, str) and value in allowed:
+            clean[key] = value
+        else:
+            issues.append(f"{key}: unexpected value {value!r}")
+            clean[key] = None
+    issues.extend(f"unknown field {key}" for key in features if key not in schema)
+    return clean, issues
+
+
+def loads_object(text: str) -> Dict[str, Any]:
+    """解析对象文本 (兼容模型输出 Python 的 None)，不是 JSON 对象时抛出 json.JSONDecodeError"""
+    obj = json.loads(text.replace(": None", ": null"))
+    if not isinstance(obj, dict):
+        raise json.JSONDecodeError("Top-level value is not an object", text, 0)
+    return obj
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import LabelEncoder
+
+import src.classifier_api as api
+
+VOCAB = ['a', 'b', 'c', 'f', 'n', 'nan', 's', 't', 'w', 'x']
+
+
+def make_raw_rows(n, seed=0):
+    """按 API 输入格式生成随机原始样本 (含 None)"""
+    rng = np.random.default_rng(seed)
+    pool = np.array(VOCAB[:-1] + [None], dtype=object)
+    rows = []
+    for i in range(n):
+        row = {"id": i}
+        for col in api.feature_order:
+            if col in api.numeric_cols:
+                row[col] = float(np.round(rng.uniform(0, 20), 2))
+            else:
+                row[col] = pool[rng.integers(len(pool))]
+        rows.append(row)
+    return rows
+
+
+def preprocess_with(encoders, rows):
+    """用指定编码器预处理，不改动 classifier_api 的全局状态"""
+    previous = api.label_encoders
+    api.label_encoders = encoders
+    try:
+        return api.preprocess_data(rows)
+    finally:
+        api.label_encoders = previous
+
+
+@pytest.fixture(scope="session")
+def tiny_models():
+    """在合成数据上训练的小型 LGB / XGB / LR，结构与线上模型一致"""
+    import lightgbm as lgb
+    import xgboost as xgb
+
+    encoders = {}
+    for col in api.categorical_cols:
+        le = LabelEncoder()
+        le.fit(np.asarray(VOCAB, dtype=object))
+        encoders[col] = le
+
+    X = preprocess_with(encoders, make_raw_rows(2000, seed=1))
+    logit = X['cap-diameter'] / 5 - X['stem-width'] / 8 + (X['cap-shape'] % 3) - 1
+    y = (logit + np.random.default_rng(2).normal(0, 0.5, len(X)) > 0).astype(int)
+
+    lgb_model = lgb.LGBMClassifier(n_estimators=20, num_leaves=15, verbosity=-1).fit(X, y)
+    xgb_model = xgb.XGBClassifier(n_estimators=20, max_depth=4).fit(X, y)
+    meta = np.column_stack([lgb_model.predict_proba(X)[:, 1], xgb_model.predict_proba(X)[:, 1]])
+    meta_model = LogisticRegression().fit(meta, y)
+    return {
+        "lgb_model": lgb_model,
+        "xgb_model": xgb_model,
+        "meta_model": meta_model,
+        "label_encoders": encoders,
+    }
+
+
+@pytest.fixture
+def loaded_api(tiny_models, monkeypatch):
+    """把小型模型注入 classifier_api 的全局变量"""
+    for name, value in tiny_models.items():
+        monkeypatch.setattr(api, name, value)
+    return api
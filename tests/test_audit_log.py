@@ -0,0 +1,121 @@
+import gzip
+import io
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import src.audit_log as audit_log
+import src.classifier_api as api
+from src.audit_log import AuditLog
+from conftest import make_raw_rows
+
+
+def test_segments_rotate_and_read_back(tmp_path):
+    log = AuditLog(str(tmp_path), flush_rows=10, flush_interval=0.01, segment_max_bytes=1).start()
+    for i in range(5):
+        rows = [{"id": i * 10 + j, "cap-shape": "x", "cap-diameter": float("nan")} for j in range(10)]
+        assert log.record(rows, np.full(10, i / 10), np.ones(10, dtype=int), version=f"v{i % 2}", latency_ms=1.5)
+        time.sleep(0.03)
+    log.close()
+
+    segments = audit_log.segments(str(tmp_path))
+    assert len(segments) == log.segments_written >= 2
+    assert not list(tmp_path.glob("*.part"))
+    records = list(audit_log.iter_records(str(tmp_path)))
+    assert [r["features"]["id"] for r in records] == list(range(50))
+    assert records[0]["features"]["cap-diameter"] is None and records[0]["latency_ms"] == 1.5
+    assert {r["version"] for r in records} == {"v0", "v1"} and records[-1]["proba"] == 0.4
+    assert log.stats()["rows_written"] == 50 and log.stats()["rows_dropped"] == 0
+
+    summary = audit_log.summary(str(tmp_path))
+    assert summary["rows"] == 50 and summary["versions"] == {"v0": 30, "v1": 20}
+
+
+def test_partial_segment_is_readable_while_open(tmp_path):
+    log = AuditLog(str(tmp_path), flush_rows=1, flush_interval=0.01).start()
+    log.record([{"id": 1}], np.array([0.2]), np.array([0]))
+    deadline = time.monotonic() + 5
+    while log.rows_written < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert audit_log.segments(str(tmp_path)) == []
+    assert [r["features"]["id"] for r in audit_log.iter_records(str(tmp_path), include_partial=True)] == [1]
+    log.close()
+    assert len(audit_log.segments(str(tmp_path))) == 1
+
+
+def test_full_buffer_drops_or_blocks(tmp_path):
+    rows = [{"id": 0}] * 3
+    proba, pred = np.zeros(3), np.zeros(3, dtype=int)
+
+    # 后台线程未启动：缓冲区只进不出
+    log = AuditLog(str(tmp_path / "drop"), max_rows=5)
+    assert log.record(rows, proba, pred)
+    assert not log.record(rows, proba, pred)
+    assert log.rows_dropped == 3
+
+    log = AuditLog(str(tmp_path / "block"), max_rows=5, policy="block", block_timeout=0.05)
+    assert log.record(rows, proba, pred)
+    start = time.perf_counter()
+    assert not log.record(rows, proba, pred)
+    assert time.perf_counter() - start >= 0.05
+
+    # 写入线程腾出空间后，阻塞的生产者继续写入
+    log.block_timeout = 5
+    result = []
+    producer = threading.Thread(target=lambda: result.append(log.record(rows, proba, pred)))
+    producer.start()
+    log.start()
+    producer.join(5)
+    log.close()
+    assert result == [True]
+    assert len(list(audit_log.iter_records(str(tmp_path / "block")))) == 6
+
+    with pytest.raises(ValueError):
+        AuditLog(str(tmp_path), policy="wait")
+
+
+def test_api_logs_predictions_and_replays(loaded_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "MICRO_BATCH", False)
+    monkeypatch.setattr(api, "prediction_cache", None)
+    monkeypatch.setattr(api, "model_version", "v7")
+    log = AuditLog(str(tmp_path), flush_interval=0.01)
+    monkeypatch.setattr(api, "audit_log", log.start())
+    rows = make_raw_rows(30, seed=8)
+
+    client = TestClient(api.app)
+    served = client.post("/predict", json=rows).json()
+    X = api.preprocess_data(rows[:5]).to_numpy(dtype=np.float64)
+    client.post("/predict/binary", content=_npy(X), headers={"Content-Type": "application/x-npy"})
+    assert client.get("/stats/audit").json()["rows_queued"] == 35
+    log.close()
+
+    records = list(audit_log.iter_records(str(tmp_path)))
+    assert len(records) == 35
+    assert [r["features"]["id"] for r in records[:30]] == [row["id"] for row in rows]
+    np.testing.assert_allclose([r["proba"] for r in records[:30]], [s["probability_poisonous"] for s in served])
+    assert {r["version"] for r in records} == {"v7"} and records[-1]["encoded"] and records[-1]["source"] == "binary"
+
+    report = audit_log.replay(str(tmp_path), models=api.current_models(), chunk_rows=8)
+    assert report["rows"] == 35 and report["over_tolerance"] == 0 and report["flipped"] == 0
+    assert report["by_logged_version"]["v7"]["max_abs_diff"] < 1e-9
+
+    # 记录被篡改时重放能发现差异
+    path = audit_log.segments(str(tmp_path))[0]
+    lines = gzip.open(path, "rt").read().splitlines()
+    first = json.loads(lines[0])
+    first["proba"] = 1 - first["proba"]
+    with gzip.open(path, "wt") as f:
+        f.write("\n".join([json.dumps(first)] + lines[1:]) + "\n")
+    report = audit_log.replay(str(tmp_path), models=api.current_models())
+    assert report["over_tolerance"] == 1
+
+
+def _npy(X):
+    buf = io.BytesIO()
+    np.save(buf, X)
+    return buf.getvalue()
@@ -0,0 +1,132 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+
+import src.batch_analyze as batch_analyze
+import src.classifier_api as api
+import src.imgprocess_api as imgprocess_api
+from test_vlm_cache import encode, make_photo
+from test_vlm_client import make_client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+from stub_vlm_server import create_app  # noqa: E402
+
+
+def photo_dir(root, n=4):
+    os.makedirs(root, exist_ok=True)
+    for i in range(n):
+        make_photo(seed=i).save(os.path.join(root, f"mushroom_{i}.png"))
+    with open(os.path.join(root, "notes.txt"), "w") as f:
+        f.write("not an image")
+    return root
+
+
+def post_batch(monkeypatch, stub, url, **kwargs):
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(httpx.ASGITransport(app=stub), max_concurrency=8))
+        monkeypatch.setattr(imgprocess_api, "vlm_cache", None)
+        monkeypatch.setattr(imgprocess_api, "VLM_BATCH_BACKOFF", 0.01)
+        monkeypatch.setattr(imgprocess_api, "VLM_LOG", False)
+        asgi = httpx.ASGITransport(app=imgprocess_api.app)
+        async with httpx.AsyncClient(transport=asgi, base_url="http://test") as http:
+            response = await http.post(url, **kwargs)
+        await imgprocess_api.client.aclose()
+        return response
+
+    response = asyncio.run(run())
+    lines = [json.loads(line) for line in response.text.splitlines()] if response.status_code == 200 else []
+    return response, lines
+
+
+def test_batch_endpoint_bounds_fan_out_and_retries(monkeypatch):
+    stub = create_app(latency=0.02, fail_rate=0.3, seed=1)
+    images = [{"image_base64": base64.b64encode(encode(make_photo(seed=i), "PNG")).decode()}
+              for i in range(8)]
+    response, lines = post_batch(monkeypatch, stub, "/analyze-images?concurrency=2&retries=5", json={"images": images})
+
+    assert response.status_code == 200 and response.headers["content-type"].startswith("application/x-ndjson")
+    features = [line for line in lines if line["type"] == "features"]
+    summary = lines[-1]
+    assert summary["type"] == "summary" and summary["ok"] == 8 and summary["failed"] == 0
+    assert sorted(line["index"] for line in features) == list(range(8))
+    assert all(len(line["features"]) == 20 for line in features)
+    assert stub.state.stats["peak"] <= 2
+    assert summary["retries"] == stub.state.stats["failed"] > 0
+
+
+def test_batch_endpoint_reads_server_directory(monkeypatch, tmp_path):
+    photo_dir(str(tmp_path / "field"), n=3)
+    monkeypatch.setattr(imgprocess_api, "VLM_BATCH_ROOT", str(tmp_path))
+    stub = create_app(latency=0.0)
+
+    response, lines = post_batch(monkeypatch, stub, "/analyze-images", json={"directory": "field"})
+    assert all(line["status"] == "ok" for line in lines[:-1])
+    assert sorted(line["name"] for line in lines[:-1]) == [f"mushroom_{i}.png" for i in range(3)]
+
+    outside, _ = post_batch(monkeypatch, stub, "/analyze-images", json={"directory": "../"})
+    missing, _ = post_batch(monkeypatch, stub, "/analyze-images", json={"directory": "nope"})
+    assert outside.status_code == 403 and missing.status_code == 404
+
+
+def test_batch_endpoint_pipes_features_into_one_predict_call(monkeypatch, loaded_api):
+    stub = create_app(latency=0.0)
+    calls = []
+    classifier = httpx.ASGITransport(app=api.app)
+
+    async def predict_rows(results, url):
+        calls.append(len(results))
+        return await batch_analyze.predict_rows(results, "http://classifier/predict", transport=classifier)
+
+    monkeypatch.setattr(imgprocess_api, "predict_rows", predict_rows)
+    images = [{"image_base64": base64.b64encode(encode(make_photo(seed=i), "PNG")).decode()}
+              for i in range(5)]
+    _, lines = post_batch(monkeypatch, stub, "/analyze-images?predict=true", json={"images": images})
+
+    predictions = [line for line in lines if line["type"] == "prediction"]
+    assert calls == [5] and [p["index"] for p in predictions] == list(range(5))
+    assert all(p["prediction"]["predicted_class"] in ("e", "p") for p in predictions)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stub_server():
+    """在后台线程中运行真实监听端口的 stub (流式响应经过真实的 HTTP 连接)"""
+    port = free_port()
+    app = create_app(latency=0.01, token_delay=0.002)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.02)
+    yield app, f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(5)
+
+
+def test_cli_against_stub_server(monkeypatch, tmp_path, stub_server):
+    app, url = stub_server
+    directory = photo_dir(str(tmp_path / "img"), n=4)
+    monkeypatch.setattr(imgprocess_api, "lm_studio_url", url)
+    monkeypatch.setattr(imgprocess_api, "VLM_CACHE", False)
+    monkeypatch.setattr(imgprocess_api, "client", None)
+    out = tmp_path / "features.ndjson"
+
+    assert batch_analyze.main([directory, "--output", str(out), "--concurrency", "3"]) == 0
+    lines = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert len(lines) == 4 and all(line["status"] == "ok" for line in lines)
+    assert app.state.stats["calls"] == 4 and app.state.stats["peak"] <= 3
@@ -0,0 +1,73 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import batch_score
+from conftest import make_raw_rows
+
+
+@pytest.fixture(scope="module")
+def model_dir(tiny_models, tmp_path_factory):
+    path = tmp_path_factory.mktemp("models")
+    for name, model in tiny_models.items():
+        joblib.dump(model, path / f"{name}.pkl")
+    return path
+
+
+@pytest.fixture(scope="module")
+def test_csv(tmp_path_factory):
+    path = tmp_path_factory.mktemp("data") / "test.csv"
+    pd.DataFrame(make_raw_rows(250, seed=31)).assign(id=lambda df: df["id"] + 1000).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture(scope="module")
+def expected(tiny_models, test_csv):
+    """同一份数据整体读入后由原生模型链路打分的结果"""
+    df = pd.read_csv(test_csv)
+    from conftest import preprocess_with
+
+    X = preprocess_with(tiny_models["label_encoders"], df)
+    meta = np.column_stack([tiny_models["lgb_model"].predict_proba(X)[:, 1],
+                            tiny_models["xgb_model"].predict_proba(X)[:, 1]])
+    return pd.DataFrame({
+        "id": df["id"],
+        "class": pd.Series(tiny_models["meta_model"].predict(meta)).map({0: "e", 1: "p"}),
+        "probability_poisonous": tiny_models["meta_model"].predict_proba(meta)[:, 1],
+    })
+
+
+@pytest.fixture(autouse=True)
+def restore_api_state(monkeypatch):
+    # init_worker 在单进程模式下会改写 classifier_api 的全局模型
+    for name in ("lgb_model", "xgb_model", "meta_model", "label_encoders", "feature_encoder",
+                 "compiled_ensemble", "INFERENCE_ENGINE"):
+        monkeypatch.setattr(batch_score.api, name, getattr(batch_score.api, name))
+    for var in ("MODEL_DIR", "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        monkeypatch.setenv(var, "1")
+
+
+def test_inline_chunks_match_full_file_scoring(model_dir, test_csv, expected, tmp_path):
+    output = tmp_path / "submission.csv"
+    code = batch_score.main(["--input", str(test_csv), "--output", str(output), "--model-dir", str(model_dir),
+                             "--chunk-rows", "40", "--workers", "1"])
+    assert code == 0
+    result = pd.read_csv(output)
+    assert list(result.columns) == ["id", "class"]
+    pd.testing.assert_frame_equal(result, expected[["id", "class"]])
+
+
+def test_process_pool_parquet_output_in_order(model_dir, test_csv, expected, tmp_path, capsys):
+    output = tmp_path / "submission.parquet"
+    reference = tmp_path / "reference.csv"
+    expected[["id", "class"]].to_csv(reference, index=False)
+
+    code = batch_score.main(["--input", str(test_csv), "--output", str(output), "--model-dir", str(model_dir),
+                             "--chunk-rows", "30", "--workers", "2", "--proba", "--compare", str(reference)])
+
+    assert code == 0
+    result = pd.read_parquet(output)
+    pd.testing.assert_frame_equal(result[["id", "class"]], expected[["id", "class"]])
+    np.testing.assert_allclose(result["probability_poisonous"], expected["probability_poisonous"], atol=1e-12)
+    assert "0 class mismatches" in capsys.readouterr().out
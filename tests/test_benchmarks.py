@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+import src.imgprocess_api as imgprocess_api
+from test_vlm_cache import encode, make_photo
+from test_vlm_client import make_client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+import bench_common  # noqa: E402
+import bench_stages  # noqa: E402
+import load_test  # noqa: E402
+from stub_vlm_server import create_app  # noqa: E402
+
+
+def test_load_generator_drives_predict_shapes(loaded_api, monkeypatch):
+    monkeypatch.setattr(loaded_api, "batcher", None)
+    records = load_test.sample_records(40)
+    transport = httpx.ASGITransport(app=loaded_api.app)
+
+    async def run():
+        results = {}
+        for shape in load_test.PREDICT_PATHS:
+            build = load_test.predict_requests(records, rows=10, shape=shape)
+            results[shape] = await load_test.run_load("http://test", build, concurrency=4, requests=20,
+                                                      rows_per_request=10, transport=transport)
+        return results
+
+    for shape, result in asyncio.run(run()).items():
+        assert result["requests"] == 20 and result["ok"] == 20 and result["errors"] == {}, shape
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"] <= result["max_ms"]
+        assert result["rows_per_s"] > result["throughput_rps"]
+
+
+def test_analyze_image_load_against_stub_vlm(monkeypatch):
+    stub = create_app(latency=0.02, max_concurrency=2)
+    build = load_test.image_requests(encode(make_photo(seed=3), "JPEG"), unique=True, variants=8)
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(httpx.ASGITransport(app=stub), max_concurrency=2,
+                                                                  max_queue=0))
+        monkeypatch.setattr(imgprocess_api, "vlm_cache", None)
+        monkeypatch.setattr(imgprocess_api, "VLM_LOG", False)
+        result = await load_test.run_load("http://test", build, concurrency=4, requests=12,
+                                          transport=httpx.ASGITransport(app=imgprocess_api.app))
+        await imgprocess_api.client.aclose()
+        return result
+
+    result = asyncio.run(run())
+    # 并发 4 超过 VLM 并发上限 2 且不排队：多出的请求被 503 拒绝并计入错误
+    assert result["requests"] == 12 and result["ok"] + result["errors"].get("503", 0) == 12
+    assert result["ok"] >= 2 and stub.state.stats["peak"] <= 2
+
+
+def test_stage_benchmark_and_regression_compare(loaded_api, tmp_path):
+    runs = bench_stages.run_stages([1, 50], repeat=3, min_time=0.0)
+    stages = {run["key"]["stage"] for run in runs}
+    assert stages == {"preprocess", "lgb", "xgb", "meta", "compiled", "end_to_end", "explain"} and len(runs) == 14
+    assert loaded_api.prediction_cache is not None  # 测量结束后恢复预测缓存
+
+    baseline = bench_common.write_results("stages", runs, {"sizes": [1, 50]}, str(tmp_path / "old.json"))
+    slower = [{**run, "p95_ms": run["p95_ms"] * 2} if run["key"]["stage"] == "lgb" else run for run in runs]
+    current = bench_common.write_results("stages", slower, {}, str(tmp_path / "new.json"))
+    with open(baseline) as f:
+        saved = json.load(f)
+    assert saved["environment"]["cpus"] and saved["runs"] == json.loads(json.dumps(runs))
+
+    assert bench_common.main([baseline, baseline]) == 0
+    assert bench_common.main([baseline, current, "--threshold", "0.5"]) == 1
+    with open(current) as f:
+        rows = bench_common.compare(saved, json.load(f), 0.5)
+    assert {row["key"]["stage"] for row in rows if row["regression"]} == {"lgb"}
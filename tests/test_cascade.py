@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import src.classifier_api as api
+from src.cascade import CascadeBand, calibrate, cascade_predict, meta_coefficients
+from src.compiled_ensemble import CompiledEnsemble
+from conftest import make_raw_rows
+
+COEF, INTERCEPT = np.array([3.0, 2.0]), -2.5
+
+
+def synthetic_oof(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lgb = rng.beta(0.3, 0.3, n)
+    xgb = np.clip(lgb + rng.normal(0, 0.15, n), 0, 1)
+    return lgb, xgb
+
+
+def brute_force_min_escalated(lgb, xgb, target):
+    """枚举空区间与所有由样本值构成的区间"""
+    full = COEF @ np.vstack([lgb, xgb]) + INTERCEPT > 0
+    values = np.unique(lgb)
+    best = 0 if np.mean((COEF.sum() * lgb + INTERCEPT > 0) == full) >= target else len(lgb)
+    for low in values:
+        for high in values[values >= low]:
+            band = CascadeBand(low, high)
+            _, pred, escalated = cascade_predict(lgb, lambda rows: xgb[rows], COEF, INTERCEPT, band)
+            if np.mean(pred == full) >= target:
+                best = min(best, int(escalated.sum()))
+    return best
+
+
+@pytest.mark.parametrize("target", [0.9, 0.97, 1.0])
+def test_calibrate_finds_smallest_band(target):
+    lgb, xgb = synthetic_oof(120)
+    band, report = calibrate(lgb, xgb, COEF, INTERCEPT, target)
+    assert report["agreement"] >= target
+    assert round(report["escalated_fraction"] * len(lgb)) == brute_force_min_escalated(lgb, xgb, target)
+
+
+def test_calibrated_band_generalizes():
+    lgb, xgb = synthetic_oof(20000)
+    band, report = calibrate(lgb, xgb, COEF, INTERCEPT, 0.999, y=(lgb + xgb > 1).astype(int))
+    assert report["escalated_fraction"] < 0.5 and {"mcc_full", "mcc_cascade"} <= set(report)
+
+    lgb, xgb = synthetic_oof(20000, seed=1)
+    full = COEF @ np.vstack([lgb, xgb]) + INTERCEPT > 0
+    _, pred, _ = cascade_predict(lgb, lambda rows: xgb[rows], COEF, INTERCEPT, band)
+    assert np.mean(pred == full) > 0.995
+
+
+def test_band_roundtrip(tmp_path):
+    CascadeBand(0.1, 0.9).save(str(tmp_path), {"target": 0.999})
+    assert CascadeBand.load(str(tmp_path)) == CascadeBand(0.1, 0.9)
+    assert CascadeBand.load(str(tmp_path / "missing")) is None
+    assert CascadeBand.parse("0.05,0.95") == CascadeBand(0.05, 0.95)
+
+
+@pytest.mark.parametrize("engine", ["native", "compiled"])
+def test_api_cascade_escalates_only_uncertain_rows(loaded_api, monkeypatch, engine):
+    ensemble = CompiledEnsemble.from_models(api.lgb_model, api.xgb_model, api.meta_model)
+    monkeypatch.setattr(api, "compiled_ensemble", ensemble)
+    monkeypatch.setattr(api, "INFERENCE_ENGINE", engine)
+    X = api.preprocess_data(make_raw_rows(300, seed=3))
+    full_proba, full_pred = api.run_ensemble(X)
+
+    # 区间覆盖全部概率：与完整 Stacking 完全一致
+    monkeypatch.setattr(api, "cascade_band", CascadeBand(0.0, 1.0))
+    proba, pred = api.run_ensemble(X)
+    np.testing.assert_allclose(proba, full_proba, atol=1e-6)
+    np.testing.assert_array_equal(pred, full_pred)
+
+    # 窄区间：XGBoost 只对区间内的行执行
+    lgb_proba = api.lgb_model.predict_proba(X)[:, 1]
+    low, high = np.quantile(lgb_proba, [0.4, 0.6])
+    monkeypatch.setattr(api, "cascade_band", CascadeBand(low, high))
+    seen = []
+    if engine == "native":
+        original = api.xgb_model.predict_proba
+        monkeypatch.setattr(api.xgb_model, "predict_proba", lambda X_: seen.append(len(X_)) or original(X_))
+    else:
+        original = ensemble.xgb.margin
+        monkeypatch.setattr(ensemble.xgb, "margin", lambda X_: seen.append(len(X_)) or original(X_))
+    before = api.cascade_rows.value("escalated")
+    proba, pred = api.run_ensemble(X)
+
+    inside = (lgb_proba >= low) & (lgb_proba <= high)
+    assert seen == [inside.sum()] and api.cascade_rows.value("escalated") == before + inside.sum()
+    np.testing.assert_allclose(proba[inside], full_proba[inside], atol=1e-6)
+    coef, intercept = meta_coefficients(api.meta_model)
+    expected = 1 / (1 + np.exp(-(coef.sum() * lgb_proba[~inside] + intercept)))
+    np.testing.assert_allclose(proba[~inside], expected, atol=1e-6)
+
+
+def test_cascade_band_loading(monkeypatch, tmp_path):
+    CascadeBand(0.2, 0.8).save(str(tmp_path))
+    monkeypatch.setattr(api, "CASCADE", False)
+    assert api.load_cascade_band(str(tmp_path)) is None
+
+    monkeypatch.setattr(api, "CASCADE", True)
+    assert api.load_cascade_band(str(tmp_path)) == CascadeBand(0.2, 0.8)
+    monkeypatch.setattr(api, "CASCADE_BAND", "0.3,0.7")
+    assert api.load_cascade_band(str(tmp_path)) == CascadeBand(0.3, 0.7)
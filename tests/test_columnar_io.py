@@ -0,0 +1,93 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from fastapi.testclient import TestClient
+
+from conftest import make_raw_rows
+
+
+def expected_results(api, rows):
+    return {r["id"]: r for r in TestClient(api.app).post("/predict", json=rows).json()}
+
+
+def test_columnar_json_matches_row_format(loaded_api):
+    rows = make_raw_rows(50)
+    columns = {key: [row[key] for row in rows] for key in rows[0]}
+
+    resp = TestClient(loaded_api.app).post("/predict/columnar", json=columns)
+
+    assert resp.status_code == 200
+    body = resp.json()
+    expected = expected_results(loaded_api, rows)
+    assert body["id"] == list(range(50))
+    assert body["predicted_class"] == [expected[i]["predicted_class"] for i in body["id"]]
+    np.testing.assert_allclose(
+        body["probability_poisonous"], [expected[i]["probability_poisonous"] for i in body["id"]]
+    )
+
+
+def test_columnar_json_rejects_ragged_columns(loaded_api):
+    resp = TestClient(loaded_api.app).post("/predict/columnar", json={"cap-shape": ["x"], "season": []})
+    assert resp.status_code == 400
+
+
+def test_arrow_roundtrip(loaded_api):
+    rows = make_raw_rows(20)
+    table = pa.Table.from_pandas(pd.DataFrame(rows))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    resp = TestClient(loaded_api.app).post(
+        "/predict/binary",
+        content=sink.getvalue().to_pybytes(),
+        headers={"content-type": "application/vnd.apache.arrow.stream",
+                 "accept": "application/vnd.apache.arrow.stream"},
+    )
+
+    assert resp.status_code == 200
+    result = pa.ipc.open_stream(resp.content).read_all().to_pydict()
+    expected = expected_results(loaded_api, rows)
+    assert result["predicted_class"] == [expected[i]["predicted_class"] for i in result["id"]]
+
+
+def test_npy_encoded_matrix(loaded_api):
+    rows = make_raw_rows(10)
+    X = loaded_api.preprocess_data(rows).to_numpy(dtype=np.float64)
+    buf = io.BytesIO()
+    np.save(buf, X)
+
+    resp = TestClient(loaded_api.app).post(
+        "/predict/binary", content=buf.getvalue(), headers={"content-type": "application/x-npy"}
+    )
+
+    assert resp.status_code == 200
+    expected = expected_results(loaded_api, rows)
+    np.testing.assert_allclose(
+        resp.json()["probability_poisonous"], [expected[i]["probability_poisonous"] for i in range(10)]
+    )
+
+
+def test_npy_structured_array(loaded_api):
+    rows = make_raw_rows(10)
+    df = pd.DataFrame(rows).fillna("nan")
+    arr = df.to_records(index=False).astype(
+        [(c, "<i8" if c == "id" else "<f8" if c in loaded_api.numeric_cols else "<U8") for c in df.columns]
+    )
+    buf = io.BytesIO()
+    np.save(buf, arr)
+
+    resp = TestClient(loaded_api.app).post(
+        "/predict/binary", content=buf.getvalue(), headers={"content-type": "application/x-npy"}
+    )
+
+    assert resp.status_code == 200
+    expected = expected_results(loaded_api, rows)
+    assert resp.json()["predicted_class"] == [expected[i]["predicted_class"] for i in range(10)]
+
+
+def test_binary_rejects_unknown_content_type(loaded_api):
+    resp = TestClient(loaded_api.app).post("/predict/binary", content=b"x", headers={"content-type": "text/plain"})
+    assert resp.status_code == 415
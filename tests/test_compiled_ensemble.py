@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from src.compiled_ensemble import CompiledEnsemble
+from conftest import make_raw_rows, preprocess_with
+
+
+def native_proba(models, X):
+    meta = np.column_stack([
+        models["lgb_model"].predict_proba(X)[:, 1],
+        models["xgb_model"].predict_proba(X)[:, 1],
+    ])
+    return models["meta_model"].predict_proba(meta)[:, 1], models["meta_model"].predict(meta)
+
+
+@pytest.fixture(scope="module")
+def features(tiny_models):
+    X = preprocess_with(tiny_models["label_encoders"], make_raw_rows(500, seed=7))
+    # 数值列中混入缺失值，覆盖 NaN 的默认方向
+    X.loc[X.index[::5], 'cap-diameter'] = np.nan
+    return X
+
+
+def test_matches_native_probabilities(tiny_models, features):
+    ensemble = CompiledEnsemble.from_models(**{k: tiny_models[k] for k in ("lgb_model", "xgb_model", "meta_model")})
+
+    proba, pred = ensemble.predict(features.to_numpy(dtype=np.float64))
+    expected_proba, expected_pred = native_proba(tiny_models, features)
+
+    np.testing.assert_allclose(proba, expected_proba, atol=1e-6, rtol=0)
+    np.testing.assert_array_equal(pred, expected_pred)
+
+
+def test_single_row_fast_path(tiny_models, features):
+    ensemble = CompiledEnsemble.from_models(**{k: tiny_models[k] for k in ("lgb_model", "xgb_model", "meta_model")})
+    X = features.to_numpy(dtype=np.float64)
+    batch_proba, _ = ensemble.predict(X[:20])
+
+    for i in range(20):
+        proba, _ = ensemble.predict(X[i:i + 1])
+        assert proba[0] == pytest.approx(batch_proba[i], abs=1e-12)
+
+
+def test_save_and_load_memory_mapped(tiny_models, features, tmp_path):
+    ensemble = CompiledEnsemble.from_models(**{k: tiny_models[k] for k in ("lgb_model", "xgb_model", "meta_model")})
+    ensemble.save(str(tmp_path))
+
+    loaded = CompiledEnsemble.load(str(tmp_path))
+
+    assert isinstance(loaded.lgb.feature, np.memmap)
+    X = features.to_numpy(dtype=np.float64)
+    np.testing.assert_array_equal(loaded.predict(X)[0], ensemble.predict(X)[0])
+
+
+def test_run_ensemble_engines_agree(loaded_api, features, monkeypatch):
+    native = loaded_api.run_ensemble(features)
+    monkeypatch.setattr(loaded_api, "compiled_ensemble", CompiledEnsemble.from_models(
+        loaded_api.lgb_model, loaded_api.xgb_model, loaded_api.meta_model))
+    monkeypatch.setattr(loaded_api, "INFERENCE_ENGINE", "compiled")
+
+    compiled = loaded_api.run_ensemble(features)
+
+    np.testing.assert_allclose(compiled[0], native[0], atol=1e-6, rtol=0)
+    np.testing.assert_array_equal(compiled[1], native[1])
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+import src.classifier_api as api
+from conftest import make_raw_rows, preprocess_with
+from src.data_prep import load_training_data, main
+
+
+def write_csvs(tmp_path, n_train=300, n_test=120):
+    train = pd.DataFrame(make_raw_rows(n_train, seed=3))
+    train["class"] = np.where(np.arange(n_train) % 3 == 0, "p", "e")
+    # 'None' 字面量与未在训练集出现的值 (notebook 的词表也包含 test 中的值)
+    train.loc[0, "cap-shape"] = "None"
+    test = pd.DataFrame(make_raw_rows(n_test, seed=4))
+    test["id"] += n_train
+    test.loc[1, "cap-shape"] = "zz"
+    test.loc[2, "cap-diameter"] = None
+    train_path, test_path = tmp_path / "train.csv", tmp_path / "test.csv"
+    train.to_csv(train_path, index=False)
+    test.to_csv(test_path, index=False)
+    return str(train_path), str(test_path)
+
+
+def notebook_encoding(train_path, test_path):
+    """
+    train_model.ipynb 中的做法：pandas 读取 + astype(str) + 在 train+test 上拟合 LabelEncoder。
+    pandas 2 的 astype(str) 把缺失值变成 'nan'，pandas 3 保留为缺失值，这里先 fillna 与 pandas 2 保持一致
+    """
+    train = pd.read_csv(train_path).drop(columns=["id"])
+    test = pd.read_csv(test_path)
+    y = train.pop("class").map({"e": 0, "p": 1})
+    test_ids = test.pop("id")
+    encoders = {}
+    for col in api.categorical_cols:
+        le = LabelEncoder()
+        train[col], test[col] = train[col].fillna("nan").astype(str), test[col].fillna("nan").astype(str)
+        le.fit(pd.concat([train[col], test[col]]))
+        train[col] = le.transform(train[col])
+        test[col] = le.transform(test[col])
+        encoders[col] = le
+    return train[api.feature_order], y, test[api.feature_order], test_ids, encoders
+
+
+def test_encoding_matches_notebook(tmp_path):
+    train_path, test_path = write_csvs(tmp_path)
+    data = load_training_data(train_path, test_path, cache_dir=str(tmp_path / "cache"))
+    X_train, y, X_test, test_ids, encoders = notebook_encoding(train_path, test_path)
+
+    for col in api.categorical_cols:
+        assert data.vocabularies[col] == list(encoders[col].classes_)
+        assert data.X_train[col].dtype == np.int8
+    assert data.X_train["cap-diameter"].dtype == np.float32
+    np.testing.assert_allclose(data.X_train.to_numpy(np.float64), X_train.to_numpy(np.float64), rtol=1e-6)
+    np.testing.assert_allclose(data.X_test.to_numpy(np.float64), X_test.to_numpy(np.float64), rtol=1e-6)
+    assert data.y.dtype == np.int8 and (data.y.to_numpy() == y.to_numpy()).all()
+    assert (data.test_ids.to_numpy() == test_ids.to_numpy()).all()
+    assert "zz" in data.vocabularies["cap-shape"] and "None" not in data.vocabularies["cap-shape"]
+
+
+def test_blank_string_is_its_own_category(tmp_path):
+    train_path, test_path = write_csvs(tmp_path)
+    train = pd.read_csv(train_path)
+    train.loc[[3, 7], "cap-shape"] = " "
+    train.loc[5, "gill-color"] = " "
+    train.to_csv(train_path, index=False)
+
+    data = load_training_data(train_path, test_path, cache_dir=None)
+    X_train, _, X_test, _, encoders = notebook_encoding(train_path, test_path)
+    assert " " in encoders["cap-shape"].classes_ and " " in encoders["gill-color"].classes_
+    for col in api.categorical_cols:
+        assert data.vocabularies[col] == list(encoders[col].classes_)
+    np.testing.assert_allclose(data.X_train.to_numpy(np.float64), X_train.to_numpy(np.float64), rtol=1e-6)
+    np.testing.assert_allclose(data.X_test.to_numpy(np.float64), X_test.to_numpy(np.float64), rtol=1e-6)
+
+
+def test_exported_encoders_match_serving_preprocessing(tmp_path):
+    train_path, test_path = write_csvs(tmp_path)
+    data = load_training_data(train_path, test_path, cache_dir=None)
+    rows = pd.read_csv(test_path).to_dict(orient="records")
+    served = preprocess_with(data.label_encoders(), rows)
+    np.testing.assert_allclose(served.to_numpy(np.float64), data.X_test.to_numpy(np.float64), rtol=1e-6)
+
+
+def test_cache_hit_and_invalidation(tmp_path, capsys):
+    train_path, test_path = write_csvs(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    first = load_training_data(train_path, test_path, cache_dir=cache_dir)
+    second = load_training_data(train_path, test_path, cache_dir=cache_dir)
+    assert first.report["cache"] == "miss" and second.report["cache"] == "hit"
+    assert first.report["key"] == second.report["key"]
+    pd.testing.assert_frame_equal(first.X_train, second.X_train)
+    pd.testing.assert_frame_equal(first.X_test, second.X_test)
+    assert second.vocabularies == first.vocabularies and second.y.dtype == np.int8
+
+    with open(train_path, "a") as f:
+        f.write(",".join(["9999"] + [""] * len(api.feature_order) + ["e"]) + "\n")
+    third = load_training_data(train_path, test_path, cache_dir=cache_dir)
+    assert third.report["cache"] == "miss" and third.report["key"] != first.report["key"]
+    assert len(third.X_train) == len(first.X_train) + 1
+
+    encoders_path = tmp_path / "label_encoders.pkl"
+    main(["--train", train_path, "--test", test_path, "--cache-dir", cache_dir,
+          "--export-encoders", str(encoders_path)])
+    assert encoders_path.exists() and '"cache": "hit"' in capsys.readouterr().out
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import src.classifier_api as api
+from src import explain
+from src.cascade import CascadeBand
+from src.prediction_cache import PredictionCache
+from conftest import make_raw_rows
+
+
+@pytest.fixture
+def native_api(loaded_api, monkeypatch):
+    monkeypatch.setattr(api, "INFERENCE_ENGINE", "native")
+    monkeypatch.setattr(api, "cascade_band", None)
+    monkeypatch.setattr(api, "MICRO_BATCH", False)
+    monkeypatch.setattr(api, "prediction_cache", None)
+    return api
+
+
+def test_contributions_sum_to_meta_logit(native_api, monkeypatch):
+    X = api.preprocess_data(make_raw_rows(200, seed=4))
+    proba, _ = api.run_ensemble(X)
+
+    base, contributions, logit = explain.explain(api.lgb_model, api.xgb_model, api.meta_model, X)
+    assert contributions.shape == (200, len(api.feature_order))
+    np.testing.assert_allclose(base + contributions.sum(axis=1), logit)
+    np.testing.assert_allclose(1 / (1 + np.exp(-logit)), proba, atol=1e-6)
+
+    # 基模型的 margin 贡献与 LightGBM 原生 pred_contrib 一致
+    native = api.lgb_model.booster_.predict(X, pred_contrib=True)
+    np.testing.assert_allclose(explain.margin_contributions(api.lgb_model, "lgb", X), native)
+    # 没有信号的特征贡献为 0
+    unused = api.lgb_model.booster_.feature_importance() == 0
+    assert np.all(explain.margin_contributions(api.lgb_model, "lgb", X)[:, :-1][:, unused] == 0)
+
+    # 级联：与 run_ensemble 的概率一致，XGBoost 只对升级的行计算
+    lgb_proba = api.lgb_model.predict_proba(X)[:, 1]
+    band = CascadeBand(*np.quantile(lgb_proba, [0.3, 0.7]))
+    monkeypatch.setattr(api, "cascade_band", band)
+    proba, _ = api.run_ensemble(X)
+    seen = []
+    original = explain.margin_contributions
+    monkeypatch.setattr(explain, "margin_contributions",
+                        lambda model, kind, X_: seen.append((kind, len(X_))) or original(model, kind, X_))
+    base, contributions, logit = explain.explain(api.lgb_model, api.xgb_model, api.meta_model, X, band)
+    assert seen == [("lgb", 200), ("xgb", band.escalate(lgb_proba).sum())]
+    np.testing.assert_allclose(1 / (1 + np.exp(-logit)), proba, atol=1e-6)
+
+
+def test_top_features():
+    contributions = np.array([[0.1, -0.5, 0.2], [0.0, 0.0, -1.0]])
+    assert explain.top_features(contributions, ["a", "b", "c"], 2) == [["b", "c"], ["c", "a"]]
+    assert explain.top_features(contributions, ["a", "b", "c"], 5)[0] == ["b", "c", "a"]
+
+
+def test_explain_endpoint_and_cache(native_api, monkeypatch):
+    cache = PredictionCache(max_entries=1000, numeric_positions=[0, 8, 9], max_explanations=1000)
+    monkeypatch.setattr(api, "prediction_cache", cache)
+    rows = make_raw_rows(30, seed=5)
+    served = api.score_payloads([rows])[0]
+    client = TestClient(api.app)
+
+    response = client.post("/explain", json=rows, params={"top": 3})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["id"] == [row["id"] for row in rows] and body["feature_order"] == api.feature_order
+    np.testing.assert_allclose(body["probability_poisonous"], served[0], atol=1e-6)
+    contributions = np.asarray(body["contributions"])
+    assert contributions.shape == (30, len(api.feature_order)) and len(body["top_features"][0]) == 3
+    logit = np.asarray(body["base_value"]) + contributions.sum(axis=1)
+    np.testing.assert_array_equal(body["predicted_class"], np.where(logit > 0, "p", "e"))
+
+    # 重复请求 (含批内重复行) 全部命中缓存，不再计算
+    computed = []
+    original = explain.explain
+    monkeypatch.setattr(explain, "explain", lambda *a: computed.append(len(a[3])) or original(*a))
+    again = client.post("/explain", json=rows + rows[:5]).json()
+    assert computed == [] and "top_features" not in again
+    np.testing.assert_allclose(np.asarray(again["contributions"])[:30], contributions)
+    assert cache.stats()["explanation_hits"] == 35 and cache.stats()["explanation_misses"] == 30
+
+    assert client.post("/explain", json=[]).status_code == 400
+    assert client.post("/explain", json=rows, params={"top": -1}).status_code == 422
+    assert client.post("/explain", json=rows, params={"top": 0}).status_code == 422
+    monkeypatch.setattr(api, "EXPLAIN_MAX_ROWS", 29)
+    assert client.post("/explain", json=rows).status_code == 413
+    monkeypatch.setattr(api, "EXPLAIN_MAX_ROWS", 1000)
+    monkeypatch.setattr(api, "xgb_model", None)
+    assert client.post("/explain", json=rows).status_code == 503
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+
+import src.classifier_api
+from src.classifier_api import preprocess_data, categorical_cols
+from src.feature_encoder import FeatureEncoder
+
+
+def legacy_encode(values: pd.Series, le) -> np.ndarray:
+    """原 preprocess_data 中逐行 apply 的编码逻辑，作为对照"""
+    values = values.astype(str).replace({'None': 'nan', 'nan': 'nan', '<NA>': 'nan'})
+    fallback_value = 'nan' if 'nan' in le.classes_ else le.classes_[0]
+    values = values.apply(lambda x: x if x in le.classes_ else fallback_value)
+    return le.transform(values)
+
+
+def make_encoder(classes):
+    le = LabelEncoder()
+    le.fit(np.asarray(classes, dtype=object))
+    return le
+
+
+@pytest.mark.parametrize("classes", [
+    ['nan', 'x', 'y', 'f'],            # 含 'nan'：未知值归为 'nan'
+    ['a', 's', 'u', 'w'],              # 不含 'nan'：未知值归为第一个类别
+    ['None', 'b', 'nan', '3.5', '<NA>'],  # 'None' / '<NA>' 必须先替换为 'nan'
+])
+@pytest.mark.parametrize("repeat", [1, 20])  # 小批量 dict 查表 / 大批量 factorize 查表
+def test_column_codes_match_legacy(classes, repeat):
+    le = make_encoder(classes)
+    values = pd.Series(
+        ['x', None, np.nan, 'None', '<NA>', 'nan', 'zz', 3.5, 'b', 'a', 'w', ''] * repeat,
+        dtype=object,
+    )
+    encoder = FeatureEncoder.from_label_encoders({'col': le})
+
+    codes = encoder.encode_column('col', values)
+
+    np.testing.assert_array_equal(codes, legacy_encode(values, le))
+    assert codes.dtype == np.int8
+
+
+def test_wide_vocabulary_uses_int16():
+    le = make_encoder([f"v{i}" for i in range(300)] + ['nan'])
+    encoder = FeatureEncoder.from_label_encoders({'col': le})
+    values = pd.Series(['v0', 'v299', 'missing', None] * 20, dtype=object)
+
+    codes = encoder.encode_column('col', values)
+
+    assert codes.dtype == np.int16
+    np.testing.assert_array_equal(codes, legacy_encode(values, le))
+
+
+def test_preprocess_data_matches_legacy(monkeypatch):
+    rng = np.random.default_rng(0)
+    vocab = ['nan', 'a', 'b', 'c', 'x']
+    encoders = {col: make_encoder(vocab if col != 'season' else ['a', 's', 'u', 'w'])
+                for col in categorical_cols}
+    monkeypatch.setattr(src.classifier_api, "label_encoders", encoders)
+
+    pool = np.array(['a', 'b', 'x', 's', 'w', 'unknown', None], dtype=object)
+    records = [
+        {col: pool[rng.integers(len(pool))] for col in categorical_cols}
+        | {'cap-diameter': float(i), 'stem-height': str(i), 'stem-width': None}
+        for i in range(200)
+    ]
+
+    df = preprocess_data(records)
+    raw = pd.DataFrame(records)
+
+    for col in categorical_cols:
+        np.testing.assert_array_equal(df[col].to_numpy(), legacy_encode(raw[col], encoders[col]))
+    assert df['stem-height'].iloc[5] == 5.0
+    assert df['stem-width'].isna().all()
+
+
+def test_encoder_rebuilt_when_label_encoders_replaced(monkeypatch):
+    first = {col: make_encoder(['nan', 'x']) for col in categorical_cols}
+    second = {col: make_encoder(['x', 'y']) for col in categorical_cols}
+
+    monkeypatch.setattr(src.classifier_api, "label_encoders", first)
+    assert preprocess_data([{'cap-shape': 'y'}])['cap-shape'].iloc[0] == 0
+
+    monkeypatch.setattr(src.classifier_api, "label_encoders", second)
+    assert preprocess_data([{'cap-shape': 'y'}])['cap-shape'].iloc[0] == 1
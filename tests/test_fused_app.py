@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+import numpy as np
+from fastapi.testclient import TestClient
+
+import src.fused_app as fused_app
+import src.imgprocess_api as imgprocess_api
+from test_vlm_cache import encode, make_photo
+from test_vlm_client import FEATURES, fake_lm_studio, make_client
+
+
+def test_lifespan_runs_both_apps_startup_hooks(monkeypatch):
+    calls = []
+    monkeypatch.setattr(fused_app.classifier_api, "load_models", lambda: calls.append("load_models"))
+    monkeypatch.setattr(fused_app.classifier_api, "MICRO_BATCH", False)
+    monkeypatch.setattr(imgprocess_api, "VLM_CACHE", False)
+    monkeypatch.setattr(imgprocess_api, "client", None)
+
+    with TestClient(fused_app.app) as client:
+        assert calls == ["load_models"] and imgprocess_api.client is not None
+        assert client.get("/").status_code == 200
+    assert imgprocess_api.client is None
+
+
+def test_analyze_and_predict_matches_separate_calls(loaded_api, monkeypatch):
+    transport, state = fake_lm_studio(delay=0.01)
+    image = encode(make_photo(), "JPEG")
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(transport))
+        monkeypatch.setattr(imgprocess_api, "vlm_cache", None)
+        asgi = httpx.ASGITransport(app=fused_app.app)
+        async with httpx.AsyncClient(transport=asgi, base_url="http://test") as http:
+            fused = await http.post("/analyze-and-predict", content=image, headers={"Content-Type": "image/jpeg"})
+            features = await http.post("/vlm/analyze-image", content=image, headers={"Content-Type": "image/jpeg"})
+            separate = await http.post("/classifier/predict", json=[{**features.json(), "id": 1}])
+        await imgprocess_api.client.aclose()
+        return fused, features, separate
+
+    fused, features, separate = asyncio.run(run())
+    assert fused.status_code == 200 and features.status_code == 200 and separate.status_code == 200
+    body = fused.json()
+    assert body["features"] == features.json() == FEATURES
+    assert body["prediction"]["predicted_class"] == separate.json()[0]["predicted_class"]
+    assert np.isclose(body["prediction"]["probability_poisonous"], separate.json()[0]["probability_poisonous"])
+    assert set(body["timings_ms"]) == {"read", "image_prep", "vlm", "predict", "total"}
+    assert body["timings_ms"]["vlm"] > 0 and "vlm;dur=" in fused.headers["Server-Timing"]
+    assert state["calls"] == 2
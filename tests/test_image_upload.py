@@ -0,0 +1,102 @@
+import asyncio
+import base64
+import io
+import json
+
+import httpx
+import pytest
+from PIL import Image
+
+import src.imgprocess_api as imgprocess_api
+from src.image_prep import prepare_image
+from test_vlm_cache import encode, make_photo
+from test_vlm_client import FEATURES, fake_lm_studio, make_client
+
+
+def phone_photo(size=(2400, 1600), orientation=6) -> bytes:
+    """横向存储、EXIF 标记需顺时针旋转 90° 的 "手机照片" """
+    img = make_photo(size)
+    exif = img.getexif()
+    exif[0x0112] = orientation
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=95, exif=exif)
+    return buf.getvalue()
+
+
+def recording_lm_studio():
+    """记录 VLM 收到的图片 (从 data URL 中解出) 的 fake LM Studio"""
+    transport, _ = fake_lm_studio(delay=0)
+    seen = []
+
+    async def handler(request):
+        body = json.loads(request.content)
+        url = body["messages"][0]["content"][1]["image_url"]["url"]
+        seen.append(url.split(",", 1)[1])
+        return await transport.handle_async_request(request)
+
+    return httpx.MockTransport(handler), seen
+
+
+def test_prepare_image_orients_and_downscales():
+    data = phone_photo()
+    prepared = prepare_image(data, max_side=512)
+    assert prepared.size_in == (2400, 1600)
+    assert max(prepared.size_out) <= 512 and prepared.size_out[1] > prepared.size_out[0]  # 已旋转为竖图
+    assert prepared.bytes_out < prepared.bytes_in / 5
+    with Image.open(io.BytesIO(prepared.data)) as img:
+        assert img.format == "JPEG" and img.size == prepared.size_out
+
+
+def test_small_upright_jpeg_is_forwarded_unchanged():
+    data = encode(make_photo((320, 240)), "JPEG")
+    assert prepare_image(data, max_side=512).data == data
+    # PNG 等其他格式统一转为 JPEG
+    png = prepare_image(encode(make_photo((320, 240)), "PNG"), max_side=512)
+    assert png.mime == "image/jpeg" and png.size_out == (320, 240)
+
+
+def test_prepare_image_rejects_non_images():
+    with pytest.raises(ValueError):
+        prepare_image(b"definitely not an image", max_side=512)
+
+
+def post_all(monkeypatch, requests):
+    transport, seen = recording_lm_studio()
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(transport))
+        monkeypatch.setattr(imgprocess_api, "vlm_cache", None)
+        monkeypatch.setattr(imgprocess_api, "VLM_MAX_SIDE", 512)
+        asgi = httpx.ASGITransport(app=imgprocess_api.app)
+        async with httpx.AsyncClient(transport=asgi, base_url="http://test") as http:
+            responses = [await http.post(url, **kwargs) for url, kwargs in requests]
+        await imgprocess_api.client.aclose()
+        return responses
+
+    return asyncio.run(run()), seen
+
+
+def test_binary_upload_is_downscaled_before_vlm(monkeypatch):
+    data = phone_photo()
+    (raw, legacy, full), seen = post_all(monkeypatch, [
+        ("/analyze-image", {"content": data, "headers": {"Content-Type": "image/jpeg"}}),
+        ("/analyze-image", {"json": {"image_base64": base64.b64encode(data).decode()}}),
+        ("/analyze-image?max_side=0", {"content": data, "headers": {"Content-Type": "application/octet-stream"}}),
+    ])
+    assert [r.status_code for r in (raw, legacy, full)] == [200, 200, 200]
+    assert raw.json() == legacy.json() == FEATURES
+    assert raw.headers["X-Image-Bytes-In"] == str(len(data))
+    assert int(raw.headers["X-Image-Bytes-Out"]) < len(data) and "X-VLM-Ms" in raw.headers
+    sizes = [Image.open(io.BytesIO(base64.b64decode(b64))).size for b64 in seen]
+    assert max(sizes[0]) <= 512 and sizes[0] == sizes[1]
+    assert sizes[2] == (1600, 2400)
+
+
+def test_bad_uploads_are_rejected(monkeypatch):
+    (garbage, unsupported, legacy_garbage), seen = post_all(monkeypatch, [
+        ("/analyze-image", {"content": b"not an image", "headers": {"Content-Type": "image/png"}}),
+        ("/analyze-image", {"content": b"hello", "headers": {"Content-Type": "text/plain"}}),
+        ("/analyze-image", {"json": {"image_base64": "AAAA"}}),  # 旧行为：无法解码时原样转发
+    ])
+    assert garbage.status_code == 400 and unsupported.status_code == 415
+    assert legacy_garbage.status_code == 200 and seen == ["AAAA"]
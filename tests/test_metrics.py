@@ -0,0 +1,189 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+import src.classifier_api as api
+import src.fused_app as fused_app
+import src.imgprocess_api as imgprocess_api
+import src.metrics as metrics
+from conftest import make_raw_rows
+from test_vlm_cache import encode, make_photo
+from test_vlm_client import fake_lm_studio, make_client
+
+
+def sample_value(text, name, **labels):
+    """从 Prometheus 文本中取出指定样本的值"""
+    selector = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    prefix = f"{name}{{{selector}}} " if labels else f"{name} "
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return None
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    hist = registry.histogram("test_seconds", "test", buckets=(0.1, 1.0), labelnames=("stage",))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        hist.observe(value, "a")
+    registry.counter("test_total", "test", ("result",)).inc(3, 'q"x')
+    text = registry.render()
+
+    assert "# TYPE test_seconds histogram" in text
+    assert sample_value(text, "test_seconds_bucket", stage="a", le="0.1") == 1
+    assert sample_value(text, "test_seconds_bucket", stage="a", le="1.0") == 3
+    assert sample_value(text, "test_seconds_bucket", stage="a", le="+Inf") == 4
+    assert sample_value(text, "test_seconds_count", stage="a") == 4
+    assert sample_value(text, "test_seconds_sum", stage="a") == 6.05
+    assert 'test_total{result="q\\"x"} 3' in text
+    # 同名指标只注册一次
+    assert registry.histogram("test_seconds", "other") is hist
+
+
+def test_predict_records_stages_and_counters(loaded_api, monkeypatch):
+    monkeypatch.setattr(api, "compiled_ensemble", None)
+    monkeypatch.setattr(api, "prediction_cache", None)
+    before = {stage: api.stages.histogram.count(stage) for stage in ("parse", "preprocess", "lgb", "xgb", "meta",
+                                                                      "response")}
+    rows_before = api.rows_scored.value()
+
+    client = TestClient(api.app)  # 不进入 lifespan：不加载磁盘上的模型，也不启动微批
+    assert client.post("/predict", json=make_raw_rows(5)).status_code == 200
+    text = client.get("/metrics").text
+
+    for stage, count in before.items():
+        assert api.stages.histogram.count(stage) == count + 1, stage
+    assert api.rows_scored.value() == rows_before + 5
+    assert sample_value(text, "classifier_stage_seconds_count", stage="lgb") == before["lgb"] + 1
+    assert sample_value(text, "http_requests_total", app="classifier", route="/predict", status="200") >= 1
+
+
+def test_prediction_cache_hits_are_counted(loaded_api, monkeypatch):
+    cache = api.PredictionCache(max_entries=100, numeric_positions=[0, 8, 9])
+    monkeypatch.setattr(api, "prediction_cache", cache)
+    rows = make_raw_rows(4)
+    hits, misses = api.cache_rows.value("hit"), api.cache_rows.value("miss")
+
+    api.score_payloads([rows])
+    api.score_payloads([rows[:2]])
+
+    assert api.cache_rows.value("miss") == misses + 4
+    assert api.cache_rows.value("hit") == hits + 2
+
+
+def test_sampled_request_writes_trace(loaded_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "MICRO_BATCH", False)
+    monkeypatch.setattr(api, "compiled_ensemble", None)
+    monkeypatch.setattr(api, "prediction_cache", None)
+    middleware = metrics.MetricsMiddleware(api.app, "classifier", sample_rate=1.0, profile_dir=str(tmp_path))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test") as http:
+            return await http.post("/predict", json=make_raw_rows(3))
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    base = tmp_path / response.headers["x-profile-id"]
+
+    events = json.loads((base.with_name(base.name + ".trace.json")).read_text())["traceEvents"]
+    names = [event["name"] for event in events]
+    assert names[0] == "POST /predict"
+    assert {"parse", "frame", "preprocess", "lgb", "xgb", "meta", "response"} <= set(names)
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+    folded = dict(line.rsplit(" ", 1) for line in base.with_name(base.name + ".folded").read_text().splitlines())
+    assert "POST /predict;lgb" in folded and "POST /predict" in folded
+    assert all(int(us) >= 0 for us in folded.values())
+
+
+def test_unsampled_request_has_no_trace(loaded_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "MICRO_BATCH", False)
+    middleware = metrics.MetricsMiddleware(api.app, "classifier", sample_rate=0.0, profile_dir=str(tmp_path))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test") as http:
+            return await http.post("/predict", json=make_raw_rows(1), headers={"X-Profile": "1"})
+
+    response = asyncio.run(run())
+    assert response.status_code == 200 and "x-profile-id" not in response.headers
+    assert not list(tmp_path.iterdir())
+
+
+def test_vlm_stages_and_failures(monkeypatch):
+    transport, _ = fake_lm_studio(delay=0.01)
+    image = encode(make_photo(), "JPEG")
+    before = {stage: imgprocess_api.stages.histogram.count(stage) for stage in ("read", "decode", "vlm", "extract")}
+    failures = imgprocess_api.vlm_failures.value("parse")
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(transport))
+        monkeypatch.setattr(imgprocess_api, "vlm_cache", None)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=imgprocess_api.app),
+                                     base_url="http://test") as http:
+            ok = await http.post("/analyze-image", content=image, headers={"Content-Type": "image/jpeg"})
+            monkeypatch.setattr(imgprocess_api, "VLM_STREAM", False)
+            monkeypatch.setattr(imgprocess_api.client, "chat", _broken_chat)
+            bad = await http.post("/analyze-image", content=image, headers={"Content-Type": "image/jpeg"})
+            text = (await http.get("/metrics")).text
+        await imgprocess_api.client.aclose()
+        return ok, bad, text
+
+    ok, bad, text = asyncio.run(run())
+    assert ok.status_code == 200 and bad.status_code == 500
+    assert imgprocess_api.stages.histogram.count("vlm") == before["vlm"] + 2
+    assert imgprocess_api.stages.histogram.count("read") == before["read"] + 2
+    assert imgprocess_api.stages.histogram.count("extract") >= before["extract"] + 1
+    assert imgprocess_api.vlm_failures.value("parse") == failures + 1
+    assert sample_value(text, "vlm_failures_total", reason="parse") == failures + 1
+
+
+async def _broken_chat(messages, **kwargs):
+    return '{"cap-shape": x}'
+
+
+async def _prose_chat(messages, **kwargs):
+    return "I cannot see a mushroom in this picture."
+
+
+def test_vlm_output_without_object_counts_as_parse_failure(monkeypatch):
+    # 模型完全没有输出 JSON 对象 (流式与非流式) 也记为 reason="parse"，而不是 "error"
+    transport, _ = fake_lm_studio(delay=0, content="I cannot see a mushroom in this picture.")
+    image = encode(make_photo(), "JPEG")
+    failures = {reason: imgprocess_api.vlm_failures.value(reason) for reason in ("parse", "error")}
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(transport))
+        monkeypatch.setattr(imgprocess_api, "vlm_cache", None)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=imgprocess_api.app),
+                                     base_url="http://test") as http:
+            monkeypatch.setattr(imgprocess_api, "VLM_STREAM", True)
+            streamed = await http.post("/analyze-image", content=image, headers={"Content-Type": "image/jpeg"})
+            monkeypatch.setattr(imgprocess_api, "VLM_STREAM", False)
+            monkeypatch.setattr(imgprocess_api.client, "chat", _prose_chat)
+            plain = await http.post("/analyze-image", content=image, headers={"Content-Type": "image/jpeg"})
+        await imgprocess_api.client.aclose()
+        return streamed, plain
+
+    streamed, plain = asyncio.run(run())
+    assert streamed.status_code == plain.status_code == 500
+    assert imgprocess_api.vlm_failures.value("parse") == failures["parse"] + 2
+    assert imgprocess_api.vlm_failures.value("error") == failures["error"]
+
+
+def test_fused_app_records_mounted_routes_once(loaded_api, monkeypatch):
+    monkeypatch.setattr(api, "MICRO_BATCH", False)
+    monkeypatch.setattr(fused_app.classifier_api, "load_models", lambda: None)
+    monkeypatch.setattr(imgprocess_api, "VLM_CACHE", False)
+    monkeypatch.setattr(imgprocess_api, "client", None)
+    key = ("fused", "/classifier/predict", "200")
+    before = metrics.http_requests.value(*key)
+    inner = metrics.http_requests.value("classifier", "/predict", "200")
+
+    with TestClient(fused_app.app) as client:
+        assert client.post("/classifier/predict", json=make_raw_rows(2)).status_code == 200
+        assert "classifier_stage_seconds_bucket" in client.get("/metrics").text
+
+    assert metrics.http_requests.value(*key) == before + 1
+    assert metrics.http_requests.value("classifier", "/predict", "200") == inner
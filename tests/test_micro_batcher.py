@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import httpx
+import numpy as np
+import pytest
+
+from src.micro_batcher import MicroBatcher, QueueFullError
+from conftest import make_raw_rows
+
+
+def test_concurrent_requests_are_coalesced():
+    seen = []
+
+    def batch_fn(payloads):
+        seen.append(len(payloads))
+        return [p * 10 for p in payloads]
+
+    async def run():
+        batcher = MicroBatcher(batch_fn, max_batch_rows=64, max_wait_ms=20)
+        await batcher.start()
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(40)])
+        stats = batcher.stats()
+        await batcher.stop()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+
+    assert results == [i * 10 for i in range(40)]
+    assert sum(seen) == 40 and len(seen) < 40
+    assert stats["requests"] == 40 and stats["batches"] == len(seen)
+
+
+def test_max_batch_rows_caps_batch_size():
+    seen = []
+
+    def batch_fn(payloads):
+        seen.append(len(payloads))
+        return payloads
+
+    async def run():
+        batcher = MicroBatcher(batch_fn, max_batch_rows=8, max_wait_ms=50)
+        await batcher.start()
+        await asyncio.gather(*[batcher.submit(i, rows=2) for i in range(20)])
+        await batcher.stop()
+
+    asyncio.run(run())
+    assert max(seen) <= 4
+
+
+def test_failing_payload_does_not_fail_the_batch():
+    def batch_fn(payloads):
+        if "bad" in payloads:
+            raise ValueError("bad payload")
+        return [p.upper() for p in payloads]
+
+    async def run():
+        batcher = MicroBatcher(batch_fn, max_wait_ms=20)
+        await batcher.start()
+        results = await asyncio.gather(*[batcher.submit(p) for p in ("a", "bad", "c")], return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    a, bad, c = asyncio.run(run())
+    assert (a, c) == ("A", "C")
+    assert isinstance(bad, ValueError)
+
+
+def test_full_queue_rejects_early():
+    gate = threading.Event()
+
+    def batch_fn(payloads):
+        gate.wait()
+        return payloads
+
+    async def run():
+        batcher = MicroBatcher(batch_fn, max_wait_ms=0, max_queue=1, workers=1)
+        await batcher.start()
+        # 第 1 个在执行中，第 2 个由收集协程持有并等待工作线程，第 3 个占满队列
+        accepted = []
+        for i in range(3):
+            accepted.append(asyncio.ensure_future(batcher.submit(i)))
+            await asyncio.sleep(0.02)
+        try:
+            with pytest.raises(QueueFullError):
+                await batcher.submit(99)
+        finally:
+            gate.set()
+        results = await asyncio.gather(*accepted)
+        stats = batcher.stats()
+        await batcher.stop()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    assert results == [0, 1, 2]
+    assert stats["rejected"] == 1
+
+
+def test_predict_endpoint_batches_concurrent_clients(loaded_api, monkeypatch):
+    rows = make_raw_rows(30, seed=3)
+    expected = loaded_api.score_payloads([rows])[0]
+    monkeypatch.setattr(loaded_api, "MICRO_BATCH_MAX_WAIT_MS", 20)
+
+    async def run():
+        await loaded_api.start_batcher()
+        transport = httpx.ASGITransport(app=loaded_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*[client.post("/predict", json=[row]) for row in rows])
+            stats = (await client.get("/stats/batcher")).json()
+        await loaded_api.stop_batcher()
+        return responses, stats
+
+    responses, stats = asyncio.run(run())
+
+    proba = [r.json()[0]["probability_poisonous"] for r in responses]
+    np.testing.assert_allclose(proba, expected[0])
+    assert stats["requests"] == 30 and stats["batches"] < 30
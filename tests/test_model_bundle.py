@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+import pytest
+
+import src.classifier_api as api
+from src.model_bundle import BundleError, ModelBundle, export_bundle
+from conftest import make_raw_rows, preprocess_with
+
+
+@pytest.fixture(scope="module")
+def bundle_dir(tiny_models, tmp_path_factory):
+    path = tmp_path_factory.mktemp("models") / "bundle"
+    export_bundle(**tiny_models, out_dir=str(path), feature_order=api.feature_order)
+    return path
+
+
+@pytest.fixture(scope="module")
+def features(tiny_models):
+    X = preprocess_with(tiny_models["label_encoders"], make_raw_rows(300, seed=41))
+    X.loc[X.index[::7], 'stem-width'] = np.nan
+    return X
+
+
+def test_native_formats_match_pickled_models(tiny_models, bundle_dir, features):
+    bundle = ModelBundle.load(str(bundle_dir))
+    assert not bundle.lgb.loaded and not bundle.xgb.loaded
+
+    for lazy, model in ((bundle.lgb, tiny_models["lgb_model"]), (bundle.xgb, tiny_models["xgb_model"])):
+        np.testing.assert_allclose(lazy.predict_proba(features), model.predict_proba(features), atol=1e-6)
+    meta = np.column_stack([tiny_models["lgb_model"].predict_proba(features)[:, 1],
+                            tiny_models["xgb_model"].predict_proba(features)[:, 1]])
+    np.testing.assert_allclose(bundle.meta_model.predict_proba(meta),
+                               tiny_models["meta_model"].predict_proba(meta), atol=1e-12)
+    np.testing.assert_array_equal(bundle.meta_model.predict(meta), tiny_models["meta_model"].predict(meta))
+    assert {"manifest", "verify", "vocabularies", "meta", "compiled", "lgb_booster", "xgb_booster"} <= set(bundle.timings)
+
+
+def test_checksum_mismatch_is_rejected(bundle_dir, tmp_path):
+    import shutil
+
+    copy = tmp_path / "bundle"
+    shutil.copytree(bundle_dir, copy)
+    vocab = json.loads((copy / "vocabularies.json").read_text())
+    vocab["cap-shape"].append("zz")
+    (copy / "vocabularies.json").write_text(json.dumps(vocab))
+
+    with pytest.raises(BundleError, match="vocabularies.json"):
+        ModelBundle.load(str(copy))
+    ModelBundle.load(str(copy), verify=False)
+
+
+def test_load_models_prefers_bundle(tiny_models, bundle_dir, features, monkeypatch):
+    for name in ("lgb_model", "xgb_model", "meta_model", "label_encoders", "feature_encoder",
+                 "compiled_ensemble", "model_load_report"):
+        monkeypatch.setattr(api, name, getattr(api, name))
+    monkeypatch.setenv("MODEL_DIR", str(bundle_dir.parent))
+    monkeypatch.setattr(api, "MODEL_PREFETCH", False)
+    monkeypatch.setattr(api, "INFERENCE_ENGINE", "auto")
+
+    api.load_models()
+    assert api.model_load_report["format"] == "bundle"
+    assert not api.lgb_model.loaded  # 小批量只用 mmap 的 compiled 引擎
+
+    rows = make_raw_rows(api.COMPILED_MAX_ROWS + 100, seed=42)
+    X = api.preprocess_data(rows)
+    np.testing.assert_array_equal(X.to_numpy(), preprocess_with(tiny_models["label_encoders"], rows).to_numpy())
+    proba, _ = api.run_ensemble(X)
+    assert api.lgb_model.loaded and api.xgb_model.loaded
+
+    meta = np.column_stack([tiny_models["lgb_model"].predict_proba(X)[:, 1],
+                            tiny_models["xgb_model"].predict_proba(X)[:, 1]])
+    np.testing.assert_allclose(proba, tiny_models["meta_model"].predict_proba(meta)[:, 1], atol=1e-6)
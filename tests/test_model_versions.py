@@ -0,0 +1,141 @@
+import json
+import threading
+
+import joblib
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from sklearn.linear_model import LogisticRegression
+
+import src.classifier_api as api
+import src.model_versions as model_versions
+from conftest import make_raw_rows, preprocess_with
+
+
+def write_models(path, models):
+    path.mkdir()
+    for name, model in models.items():
+        joblib.dump(model, path / f"{name}.pkl")
+    return path
+
+
+@pytest.fixture
+def versioned(tiny_models, tmp_path, monkeypatch):
+    """models/versions/{v1,v2}，CURRENT -> v1，并已加载 v1；v2 只换了元模型"""
+    for name in ("lgb_model", "xgb_model", "meta_model", "label_encoders", "feature_encoder", "compiled_ensemble",
+                 "cascade_band", "model_load_report", "model_version", "previous_models"):
+        monkeypatch.setattr(api, name, getattr(api, name))
+    monkeypatch.setattr(api, "prediction_cache", None)
+    monkeypatch.setattr(api, "MICRO_BATCH", False)
+    monkeypatch.setattr(api, "INFERENCE_ENGINE", "auto")
+    monkeypatch.setattr(api, "reload_history", api.collections.deque(maxlen=20))
+    base = tmp_path / "models"
+    monkeypatch.setenv("MODEL_DIR", str(base))
+
+    X = preprocess_with(tiny_models["label_encoders"], make_raw_rows(500, seed=5))
+    meta = np.column_stack([tiny_models["lgb_model"].predict_proba(X)[:, 1],
+                            tiny_models["xgb_model"].predict_proba(X)[:, 1]])
+    v2 = dict(tiny_models, meta_model=LogisticRegression(C=0.01).fit(meta, X["cap-shape"] % 2))
+
+    model_versions.publish(str(base), str(write_models(tmp_path / "v1", tiny_models)), "v1", activate=True,
+                           parity_rows=32)
+    model_versions.publish(str(base), str(write_models(tmp_path / "v2", v2)), "v2", parity_rows=32)
+    api.load_models()
+    return base
+
+
+def test_publish_and_resolve(versioned):
+    assert model_versions.resolve(str(versioned)) == (str(versioned / "versions" / "v1"), "v1")
+    assert [(v["name"], v["current"], v["parity"]) for v in model_versions.list_versions(str(versioned))] == [
+        ("v1", True, True), ("v2", False, True)]
+    parity = json.loads((versioned / "versions" / "v2" / "parity.json").read_text())
+    assert len(parity["rows"]) == len(parity["proba"]) == 32
+    assert api.model_version == "v1" and api.model_load_report["version"] == "v1"
+
+    with pytest.raises(FileExistsError):
+        model_versions.publish(str(versioned), str(versioned / "versions" / "v1"), "v1")
+    with pytest.raises(ValueError):
+        model_versions.version_dir(str(versioned), "../v1")
+    # 没有 CURRENT 时模型目录本身就是唯一版本
+    assert model_versions.resolve(str(versioned / "versions" / "v1")) == (str(versioned / "versions" / "v1"), None)
+
+
+def test_reload_swaps_and_rolls_back(versioned):
+    rows = make_raw_rows(20, seed=6)
+    before = api.score_payloads([rows])[0][0]
+    client = TestClient(api.app)  # 不进入 lifespan
+
+    response = client.post("/admin/models/reload", params={"version": "v2"})
+    assert response.status_code == 200
+    entry = response.json()
+    assert entry["result"] == "ok" and entry["swap_us"] >= 0
+    assert entry["parity"]["source"] == "parity.json" and entry["parity"]["rows"] == 32
+    assert all(diff <= api.PARITY_TOLERANCE for diff in entry["parity"]["max_abs_diff"].values())
+    assert set(entry["parity"]["max_abs_diff"]) == {"native", "compiled"}
+    assert api.model_version == "v2" and model_versions.read_current(str(versioned)) == "v2"
+    after = api.score_payloads([rows])[0][0]
+    assert not np.allclose(before, after)
+
+    response = client.post("/admin/models/rollback")
+    assert response.status_code == 200 and response.json()["version"] == "v1"
+    assert api.model_version == "v1" and model_versions.read_current(str(versioned)) == "v1"
+    np.testing.assert_allclose(api.score_payloads([rows])[0][0], before)
+
+    listing = client.get("/admin/models").json()
+    assert listing["version"] == "v1" and listing["previous"] == "v2"
+    assert [h["result"] for h in listing["history"]] == ["ok", "rollback"]
+
+
+def test_reload_rejects_failed_parity(versioned, monkeypatch):
+    parity_path = versioned / "versions" / "v2" / "parity.json"
+    parity = json.loads(parity_path.read_text())
+    parity["proba"][0] += 0.01
+    parity_path.write_text(json.dumps(parity))
+    rejected = api.model_reloads.value("rejected")
+    client = TestClient(api.app)
+
+    response = client.post("/admin/models/reload", params={"version": "v2"})
+    assert response.status_code == 409 and "deviates" in response.json()["detail"]
+    assert api.model_version == "v1" and model_versions.read_current(str(versioned)) == "v1"
+    assert api.model_reloads.value("rejected") == rejected + 1
+    assert client.post("/admin/models/reload", params={"version": "v3"}).status_code == 409
+
+    # 与当前版本的一致率门槛
+    monkeypatch.setattr(api, "MODEL_RELOAD_MIN_AGREEMENT", 1.01)
+    response = client.post("/admin/models/reload", params={"version": "v1"})
+    assert response.status_code == 409 and "agree" in response.json()["detail"]
+
+
+def test_admin_token(versioned, monkeypatch):
+    monkeypatch.setattr(api, "ADMIN_TOKEN", "s3cret")
+    client = TestClient(api.app)
+    assert client.get("/admin/models").status_code == 403
+    assert client.post("/admin/models/rollback", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/models", headers={"X-Admin-Token": "s3cret"}).status_code == 200
+
+
+def test_scoring_never_mixes_versions(versioned):
+    """交替换入两个版本的同时打分：每一批的结果都必须完整地来自其中一个版本"""
+    rows = make_raw_rows(api.COMPILED_MAX_ROWS + 10, seed=7)
+    v1 = api.current_models()
+    v2 = api.load_model_set(str(versioned / "versions" / "v2"), "v2")
+    expected = [api.score_payloads([rows])[0][0]]
+    api.install(v2)
+    expected.append(api.score_payloads([rows])[0][0])
+
+    stop = threading.Event()
+
+    def swap():
+        while not stop.is_set():
+            for models in (v1, v2):
+                api.install(models)
+
+    thread = threading.Thread(target=swap)
+    thread.start()
+    try:
+        for _ in range(50):
+            proba = api.score_payloads([rows])[0][0]
+            assert any(np.allclose(proba, e, atol=1e-6) for e in expected)
+    finally:
+        stop.set()
+        thread.join()
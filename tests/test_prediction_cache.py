@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from src.prediction_cache import PredictionCache
+from conftest import make_raw_rows
+
+
+@pytest.fixture
+def cached_api(loaded_api, monkeypatch):
+    cache = PredictionCache(max_entries=1000, numeric_positions=[0, 8, 9])
+    monkeypatch.setattr(loaded_api, "prediction_cache", cache)
+    monkeypatch.setattr(loaded_api, "INFERENCE_ENGINE", "native")
+    return loaded_api
+
+
+def test_batch_scores_only_misses_and_keeps_order(cached_api, monkeypatch):
+    api = cached_api
+    rows = make_raw_rows(50, seed=3)
+    X = api.preprocess_data(rows)
+    expected_proba, expected_pred = api.run_ensemble(X)
+
+    api.run_ensemble_cached(X.iloc[::2])  # 预热一半的行
+
+    scored = []
+    run_ensemble = api.run_ensemble
+    monkeypatch.setattr(api, "run_ensemble", lambda X, models=None: scored.append(len(X)) or run_ensemble(X, models))
+    # 批内重复行只推理一次
+    doubled = X.iloc[np.r_[np.arange(50), np.arange(1, 50, 2)]]
+    proba, pred = api.run_ensemble_cached(doubled)
+
+    assert scored == [25]
+    np.testing.assert_allclose(proba[:50], expected_proba)
+    np.testing.assert_array_equal(pred[:50], expected_pred)
+    np.testing.assert_allclose(proba[50:], expected_proba[1::2])
+    stats = api.prediction_cache.stats()
+    assert stats["hits"] == 25 and stats["misses"] == 25 + 50
+
+
+def test_lru_eviction():
+    cache = PredictionCache(max_entries=2)
+    X = np.arange(6, dtype=np.float64).reshape(3, 2)
+    keys = cache.keys(X)
+    cache.store(keys[:2], np.array([0.1, 0.2]), np.array([0, 0]))
+    cache.lookup(keys[:1])  # 第 0 行变为最近使用
+    cache.store(keys[2:], np.array([0.3]), np.array([1]))
+
+    _, _, missing = cache.lookup(keys)
+    np.testing.assert_array_equal(missing, [False, True, False])
+    assert cache.stats()["evictions"] == 1
+
+
+def test_rounding_and_nan_keys():
+    exact = PredictionCache(numeric_positions=[0])
+    rounded = PredictionCache(round_decimals=1, numeric_positions=[0])
+    X = np.array([[1.001, 2.0], [1.004, 2.0], [np.nan, -0.0], [-np.nan, 0.0]])
+
+    assert exact.keys(X)[0] != exact.keys(X)[1]
+    assert rounded.keys(X)[0] == rounded.keys(X)[1]
+    assert exact.keys(X)[2] == exact.keys(X)[3]
+
+
+def test_cache_invalidated_when_models_change(cached_api, tiny_models, monkeypatch):
+    api = cached_api
+    X = api.preprocess_data(make_raw_rows(10, seed=4))
+    api.run_ensemble_cached(X)
+    assert api.prediction_cache.stats()["entries"] == 10
+
+    # 换一个模型对象 (如重新加载) 后旧结果不可再命中
+    monkeypatch.setattr(api, "meta_model", type(tiny_models["meta_model"])().fit(
+        np.array([[0.0, 0.0], [1.0, 1.0]]), [1, 0]))
+    api.run_ensemble_cached(X)
+    stats = api.prediction_cache.stats()
+    assert stats["invalidations"] == 1 and stats["hits"] == 0
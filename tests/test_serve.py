@@ -0,0 +1,96 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import joblib
+import numpy as np
+import pytest
+
+import src.classifier_api as api
+from src.compiled_ensemble import CompiledEnsemble
+from conftest import make_raw_rows, preprocess_with
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+@pytest.fixture(scope="module")
+def shared_model_dir(tiny_models, tmp_path_factory):
+    """只含词表与 compiled 导出的模型目录 (多进程模式所需的全部状态)"""
+    model_dir = tmp_path_factory.mktemp("models")
+    joblib.dump(tiny_models["label_encoders"], model_dir / "label_encoders.pkl")
+    ensemble = CompiledEnsemble.from_models(
+        tiny_models["lgb_model"], tiny_models["xgb_model"], tiny_models["meta_model"]
+    )
+    ensemble.save(str(model_dir / "compiled"))
+    return model_dir
+
+
+def expected_proba(tiny_models, rows):
+    ensemble = CompiledEnsemble.from_models(
+        tiny_models["lgb_model"], tiny_models["xgb_model"], tiny_models["meta_model"]
+    )
+    X = preprocess_with(tiny_models["label_encoders"], rows)
+    return ensemble.predict(X.to_numpy(dtype=np.float64))[0]
+
+
+def test_shared_state_serves_without_native_models(tiny_models, shared_model_dir, monkeypatch):
+    for name in ("lgb_model", "xgb_model", "meta_model", "label_encoders", "feature_encoder",
+                 "compiled_ensemble", "shared_state_loaded"):
+        monkeypatch.setattr(api, name, None if name != "shared_state_loaded" else False)
+    monkeypatch.setattr(api, "INFERENCE_ENGINE", "auto")
+
+    api.load_shared_state(str(shared_model_dir))
+    assert api.shared_state_loaded
+    assert isinstance(api.compiled_ensemble.lgb.threshold, np.memmap)
+
+    # 超过 COMPILED_MAX_ROWS 的批量在没有原生模型时同样走 compiled 引擎
+    rows = make_raw_rows(api.COMPILED_MAX_ROWS + 50, seed=11)
+    proba, _ = api.run_ensemble(api.preprocess_data(rows))
+    np.testing.assert_allclose(proba, expected_proba(tiny_models, rows), atol=1e-12)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork 模式需要 os.fork")
+def test_supervisor_recycles_workers_and_shuts_down_gracefully(tiny_models, shared_model_dir):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join("src", "serve.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--model-dir", str(shared_model_dir), "--workers", "2",
+         "--max-requests", "3", "--max-requests-jitter", "0", "--graceful-timeout", "5"],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        env={**os.environ, "MICRO_BATCH": "0"},
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(url + "/", timeout=1)
+                break
+            except httpx.TransportError:
+                assert proc.poll() is None, proc.stdout.read()
+                assert time.monotonic() < deadline, "supervisor did not start"
+                time.sleep(0.2)
+
+        # 每个工作进程处理 3 个请求后被回收，12 个请求必然跨越多次重启
+        rows = make_raw_rows(12, seed=5)
+        expected = expected_proba(tiny_models, rows)
+        for i, row in enumerate(rows):
+            response = httpx.post(url + "/predict", json=[row], timeout=10)
+            assert response.status_code == 200
+            assert response.json()[0]["probability_poisonous"] == pytest.approx(expected[i], abs=1e-9)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        output = proc.communicate(timeout=30)[0]
+
+    assert proc.returncode == 0, output
+    assert "respawning" in output
@@ -0,0 +1,73 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import make_raw_rows
+
+
+@pytest.fixture
+def client(loaded_api, monkeypatch):
+    monkeypatch.setattr(loaded_api, "STREAM_CHUNK_ROWS", 7)
+    monkeypatch.setattr(loaded_api, "batcher", None)
+    return TestClient(loaded_api.app)
+
+
+def body_chunks(data: bytes, size: int = 50):
+    """按固定字节数切分请求体，行会被切断在块边界上"""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_ndjson_stream_matches_predict(client):
+    rows = make_raw_rows(30, seed=21)
+    expected = client.post("/predict", json=rows).json()
+    body = "\n".join(json.dumps(row) for row in rows).encode() + b"\n\n"
+
+    response = client.post("/predict/stream", content=body_chunks(body),
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    results = read_ndjson(response)
+    assert [r["id"] for r in results] == [r["id"] for r in expected]
+    np.testing.assert_allclose([r["probability_poisonous"] for r in results],
+                               [r["probability_poisonous"] for r in expected], atol=1e-12)
+
+
+def test_csv_stream_matches_predict(client):
+    rows = make_raw_rows(30, seed=22)
+    expected = client.post("/predict", json=rows).json()
+    buffer = io.StringIO()
+    pd.DataFrame(rows).to_csv(buffer, index=False, lineterminator="\r\n")
+
+    response = client.post("/predict/stream", content=body_chunks(buffer.getvalue().encode()),
+                           headers={"Content-Type": "text/csv"})
+
+    results = read_ndjson(response)
+    assert [r["id"] for r in results] == list(range(30))
+    assert [r["predicted_class"] for r in results] == [r["predicted_class"] for r in expected]
+    np.testing.assert_allclose([r["probability_poisonous"] for r in results],
+                               [r["probability_poisonous"] for r in expected], atol=1e-12)
+
+
+def test_stream_reports_invalid_line_after_scored_chunks(client):
+    rows = [json.dumps(row) for row in make_raw_rows(10, seed=23)]
+    rows[8] = "{not json"
+    response = client.post("/predict/stream", content="\n".join(rows).encode(),
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    results = read_ndjson(response)
+    assert len(results) == 8  # 第一块 7 行已写回
+    assert "line 9" in results[-1]["error"] and results[-1]["rows_scored"] == 7
+
+
+def test_stream_rejects_unknown_content_type(client):
+    response = client.post("/predict/stream", content=b"[]", headers={"Content-Type": "application/json"})
+    assert response.status_code == 415
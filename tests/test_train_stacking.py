@@ -0,0 +1,58 @@
+import joblib
+import numpy as np
+import pytest
+
+import src.train_stacking as trainer
+from src.data_prep import load_training_data
+from test_data_prep import write_csvs
+
+PARAMS = {
+    "lgb": {"n_estimators": 15, "num_leaves": 7, "objective": "binary", "device": "gpu", "verbosity": -1},
+    "xgb": {"n_estimators": 15, "max_depth": 3, "objective": "binary:logistic", "device": "cuda"},
+}
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    monkeypatch.setattr(trainer, "gpu_available", lambda kind: False)
+    train_path, test_path = write_csvs(tmp_path, n_train=400, n_test=100)
+    return load_training_data(train_path, test_path, cache_dir=str(tmp_path / "cache"))
+
+
+def test_gpu_params_fall_back_to_cpu(monkeypatch):
+    monkeypatch.setattr(trainer, "gpu_available", lambda kind: False)
+    assert trainer.resolve_device("lgb", PARAMS["lgb"])["device"] == "cpu"
+    assert trainer.resolve_device("xgb", PARAMS["xgb"])["device"] == "cpu"
+    with pytest.raises(RuntimeError):
+        trainer.resolve_device("lgb", PARAMS["lgb"], device="gpu")
+
+
+def test_sequential_training_writes_models_and_resumes(data, tmp_path):
+    model_dir, work_dir = tmp_path / "models", tmp_path / "work"
+    report = trainer.train(data, PARAMS, str(model_dir), str(work_dir), n_splits=3, workers=1, threads=1)
+    assert report["device"] == {"lgb": "cpu", "xgb": "cpu"} and report["jobs_run"] == 8
+    assert len(report["test_proba"]) == 100 and set(report["oof_mcc"]) == {"lgb", "xgb"}
+
+    lgb_model = joblib.load(model_dir / "lgb_model.pkl")
+    meta_model = joblib.load(model_dir / "meta_model.pkl")
+    encoders = joblib.load(model_dir / "label_encoders.pkl")
+    assert list(lgb_model.feature_name_) == [c for c in data.X_train.columns]
+    assert meta_model.coef_.shape == (1, 2)
+    with np.load(work_dir / "oof.npz") as oof:
+        assert len(oof["lgb"]) == len(oof["xgb"]) == len(oof["y"]) == 400
+    assert list(encoders["cap-shape"].classes_) == data.vocabularies["cap-shape"]
+
+    # 删除一折的结果后重新运行：只训练缺失的那一折，元模型结果不变
+    next(work_dir.glob("xgb-*/fold1.npz")).unlink()
+    resumed = trainer.train(data, PARAMS, str(model_dir), str(work_dir), n_splits=3, workers=1, threads=1)
+    assert resumed["jobs_run"] == 1 and resumed["jobs_resumed"] == 7
+    assert list(resumed["job_seconds"]) == ["xgb/fold1"]
+    np.testing.assert_allclose(resumed["test_proba"], report["test_proba"])
+
+
+def test_process_pool_matches_sequential(data, tmp_path):
+    sequential = trainer.train(data, PARAMS, None, str(tmp_path / "seq"), n_splits=3, workers=1, threads=1)
+    parallel = trainer.train(data, PARAMS, None, str(tmp_path / "par"), n_splits=3, workers=2, threads=2)
+    assert parallel["workers"] == 2 and parallel["threads_per_job"] == 1
+    assert parallel["oof_mcc"] == sequential["oof_mcc"]
+    np.testing.assert_allclose(parallel["test_proba"], sequential["test_proba"])
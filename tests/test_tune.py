@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+optuna = pytest.importorskip("optuna")
+
+import src.train_stacking as train_stacking  # noqa: E402
+import src.tune as tune  # noqa: E402
+from src.data_prep import load_training_data  # noqa: E402
+from test_data_prep import write_csvs  # noqa: E402
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_stacking, "gpu_available", lambda kind: False)
+    train_path, _ = write_csvs(tmp_path, n_train=600, n_test=10)
+    return load_training_data(train_path, None, cache_dir=str(tmp_path / "cache"))
+
+
+@pytest.mark.parametrize("kind", ["lgb", "xgb"])
+def test_study_persists_and_resumes(kind, data, tmp_path):
+    storage = f"sqlite:///{tmp_path / 'optuna.sqlite3'}"
+    kwargs = dict(storage=storage, work_dir=str(tmp_path / "work"), max_rounds=40, early_stopping=10)
+    study = tune.tune(kind, data, n_trials=3, **kwargs)
+    assert len(study.trials) == 3
+    params = [t.params for t in study.trials]
+    assert all(0 < t.user_attrs["best_iteration"] <= 40 for t in study.trials
+               if t.state == optuna.trial.TrialState.COMPLETE)
+
+    # 同一个 study 继续运行到 5 个试验，已完成的不会重跑
+    resumed = tune.tune(kind, data, n_trials=5, **kwargs)
+    assert len(resumed.trials) == 5
+    assert [t.params for t in resumed.trials[:3]] == params
+
+    report = tune.progress(resumed)
+    assert sum(report["trials"].values()) == 5 and report["best_over_time"]
+    params = tune.best_params(kind, resumed, {"device": "gpu" if kind == "lgb" else "cuda"})
+    assert params["n_estimators"] == resumed.best_trial.user_attrs["best_iteration"]
+    json.dumps(params)
+
+
+class PruneAfter:
+    """只记录中间值的 trial：第 limit 轮之后要求剪枝"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.reports = []
+
+    def report(self, value, step):
+        self.reports.append((step, value))
+
+    def should_prune(self):
+        return self.reports[-1][0] >= self.limit
+
+
+@pytest.mark.parametrize("kind", ["lgb", "xgb"])
+def test_pruning_callbacks_stop_training(kind, data):
+    X, y = data.X_train, data.y
+    trial = PruneAfter(limit=20)
+    with pytest.raises(optuna.TrialPruned):
+        if kind == "lgb":
+            model = train_stacking.make_model("lgb", {"n_estimators": 100, "verbosity": -1}, 1)
+            model.fit(X, y, eval_set=[(X, y)], callbacks=[tune.lgb_pruning_callback(trial)])
+        else:
+            model = train_stacking.make_model("xgb", {"n_estimators": 100,
+                                                      "callbacks": [tune.xgb_pruning_callback(trial)]}, 1)
+            model.fit(X, y, eval_set=[(X, y)], verbose=False)
+    # 每 REPORT_EVERY 轮报告一次 -logloss
+    assert [step for step, _ in trial.reports] == [10, 20]
+    assert all(value < 0 for _, value in trial.reports)
@@ -0,0 +1,105 @@
+import asyncio
+import base64
+import io
+
+import httpx
+import numpy as np
+from PIL import Image
+
+import src.imgprocess_api as imgprocess_api
+from src.vlm_cache import VLMCache, image_fingerprint, version_key
+from test_vlm_client import FEATURES, fake_lm_studio, make_client
+
+
+def make_photo(size=(96, 64), seed=0) -> Image.Image:
+    """平滑渐变 + 少量噪声的合成 "照片"，缩放后 dHash 基本不变"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    x, y = np.meshgrid(np.linspace(0, 1, w), np.linspace(0, 1, h))
+    base = np.stack([x * 255, y * 255, (1 - x) * 200 + rng.integers(0, 30)], axis=-1)
+    base += rng.normal(0, 3, base.shape)
+    return Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+
+
+def encode(img: Image.Image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def test_same_pixels_in_different_containers_hit_exactly(tmp_path):
+    img = make_photo()
+    png, bmp = image_fingerprint(encode(img, "PNG")), image_fingerprint(encode(img, "BMP"))
+    assert png == bmp
+
+    cache = VLMCache(str(tmp_path / "c.sqlite3"), version="v1")
+    assert cache.get(*png) == (None, "miss")
+    cache.put(png[0], FEATURES, png[1])
+    assert cache.get(*bmp) == (FEATURES, "exact")
+    # 提示词 / 模型版本变化后旧结果不再命中
+    assert VLMCache(str(tmp_path / "c.sqlite3"), version="v2").get(*png) == (None, "miss")
+    stats = cache.stats()
+    assert stats["exact_hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
+
+
+def test_resized_copy_is_a_near_hit(tmp_path):
+    img = make_photo((192, 128))
+    original = image_fingerprint(encode(img, "PNG"))
+    resized = image_fingerprint(encode(img.resize((180, 120)), "JPEG"))
+    assert original[0] != resized[0]
+
+    strict = VLMCache(str(tmp_path / "strict.sqlite3"), version="v1")
+    strict.put(original[0], FEATURES, original[1])
+    assert strict.get(*resized)[1] == "miss"
+
+    near = VLMCache(str(tmp_path / "near.sqlite3"), version="v1", near_duplicate_distance=6)
+    near.put(original[0], FEATURES, original[1])
+    assert near.get(*resized) == (FEATURES, "near")
+    # 重新打开后从数据库恢复 dHash 索引
+    reopened = VLMCache(str(tmp_path / "near.sqlite3"), version="v1", near_duplicate_distance=6)
+    assert reopened.get(*resized)[1] == "near"
+    # 完全不同的图片不会误命中
+    other = image_fingerprint(encode(make_photo((192, 128)).transpose(Image.Transpose.ROTATE_180), "PNG"))
+    assert near.get(*other)[1] == "miss"
+
+
+def test_ttl_and_size_eviction(tmp_path):
+    cache = VLMCache(str(tmp_path / "c.sqlite3"), version="v1", max_entries=3, ttl_seconds=3600)
+    for i in range(5):
+        cache.put(f"img-{i}", {"i": i})
+    cache.get("img-0")  # 最近访问过的条目在 LRU 淘汰中保留
+    cache.evict()
+    assert cache.stats()["entries"] == 3 and cache.evictions == 2
+    assert cache.get("img-0")[1] == "exact" and cache.get("img-1")[1] == "miss"
+
+    cache.ttl = -1  # 所有条目都已过期
+    assert cache.get("img-0")[1] == "miss"
+    cache.evict()
+    assert cache.stats()["entries"] == 0
+
+
+def test_version_key_changes_with_any_part():
+    assert version_key("prompt", "model", 800) == version_key("prompt", "model", 800)
+    assert version_key("prompt", "model", 800) != version_key("prompt!", "model", 800)
+
+
+def test_endpoint_calls_vlm_once_per_image(monkeypatch, tmp_path):
+    transport, state = fake_lm_studio(delay=0.01)
+    img = make_photo()
+    uploads = [base64.b64encode(encode(img, fmt)).decode() for fmt in ("PNG", "BMP", "PNG")]
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(transport))
+        monkeypatch.setattr(imgprocess_api, "vlm_cache", VLMCache(str(tmp_path / "c.sqlite3"), version="v1"))
+        asgi = httpx.ASGITransport(app=imgprocess_api.app)
+        async with httpx.AsyncClient(transport=asgi, base_url="http://test") as http:
+            responses = [await http.post("/analyze-image", json={"image_base64": b64}) for b64 in uploads]
+            stats = (await http.get("/stats/vlm-cache")).json()
+        await imgprocess_api.client.aclose()
+        return responses, stats
+
+    responses, stats = asyncio.run(run())
+    assert [r.json() for r in responses] == [FEATURES] * 3
+    assert [r.headers["X-VLM-Cache"] for r in responses] == ["miss", "exact", "exact"]
+    assert state["calls"] == 1
+    assert stats["enabled"] and stats["entries"] == 1 and stats["exact_hits"] == 2
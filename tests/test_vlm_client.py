@@ -0,0 +1,152 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import src.imgprocess_api as imgprocess_api
+from src.vlm_client import VLMBusyError, VLMClient, VLMTimeoutError
+
+# 与提示词示例一致的完整 20 个字段
+FEATURES = {
+    "cap-diameter": 5.0, "cap-shape": "x", "cap-surface": "s", "cap-color": "n", "does-bruise-or-bleed": "f",
+    "gill-attachment": "f", "gill-spacing": None, "gill-color": "n", "stem-height": 10.0, "stem-width": 15.0,
+    "stem-root": None, "stem-surface": "s", "stem-color": "b", "veil-type": None, "veil-color": "w",
+    "has-ring": "t", "ring-type": "l", "spore-print-color": "n", "habitat": "d", "season": "a",
+}
+
+
+def sse_chunk(text, finish_reason=None):
+    return ("data: " + json.dumps({
+        "id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "local-model",
+        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": finish_reason}],
+    }) + "\n\n").encode()
+
+
+def fake_lm_studio(delay=0.05, content=None, trailing="", token_delay=0.0):
+    """
+    模拟 LM Studio 的 /chat/completions：每次调用耗时 delay 秒，并记录最大并发数。
+    stream=true 时按 4 个字符一块以 SSE 返回 content 与其后的 trailing 文本 (最后一块带 finish_reason)，
+    记录实际发出的块数
+    """
+    state = {"active": 0, "peak": 0, "calls": 0, "chunks_sent": 0, "chunks_total": 0}
+
+    async def handler(request):
+        state["active"] += 1
+        state["calls"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state["active"] -= 1
+        text = content if content is not None else "```json\n" + json.dumps(FEATURES) + "\n```"
+        if json.loads(request.content).get("stream"):
+            full = text + trailing
+            pieces = [full[i:i + 4] for i in range(0, len(full), 4)]
+            state["chunks_total"] += len(pieces)
+
+            async def events():
+                for i, piece in enumerate(pieces):
+                    if token_delay:
+                        await asyncio.sleep(token_delay)
+                    state["chunks_sent"] += 1
+                    yield sse_chunk(piece, "stop" if i == len(pieces) - 1 else None)
+                yield b"data: [DONE]\n\n"
+
+            return httpx.Response(200, content=events(), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "local-model",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+        })
+
+    return httpx.MockTransport(handler), state
+
+
+def make_client(transport, **kwargs):
+    return VLMClient(base_url="http://lm-studio.test/v1", transport=transport, **kwargs)
+
+
+def test_concurrency_is_capped():
+    transport, state = fake_lm_studio(delay=0.05)
+
+    async def run():
+        client = make_client(transport, max_concurrency=2, max_queue=10)
+        results = await asyncio.gather(*[client.chat([{"role": "user", "content": "hi"}]) for _ in range(6)])
+        stats = client.stats()
+        await client.aclose()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    assert len(results) == 6 and state["peak"] == 2
+    assert stats["completed"] == 6 and stats["avg_queue_wait_ms"] > 0
+
+
+def test_full_queue_rejects_early():
+    transport, state = fake_lm_studio(delay=0.2)
+
+    async def run():
+        client = make_client(transport, max_concurrency=1, max_queue=1)
+        results = await asyncio.gather(*[client.chat([]) for _ in range(3)], return_exceptions=True)
+        await client.aclose()
+        return results, client.stats()
+
+    results, stats = asyncio.run(run())
+    assert sum(isinstance(r, VLMBusyError) for r in results) == 1
+    assert state["calls"] == 2 and stats["rejected"] == 1
+
+
+def test_timeout_releases_the_slot():
+    transport, _ = fake_lm_studio(delay=0.5)
+
+    async def run():
+        client = make_client(transport, max_concurrency=1, timeout=0.05)
+        with pytest.raises(VLMTimeoutError):
+            await client.chat([])
+        client.timeout = 5
+        content = await client.chat([])
+        await client.aclose()
+        return content, client.stats()
+
+    content, stats = asyncio.run(run())
+    assert "cap-shape" in content and stats["timeouts"] == 1 and stats["in_flight"] == 0
+
+
+def test_health_check_answers_while_vlm_call_in_flight(monkeypatch):
+    transport, _ = fake_lm_studio(delay=0.3)
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(transport, max_concurrency=1))
+        asgi = httpx.ASGITransport(app=imgprocess_api.app)
+        async with httpx.AsyncClient(transport=asgi, base_url="http://test") as http:
+            analyze = asyncio.create_task(http.post("/analyze-image", json={"image_base64": "AAAA"}))
+            await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            health = await http.get("/")
+            health_latency = time.perf_counter() - started
+            response = await analyze
+        await imgprocess_api.client.aclose()
+        return health, health_latency, response
+
+    health, health_latency, response = asyncio.run(run())
+    assert health.status_code == 200 and health.json()["vlm"]["in_flight"] == 1
+    assert health_latency < 0.2
+    assert response.json() == FEATURES
+
+
+def test_analyze_image_maps_busy_to_503(monkeypatch):
+    transport, _ = fake_lm_studio(delay=0.2)
+
+    async def run():
+        monkeypatch.setattr(imgprocess_api, "client", make_client(transport, max_concurrency=1, max_queue=0))
+        asgi = httpx.ASGITransport(app=imgprocess_api.app)
+        async with httpx.AsyncClient(transport=asgi, base_url="http://test") as http:
+            responses = await asyncio.gather(
+                *[http.post("/analyze-image", json={"image_base64": "AAAA"}) for _ in range(2)]
+            )
+        await imgprocess_api.client.aclose()
+        return responses
+
+    codes = sorted(r.status_code for r in asyncio.run(run()))
+    assert codes == [200, 503]
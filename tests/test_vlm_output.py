@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+import src.imgprocess_api as imgprocess_api
+from src.vlm_output import JSONObjectScanner, loads_object, schema_from_prompt, validate_features
+from test_vlm_client import FEATURES, fake_lm_studio, make_client
+
+TRAILING = "\n\n说明：菌盖呈凸面，表面光滑，{以上为推测}。" * 20
+
+
+def feed_all(scanner, text, size):
+    for i in range(0, len(text), size):
+        obj = scanner.feed(text[i:i + size])
+        if obj is not None:
+            return obj, i + size
+    return None, len(text)
+
+
+@pytest.mark.parametrize("size", [1, 3, 64])
+def test_scanner_finds_object_regardless_of_chunking(size):
+    obj = {"a": "brace } in { string", "b": 'escaped " quote \\ {', "nested": {"c": [1, {"d": None}]}}
+    text = "Sure! Here you go:\n```json\n" + json.dumps(obj) + "\n```" + TRAILING
+    found, consumed = feed_all(JSONObjectScanner(), text, size)
+    assert json.loads(found) == obj
+    assert consumed < len(text) - len(TRAILING) + size + 4  # 对象一闭合就停下，不读后面的说明
+
+
+def test_scanner_skips_unparseable_prose_braces():
+    scanner = JSONObjectScanner()
+    assert scanner.feed("The {best} guess is ") == "{best}"
+    with pytest.raises(ValueError):
+        loads_object("{best}")
+    assert loads_object(scanner.feed('{"cap-shape": None}')) == {"cap-shape": None}
+
+
+def test_schema_is_parsed_from_prompt_table():
+    schema = imgprocess_api.FEATURE_SCHEMA
+    assert len(schema) == 20 and set(schema) == set(FEATURES)
+    assert schema["cap-diameter"] is None and schema["stem-width"] is None
+    assert schema["season"] == {"a", "s", "u", "w"} and "?" in schema["stem-root"]
+    assert schema_from_prompt("no table here") == {}
+
+
+def test_validate_features_normalises_vlm_output():
+    raw = {"cap-diameter": "6.5", "cap-shape": "z", "stem-height": "tall", "season": "a", "mood": "happy"}
+    clean, issues = validate_features(raw, imgprocess_api.FEATURE_SCHEMA)
+    assert list(clean) == list(imgprocess_api.FEATURE_SCHEMA)
+    assert clean["cap-diameter"] == 6.5 and clean["season"] == "a"
+    assert clean["cap-shape"] is None and clean["stem-height"] is None and clean["habitat"] is None
+    assert "unknown field mood" in issues and any(i.startswith("cap-shape") for i in issues)
+    assert validate_features(FEATURES, imgprocess_api.FEATURE_SCHEMA) == (FEATURES, [])
+
+
+def test_stream_is_cancelled_once_object_closes():
+    transport, state = fake_lm_studio(delay=0, trailing=TRAILING, token_delay=0.002)
+
+    async def run():
+        client = make_client(transport)
+        result, stats = await client.chat_json([{"role": "user", "content": "hi"}])
+        await asyncio.sleep(0.05)  # 关闭后服务端不再继续发送
+        await client.aclose()
+        return result, stats, client.stats()
+
+    result, stats, client_stats = asyncio.run(run())
+    assert result == FEATURES and stats["early_stop"]
+    assert state["chunks_sent"] < state["chunks_total"] / 2
+    assert stats["chunks"] <= state["chunks_sent"] and stats["time_to_result_ms"] >= stats["first_token_ms"] > 0
+    assert client_stats["stream"]["early_stops"] == 1 and client_stats["in_flight"] == 0
+
+
+def test_stream_ending_with_object_is_not_an_early_stop():
+    # 对象在带 finish_reason 的最后一块闭合：生成已经结束，没有被截断
+    transport, state = fake_lm_studio(delay=0, content=json.dumps(FEATURES))
+
+    async def run():
+        client = make_client(transport)
+        try:
+            return await client.chat_json([{"role": "user", "content": "hi"}]), client.stats()
+        finally:
+            await client.aclose()
+
+    (result, stats), client_stats = asyncio.run(run())
+    assert result == FEATURES and not stats["early_stop"]
+    assert stats["chunks"] == state["chunks_total"] and client_stats["stream"]["early_stops"] == 0
+
+
+def test_stream_without_object_raises():
+    transport, _ = fake_lm_studio(delay=0, content="I cannot see a mushroom in this picture.")
+
+    async def run():
+        client = make_client(transport)
+        try:
+            with pytest.raises(ValueError):
+                await client.chat_json([])
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())